@@ -0,0 +1,25 @@
+"""Python binding for libexword
+
+    import libexword
+    with libexword.Session() as s:
+        for e in s.list():
+            print(e.name)
+"""
+from ._native import (available, SD_CARD, INTERNAL_MEM, ROOT,
+                      LIST_F_DIR, LIST_F_UNICODE,
+                      LOCALE_JA, LOCALE_KR, LOCALE_CN, LOCALE_DE, LOCALE_ES, LOCALE_FR, LOCALE_RU,
+                      OPEN_LIBRARY, OPEN_TEXT, OPEN_CD,
+                      CAP_SW, CAP_P, CAP_F, CAP_C, CAP_EXT)
+from .session import (Session, ExwordError, DirEntry, Model, Capacity,
+                      join_path, response_to_string)
+from .cache import DirCache
+from .worker import DeviceWorker, Job, Cancelled
+from .manager import SessionManager
+from .devices import DeviceInfo, DeviceWatcher, list_devices, ARRIVED, LEFT
+from .stats import TraceEntry, Histogram, TraceLog, export_chrome
+from .manifest import Manifest, ManifestStore, device_key
+from .library import Library, Pack
+from .batch import Batch, BatchResult
+from .listing import Listing
+from .sched import PriorityLock, INTERACTIVE, NORMAL, BULK
+from .progress import Progress, Meter
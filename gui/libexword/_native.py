@@ -0,0 +1,271 @@
+"""ctypes declarations for libexword
+
+The shared library is looked up in this order:
+  1. the LIBEXWORD_LIBRARY environment variable (full path)
+  2. the system library path (ctypes.util.find_library)
+  3. an in-tree libtool build (src/.libs)
+"""
+import ctypes
+import ctypes.util
+import locale
+import os
+import threading
+
+# exword.h
+SD_CARD = '\\_SD_00'
+INTERNAL_MEM = '\\_INTERNAL_00'
+ROOT = ''
+
+LIST_F_DIR = 1
+LIST_F_UNICODE = 2
+
+LOCALE_JA = 0x20
+LOCALE_KR = 0x40
+LOCALE_CN = 0x60
+LOCALE_DE = 0x80
+LOCALE_ES = 0xa0
+LOCALE_FR = 0xc0
+LOCALE_RU = 0xe0
+
+OPEN_LIBRARY = 0x0000
+OPEN_TEXT = 0x0100
+OPEN_CD = 0x0200
+
+CAP_SW = 1 << 0
+CAP_P = 1 << 1
+CAP_F = 1 << 2
+CAP_C = 1 << 3
+CAP_EXT = 1 << 15
+
+RSP_SUCCESS = 0x20
+
+# obex.h
+OBEX_DEFAULT_MTU = 4096
+OBEX_MAXIMUM_MTU = 65535
+
+
+class exword_dirent_t(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('size', ctypes.c_uint16),
+                ('flags', ctypes.c_uint8),
+                ('name', ctypes.POINTER(ctypes.c_uint8))]
+
+
+class exword_listent_t(ctypes.Structure):
+    _fields_ = [('offset', ctypes.c_uint32),
+                ('length', ctypes.c_uint16),
+                ('flags', ctypes.c_uint8),
+                ('reserved', ctypes.c_uint8)]
+
+
+class exword_listing_t(ctypes.Structure):
+    _fields_ = [('count', ctypes.c_uint32),
+                ('names_size', ctypes.c_uint32),
+                ('entries', ctypes.POINTER(exword_listent_t)),
+                ('names', ctypes.c_void_p)]
+
+
+class exword_capacity_t(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('total', ctypes.c_uint32),
+                ('free', ctypes.c_uint32)]
+
+
+class exword_model_t(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('model', ctypes.c_char * 15),
+                ('sub_model', ctypes.c_char * 6),
+                ('ext_model', ctypes.c_char * 6),
+                ('capabilities', ctypes.c_short)]
+
+
+class exword_cryptkey_t(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('blk1', ctypes.c_ubyte * 16),
+                ('blk2', ctypes.c_ubyte * 12),
+                ('key', ctypes.c_ubyte * 12)]
+
+
+class exword_device_info_t(ctypes.Structure):
+    _fields_ = [('index', ctypes.c_int),
+                ('bus', ctypes.c_uint8),
+                ('address', ctypes.c_uint8),
+                ('port_count', ctypes.c_uint8),
+                ('ports', ctypes.c_uint8 * 7)]
+
+
+EXWORD_DEVICE_ARRIVED = 1
+EXWORD_DEVICE_LEFT = 2
+
+# EXWORD_STAT_* in enum order
+STAT_COMMANDS = ('connect', 'disconnect', 'send_file', 'get_file', 'remove_file',
+                 'sd_format', 'setpath', 'model', 'capacity', 'list', 'userid',
+                 'cryptkey', 'cname', 'unlock', 'lock', 'authchallenge', 'authinfo')
+EXWORD_HIST_BUCKETS = 32
+OBEX_TRACE_SIZE = 256
+
+
+class exword_stats_t(ctypes.Structure):
+    _fields_ = [('count', ctypes.c_uint32),
+                ('errors', ctypes.c_uint32),
+                ('total_us', ctypes.c_uint64),
+                ('max_us', ctypes.c_uint32),
+                ('buckets', ctypes.c_uint32 * EXWORD_HIST_BUCKETS)]
+
+
+class exword_trace_t(ctypes.Structure):
+    _fields_ = [('start_us', ctypes.c_int64),
+                ('id', ctypes.c_uint32),
+                ('command', ctypes.c_uint8),
+                ('opcode', ctypes.c_uint8),
+                ('mtu', ctypes.c_uint16),
+                ('rsp', ctypes.c_int),
+                ('packets', ctypes.c_uint16),
+                ('retries', ctypes.c_uint16),
+                ('tx_bytes', ctypes.c_uint32),
+                ('rx_bytes', ctypes.c_uint32),
+                ('write_us', ctypes.c_uint32),
+                ('seq_us', ctypes.c_uint32),
+                ('read_us', ctypes.c_uint32),
+                ('total_us', ctypes.c_uint32)]
+
+hotplug_cb = ctypes.CFUNCTYPE(None, ctypes.c_int, ctypes.POINTER(exword_device_info_t),
+                              ctypes.c_void_p)
+
+file_cb = ctypes.CFUNCTYPE(None, ctypes.c_char_p, ctypes.c_uint32,
+                           ctypes.c_uint32, ctypes.c_void_p)
+
+# buffer is passed as a plain pointer so callbacks can wrap it without a copy
+stream_read_cb = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+stream_write_cb = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+
+# bulk transport for exword_open_transport(): (data, len, actual, timeout, user_data)
+bulk_cb = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                           ctypes.c_uint, ctypes.c_void_p)
+
+LIBUSB_ERROR_IO = -1
+LIBUSB_ERROR_NO_DEVICE = -4
+LIBUSB_ERROR_TIMEOUT = -7
+LIBUSB_ERROR_INTERRUPTED = -10
+
+_handle = ctypes.c_void_p
+_buffer = ctypes.POINTER(ctypes.c_char)
+
+_PROTOTYPES = {
+    'exword_open2': (_handle, [ctypes.c_uint16]),
+    'exword_open_index': (_handle, [ctypes.c_uint16, ctypes.c_int]),
+    'exword_open_transport': (_handle, [ctypes.c_uint16, bulk_cb, bulk_cb, ctypes.c_void_p]),
+    'exword_close': (None, [_handle]),
+    'exword_list_devices': (ctypes.c_int, [ctypes.POINTER(exword_device_info_t), ctypes.c_int]),
+    'exword_hotplug_register': (ctypes.c_void_p, [hotplug_cb, ctypes.c_void_p]),
+    'exword_hotplug_handle_events': (ctypes.c_int, [ctypes.c_void_p, ctypes.c_int]),
+    'exword_hotplug_stop': (None, [ctypes.c_void_p]),
+    'exword_hotplug_free': (None, [ctypes.c_void_p]),
+    'exword_connect': (ctypes.c_int, [_handle]),
+    'exword_disconnect': (ctypes.c_int, [_handle]),
+    'exword_set_debug': (None, [_handle, ctypes.c_int]),
+    'exword_set_max_mtu': (None, [_handle, ctypes.c_uint16]),
+    'exword_get_mtu': (ctypes.c_uint16, [_handle]),
+    'exword_set_pipeline': (ctypes.c_int, [_handle, ctypes.c_int]),
+    'exword_set_timeouts': (None, [_handle, ctypes.c_uint, ctypes.c_uint, ctypes.c_uint]),
+    'exword_get_rtt': (ctypes.c_uint, [_handle]),
+    'exword_abort': (None, [_handle]),
+    'exword_set_trace': (ctypes.c_int, [_handle, ctypes.c_int]),
+    'exword_get_trace': (ctypes.c_int, [_handle, ctypes.POINTER(exword_trace_t), ctypes.c_int,
+                                        ctypes.c_uint32]),
+    'exword_get_stats': (None, [_handle, ctypes.POINTER(exword_stats_t), ctypes.c_int]),
+    'exword_reset_stats': (None, [_handle]),
+    'exword_register_callbacks': (None, [_handle, file_cb, file_cb, ctypes.c_void_p]),
+    'exword_set_callback_interval': (None, [_handle, ctypes.c_uint]),
+    'exword_send_file': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]),
+    'exword_get_file': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.POINTER(_buffer),
+                                       ctypes.POINTER(ctypes.c_int)]),
+    'exword_send_file_stream': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_int,
+                                               stream_read_cb, ctypes.c_void_p]),
+    'exword_get_file_stream': (ctypes.c_int, [_handle, ctypes.c_char_p, stream_write_cb,
+                                              ctypes.c_void_p]),
+    'exword_free_buffer': (None, [_buffer]),
+    'exword_remove_file': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_int]),
+    'exword_get_model': (ctypes.c_int, [_handle, ctypes.POINTER(exword_model_t)]),
+    'exword_get_capacity': (ctypes.c_int, [_handle, ctypes.POINTER(exword_capacity_t)]),
+    'exword_sd_format': (ctypes.c_int, [_handle]),
+    'exword_setpath': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_uint8]),
+    'exword_list': (ctypes.c_int, [_handle, ctypes.POINTER(ctypes.POINTER(exword_dirent_t)),
+                                   ctypes.POINTER(ctypes.c_uint16)]),
+    'exword_free_list': (None, [ctypes.POINTER(exword_dirent_t)]),
+    'exword_list_arena': (ctypes.c_int, [_handle, ctypes.POINTER(ctypes.POINTER(exword_listing_t))]),
+    'exword_unlock': (ctypes.c_int, [_handle]),
+    'exword_lock': (ctypes.c_int, [_handle]),
+    'exword_cname': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_char_p]),
+    'exword_cryptkey': (ctypes.c_int, [_handle, ctypes.POINTER(exword_cryptkey_t)]),
+    'exword_response_to_string': (ctypes.c_char_p, [ctypes.c_int]),
+    # dict.h
+    'dict_list': (ctypes.c_int, [_handle, ctypes.c_char_p]),
+    'dict_remove': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_char_p]),
+    'dict_decrypt': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_char_p]),
+    'dict_install': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_char_p]),
+    'dict_auth': (ctypes.c_int, [_handle, ctypes.c_char_p, ctypes.c_char_p]),
+    'dict_reset': (ctypes.c_int, [_handle, ctypes.c_char_p]),
+    'dict_crypt': (None, [ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p]),
+    'dict_forget_keys': (None, [_handle]),
+}
+
+_lib = None
+_lib_lock = threading.Lock()
+
+
+def _candidates():
+    path = os.environ.get('LIBEXWORD_LIBRARY')
+    if path:
+        yield path
+    name = ctypes.util.find_library('exword')
+    if name:
+        yield name
+    here = os.path.dirname(os.path.abspath(__file__))
+    libs = os.path.join(here, os.pardir, os.pardir, 'src', '.libs')
+    for fn in ('libexword.so', 'libexword.dylib', 'libexword-1.dll'):
+        yield os.path.normpath(os.path.join(libs, fn))
+
+
+def load():
+    """Return the loaded libexword CDLL, loading it on first use."""
+    global _lib
+    with _lib_lock:
+        if _lib is not None:
+            return _lib
+        errors = []
+        for path in _candidates():
+            try:
+                lib = ctypes.CDLL(path)
+            except OSError as e:
+                errors.append(str(e))
+                continue
+            for fname, (restype, argtypes) in _PROTOTYPES.items():
+                func = getattr(lib, fname)
+                func.restype = restype
+                func.argtypes = argtypes
+            _lib = lib
+            return _lib
+        raise OSError('libexword shared library not found: ' + '; '.join(errors))
+
+
+def available():
+    """True if the shared library can be loaded."""
+    try:
+        load()
+    except OSError:
+        return False
+    return True
+
+
+def encode(s):
+    """Encode a str the way the C side expects (current locale, see iconv_open(""))."""
+    if isinstance(s, bytes):
+        return s
+    return s.encode(locale.getpreferredencoding(False), 'replace')
+
+
+def decode(b):
+    if isinstance(b, str):
+        return b
+    return b.decode(locale.getpreferredencoding(False), 'replace')
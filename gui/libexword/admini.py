@@ -0,0 +1,113 @@
+"""Installed add-on index (admini.inf)
+
+Each storage root holds an admini*.inf listing the installed add-ons as
+180 byte records: id[32], key[16], name[132] (Shift_JIS).  dict.c
+downloads and scans it for every dict list/remove/install; here it is
+parsed once into a dict keyed by id and kept in session.admini until an
+install or remove changes it.
+"""
+import collections
+import struct
+
+from .cache import cache_key
+from .session import ExwordError
+
+ADMINI_FILES = ('admini.inf', 'adminikr.inf', 'adminicn.inf', 'adminide.inf',
+                'adminies.inf', 'adminifr.inf', 'adminiru.inf')
+RECORD = struct.Struct('32s16s132s')
+
+
+class Addon(collections.namedtuple('Addon', 'id key name')):
+    """One admini.inf record; name is the raw Shift_JIS bytes."""
+    __slots__ = ()
+
+    @property
+    def title(self):
+        return self.name.decode('shift_jis', 'replace')
+
+
+def _cstr(raw):
+    return raw.split(b'\x00', 1)[0]
+
+
+def parse(data):
+    """Parse admini.inf contents into an ordered {id: Addon} dict."""
+    index = collections.OrderedDict()
+    for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+        id, key, name = RECORD.unpack_from(data, offset)
+        id = _cstr(id).decode('ascii', 'replace')
+        index[id] = Addon(id, key, _cstr(name))
+    return index
+
+
+def cryptkey_blocks(key):
+    """Split a 16 byte add-on key into the exword_cryptkey() input blocks."""
+    blk1 = bytearray(16)
+    blk1[0:2] = key[0:2]
+    blk1[10:12] = key[10:12]
+    blk2 = key[2:10] + key[12:16]
+    return bytes(blk1), bytes(blk2)
+
+
+def read_admini(session):
+    """Contents of the first non-empty admini*.inf in the cwd, or None."""
+    for name in ADMINI_FILES:
+        try:
+            data = session.get_file(name)
+        except ExwordError:
+            continue
+        if data:
+            return data
+    return None
+
+
+def cached(session, root=None):
+    """The index of root if it is already known, without any I/O."""
+    return session.admini.get(cache_key(root or session.storage_root()))
+
+
+def index(session, root=None, refresh=False):
+    """The {id: Addon} index of root, downloading admini.inf on first use.
+
+    The current path is restored afterwards.
+    """
+    root = root or session.storage_root()
+    key = cache_key(root)
+    if not refresh:
+        result = session.admini.get(key)
+        if result is not None:
+            return result
+    cwd = session.cwd
+    session.setpath(root)
+    try:
+        result = parse(read_admini(session) or b'')
+    finally:
+        if cwd is not None and cache_key(cwd) != key:
+            session.setpath(cwd)
+    session.admini[key] = result
+    return result
+
+
+def find(session, id, root=None):
+    return index(session, root).get(id)
+
+
+def remove(session, id, root=None):
+    """Remove an installed add-on, like `dict remove`."""
+    root = root or session.storage_root()
+    addon = find(session, id, root)
+    if addon is None:
+        raise ExwordError(-1, 'No dictionary with id %s installed' % id)
+    session.setpath(root)
+    session.unlock()
+    try:
+        session.cname(addon.name, id)
+        session.cryptkey(*cryptkey_blocks(addon.key))
+        session.remove_file(id)
+    except BaseException:
+        try:
+            session.lock()
+        except ExwordError:
+            pass
+        raise
+    session.lock()
@@ -0,0 +1,325 @@
+"""Batched file operations
+
+Every send, get, remove or list on the device acts on the current path,
+so a command line tool that runs them one by one pays a setpath round
+trip for each.  A Batch collects operations on many directories, runs
+all the operations of one directory before moving to the next, and only
+changes the path when it has to (Session.chdir):
+
+    batch = Batch()
+    batch.send('\\\\_INTERNAL_00\\\\a', 'x.txt', b'...')
+    batch.get('\\\\_SD_00', 'y.txt', '/tmp/y.txt')
+    batch.send('\\\\_INTERNAL_00\\\\a', 'z.txt', '/home/me/z.txt')
+    result = batch.run(session, job)
+    print(result.setpaths, 'setpath requests,', result.saved, 'saved')
+
+Operations are reordered only where that cannot change the outcome: one
+that touches a file (or the listing of a directory) another operation
+before it changed, or a directory an earlier mkdir creates, stays after
+it.  A remove of d\\name counts as a change of everything below
+d\\name, so it stays after the operations in there before it and
+before those after it.  Otherwise the first ready operation in the current directory runs
+next, and when there is none the batch moves to the directory of the
+earliest ready operation.
+
+A failed operation does not stop the batch, whether the device refused
+it or a local file could not be read or written; the operations
+depending on it are skipped with the same error and the others still
+run.
+
+    python -m libexword.batch ops.txt             # run a batch file
+    python -m libexword.batch --mock ops.txt      # on the emulator
+
+A batch file has one operation per line (device paths use '\\' or '/'):
+
+    mkdir  \\_INTERNAL_00\\dir
+    send   \\_INTERNAL_00\\dir  local/file.txt [device name]
+    get    \\_SD_00             name.txt [local file]
+    remove \\_SD_00             name.txt
+    list   \\_INTERNAL_00
+"""
+import argparse
+import collections
+import heapq
+import os
+import shlex
+import sys
+
+from .cache import cache_key, parent_paths
+from .session import ExwordError
+
+SEND = 'send'
+GET = 'get'
+REMOVE = 'remove'
+LIST = 'list'
+MKDIR = 'mkdir'
+
+
+class Op(collections.namedtuple('Op', 'kind path name source')):
+    """One operation; source is the data to send (bytes or a local file
+    name) or where to save a file (a local file name, or None to return
+    its contents)."""
+    __slots__ = ()
+
+    def __str__(self):
+        if self.name is None:
+            return '%s %s' % (self.kind, self.path)
+        return '%s %s' % (self.kind, self.path.rstrip('\\') + '\\' + self.name)
+
+
+class BatchResult(collections.namedtuple('BatchResult', 'results order setpaths naive')):
+    """results[i] is the result of the i-th operation, or the exception it
+    failed with; order lists the operations in the order they ran.
+    setpaths counts the setpath requests the batch sent, naive those a
+    setpath per operation would have cost."""
+    __slots__ = ()
+
+    @property
+    def saved(self):
+        return self.naive - self.setpaths
+
+    @property
+    def errors(self):
+        return [(i, r) for i, r in enumerate(self.results) if isinstance(r, Exception)]
+
+
+def _key(path):
+    return cache_key(path).casefold()
+
+
+def _within(path, tree):
+    return path == tree or path.startswith(tree + '\\')
+
+
+class Batch(object):
+
+    def __init__(self):
+        self.ops = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def add(self, op):
+        self.ops.append(op)
+        return len(self.ops) - 1
+
+    def send(self, path, name, source):
+        """Send bytes, or the local file named source, as path\\name."""
+        return self.add(Op(SEND, path, name, source))
+
+    def get(self, path, name, dest=None):
+        """Get path\\name into local file dest; without dest the result is
+        the file contents."""
+        return self.add(Op(GET, path, name, dest))
+
+    def remove(self, path, name):
+        return self.add(Op(REMOVE, path, name, None))
+
+    def list(self, path):
+        return self.add(Op(LIST, path, None, None))
+
+    def mkdir(self, path):
+        return self.add(Op(MKDIR, path, None, None))
+
+    def dependencies(self):
+        """deps[i]: the operations that have to run before operation i."""
+        deps = [set() for _ in self.ops]
+        writer = {}
+        readers = collections.defaultdict(list)
+        made = {}
+        # removed[tree]: the last remove of directory (or file) tree
+        removed = {}
+        dirs = []
+        for i, op in enumerate(self.ops):
+            d = _key(op.path)
+            for tree, j in removed.items():
+                if _within(d, tree):
+                    deps[i].add(j)
+            if op.kind == REMOVE:
+                tree = d + '\\' + op.name.casefold()
+                deps[i].update(j for j, p in dirs if _within(p, tree))
+                removed[tree] = i
+            dirs.append((i, d))
+            if op.kind == MKDIR:
+                parents = parent_paths(d)
+                parent = parents[0] if parents else ''
+                name = d[len(parent):].strip('\\')
+                touched = [(('file', parent, name), True), (('dir', parent), True)]
+            elif op.kind == LIST:
+                touched = [(('dir', d), False)]
+            else:
+                write = op.kind != GET
+                touched = [(('file', d, op.name.casefold()), write)]
+                if write:
+                    touched.append((('dir', d), True))
+            for resource, write in touched:
+                if resource in writer:
+                    deps[i].add(writer[resource])
+                if write:
+                    deps[i].update(readers.pop(resource, ()))
+                    writer[resource] = i
+                else:
+                    readers[resource].append(i)
+            for p in [d] + parent_paths(d):
+                if p in made and made[p] != i:
+                    deps[i].add(made[p])
+            if op.kind == MKDIR:
+                made[d] = i
+        return deps
+
+    def schedule(self, cwd=None):
+        """Order to run the operations in, starting at device path cwd."""
+        deps = self.dependencies()
+        waiting = [len(d) for d in deps]
+        dependents = [[] for _ in self.ops]
+        for i, d in enumerate(deps):
+            for j in d:
+                dependents[j].append(i)
+        ready = collections.defaultdict(list)
+        earliest = []
+        for i, n in enumerate(waiting):
+            if not n:
+                heapq.heappush(ready[_key(self.ops[i].path)], i)
+                heapq.heappush(earliest, i)
+        current = _key(cwd) if cwd is not None else None
+        done = [False] * len(self.ops)
+        order = []
+        while earliest:
+            if not ready.get(current):
+                while done[earliest[0]]:
+                    heapq.heappop(earliest)
+                current = _key(self.ops[earliest[0]].path)
+            i = heapq.heappop(ready[current])
+            done[i] = True
+            order.append(i)
+            for j in dependents[i]:
+                waiting[j] -= 1
+                if not waiting[j]:
+                    heapq.heappush(ready[_key(self.ops[j].path)], j)
+                    heapq.heappush(earliest, j)
+            while earliest and done[earliest[0]]:
+                heapq.heappop(earliest)
+        return order
+
+    def run(self, session, job=None):
+        """Run the batch on session; returns a BatchResult."""
+        deps = self.dependencies()
+        order = self.schedule(session.cwd)
+        results = [None] * len(self.ops)
+        failed = set()
+        setpaths = 0
+        for done, i in enumerate(order):
+            op = self.ops[i]
+            if job is not None:
+                job.check()
+            blocked = deps[i] & failed
+            if blocked:
+                results[i] = results[min(blocked)]
+                failed.add(i)
+                continue
+            try:
+                if op.kind == MKDIR:
+                    setpaths += session.chdir(op.path, mkdir=True)
+                else:
+                    setpaths += session.chdir(op.path)
+                    results[i] = _execute(session, op, job)
+            except (ExwordError, OSError, ValueError) as e:
+                results[i] = e
+                failed.add(i)
+                if not session.connected:
+                    # every later operation would fail the same way
+                    for j in order[done + 1:]:
+                        results[j] = e
+                    break
+            if job is not None:
+                job.progress(str(op), done + 1, len(order))
+        naive = len(self.ops)
+        return BatchResult(results, order, setpaths, naive)
+
+
+def _execute(session, op, job):
+    cancel = (lambda: job.cancelled) if job is not None else None
+    if op.kind == SEND:
+        if isinstance(op.source, (bytes, bytearray, memoryview)):
+            session.send_stream(op.name, memoryview(op.source), len(op.source), cancel=cancel)
+            return len(op.source)
+        with open(op.source, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            session.send_stream(op.name, f, size, cancel=cancel)
+        return size
+    if op.kind == GET:
+        if op.source is None:
+            return session.get_file(op.name)
+        f = open(op.source, 'wb')
+        try:
+            with f:
+                session.get_stream(op.name, f, cancel=cancel)
+        except BaseException:
+            # only the file this call created; a failed open() leaves none
+            os.remove(op.source)
+            raise
+        return op.source
+    if op.kind == REMOVE:
+        session.remove_file(op.name)
+        return None
+    return session.list_view()
+
+
+def parse(lines):
+    """Batch from lines in the batch file format."""
+    batch = Batch()
+    for number, line in enumerate(lines, 1):
+        words = shlex.split(line, comments=True, posix=False)
+        if not words:
+            continue
+        kind, args = words[0].lower(), [w.strip('"') for w in words[1:]]
+        if args:
+            args[0] = args[0].replace('/', '\\')
+        if kind in (LIST, MKDIR) and len(args) == 1:
+            batch.add(Op(kind, args[0], None, None))
+        elif kind == SEND and len(args) in (2, 3):
+            batch.send(args[0], args[2] if len(args) == 3 else os.path.basename(args[1]), args[1])
+        elif kind == GET and len(args) in (2, 3):
+            batch.get(args[0], args[1], args[2] if len(args) == 3 else args[1])
+        elif kind == REMOVE and len(args) == 2:
+            batch.remove(args[0], args[1])
+        else:
+            raise ValueError('line %d: cannot parse %r' % (number, line.strip()))
+    return batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file', help='batch file, - for stdin')
+    parser.add_argument('--mock', action='store_true', help='run on the emulator')
+    parser.add_argument('--index', type=int, default=0, help='device number')
+    args = parser.parse_args(argv)
+    from .session import Session
+    if args.file == '-':
+        batch = parse(sys.stdin)
+    else:
+        with open(args.file) as f:
+            batch = parse(f)
+    device = None
+    if args.mock:
+        from . import mock
+        device = mock.MockDevice()
+    with Session(index=args.index, transport=device) as session:
+        result = batch.run(session)
+    for i in result.order:
+        r = result.results[i]
+        if isinstance(r, Exception):
+            status = 'failed: %s' % r
+        elif batch.ops[i].kind == LIST:
+            status = '%d entries' % len(r)
+        else:
+            status = 'ok'
+        print('%-40s %s' % (batch.ops[i], status))
+    print('%d operations, %d setpath requests (%d saved)'
+          % (len(batch), result.setpaths, result.saved))
+    if result.errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Transfer benchmarks
+
+    python -m libexword.bench                 # upload MB/s vs. MTU, loopback mock
+    python -m libexword.bench --device        # the same against a connected device
+    python -m libexword.bench --suite         # send/get/list/install on the emulator
+    python -m libexword.bench --download      # get time vs. file size, emulator
+    python -m libexword.bench --faults        # time until unplug/wedge/abort fail
+    python -m libexword.bench --crypt         # content cipher, GB/s
+
+Each MTU is measured with plain stop-and-wait and with pipelined PUT.
+--suite drives the C library through exword_open_transport() and the
+mock.MockDevice emulator and reports MB/s, ops/s and p50/p99 latency per
+operation, plus the CPU time the calling thread spent per MB moved
+(the emulator runs on its own thread and is not counted); send, stream
+and mapped compare exword_send_file() from memory, send_stream() and
+send_mapped(), install and install mapped install_zip() with and
+without mapped=True.  --json stores the rows for comparing runs.  With --device a
+scratch file is written to the current storage root and removed again
+afterwards (--suite --device skips the install step).  --download checks
+that receiving a file stays linear in its size, with and without the
+Length header the receive buffer is pre-sized from.  --faults reports how
+long a command takes to fail when the emulator is unplugged, stops
+answering, or the command is aborted from another thread.
+"""
+import argparse
+import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+from . import crypt
+from . import mock
+from ._native import OBEX_MAXIMUM_MTU
+
+DEFAULT_MTUS = (4096, 0x4006, 32768, OBEX_MAXIMUM_MTU)
+SCRATCH = 'BENCH.TMP'
+
+
+def bench_mock(size, mtus, latency, bandwidth, store_rate):
+    data = bytes(size)
+    for mtu in mtus:
+        for pipeline in (False, True):
+            device = mock.MockDevice(latency, bandwidth, store_rate)
+            try:
+                client = mock.MockClient(device, mtu, pipeline)
+                client.connect()
+                start = time.perf_counter()
+                rsp = client.put(SCRATCH, data)
+                elapsed = time.perf_counter() - start
+                if rsp != mock.OBEX_RSP_SUCCESS or device.files.get(SCRATCH) != data:
+                    raise RuntimeError('mock upload failed (0x%02x)' % rsp)
+            finally:
+                device.close()
+            yield mtu, client.mtu_tx, pipeline, elapsed
+
+
+def bench_device(size, mtus):
+    import io
+    from .session import Session
+    for mtu in mtus:
+        for pipeline in (False, True):
+            with Session(max_mtu=mtu, pipeline=pipeline) as s:
+                start = time.perf_counter()
+                s.send_stream(SCRATCH, io.BytesIO(bytes(size)))
+                elapsed = time.perf_counter() - start
+                used = s.mtu
+                s.remove_file(SCRATCH)
+            yield mtu, used, pipeline, elapsed
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of samples (0 < p <= 100)."""
+    ordered = sorted(samples)
+    rank = max(1, int(-(-len(ordered) * p // 100)))
+    return ordered[rank - 1]
+
+
+def _measure(op, func, count, size=0):
+    times = []
+    cpu = time.thread_time()
+    for i in range(count):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    cpu = time.thread_time() - cpu
+    total = sum(times)
+    return {'op': op, 'count': count, 'bytes': size * count,
+            'mb_s': size * count / total / 1e6 if size else None,
+            'cpu_ms_mb': cpu * 1000 / (size * count / 1e6) if size else None,
+            'ops_s': count / total,
+            'p50_ms': percentile(times, 50) * 1000,
+            'p99_ms': percentile(times, 99) * 1000}
+
+
+def _addon_zip(path, id, files, size):
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr(id + '/diction.htm', '<html><title>Bench</title></html>')
+        for i in range(files):
+            zf.writestr('%s/F%03d.HTM' % (id, i), os.urandom(size))
+
+
+def bench_suite(session, size, count, entries, install=True):
+    """Rows of send, get, list and (optionally) dict install timings."""
+    from . import admini
+    from .install import install_zip
+    from .session import join_path
+    root = session.storage_root()
+    data = os.urandom(size)
+    scratch = join_path(root, 'BENCH')
+    session.setpath(scratch, mkdir=True)
+    for i in range(entries):
+        session.send_file('E%04d.TXT' % i, b'')
+    yield _measure('send', lambda i: session.send_file(SCRATCH, data), count, size)
+    yield _measure('stream', lambda i: session.send_stream(SCRATCH, memoryview(data), size),
+                   count, size)
+    fd, local = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        yield _measure('mapped', lambda i: session.send_mapped(SCRATCH, local), count, size)
+    finally:
+        os.remove(local)
+    yield _measure('get', lambda i: session.get_file(SCRATCH), count, size)
+    yield _measure('list', lambda i: session.list(), count)
+    session.setpath(root)
+    session.remove_file('BENCH')
+    if not install:
+        return
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'BENCH.zip')
+        files = 8
+        _addon_zip(path, 'BENCH', files, size // files)
+
+        def install_once(i, mapped=False):
+            install_zip(session, path, job=None, mapped=mapped)
+            admini.remove(session, 'BENCH')
+        yield _measure('install', install_once, max(1, count // 4), size)
+        yield _measure('install mapped', functools.partial(install_once, mapped=True),
+                       max(1, count // 4), size)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_download(sizes, mtu=OBEX_MAXIMUM_MTU):
+    """(size, length hinted, seconds) of get_file from an unthrottled emulator."""
+    from .session import Session
+    for hinted in (True, False):
+        device = mock.MockDevice(0, None, None, length_header=hinted)
+        try:
+            with Session(max_mtu=mtu, transport=device) as s:
+                for size in sizes:
+                    device.files[SCRATCH] = bytes(size)
+                    start = time.perf_counter()
+                    s.get_file(SCRATCH)
+                    yield size, hinted, time.perf_counter() - start
+        finally:
+            device.close()
+
+
+def bench_faults(latency=0.001, timeout_max=0.8, warmup=20):
+    """(fault, seconds until the command failed, error, rtt) on the emulator."""
+    from .session import Session, ExwordError
+    for fault in ('unplug', 'wedge', 'abort'):
+        device = mock.MockDevice(latency, None, None)
+        s = Session(transport=device, timeout_max=timeout_max)
+        try:
+            s.open()
+            for i in range(warmup):
+                s.model()
+            rtt = s.rtt
+            if fault == 'unplug':
+                device.unplug()
+            else:
+                device.wedge()
+            if fault == 'abort':
+                timer = threading.Timer(0.05, s.abort)
+                timer.start()
+            start = time.perf_counter()
+            try:
+                s.model()
+                error = None
+            except ExwordError as e:
+                error = e
+            elapsed = time.perf_counter() - start
+            if fault == 'abort':
+                timer.join()
+                elapsed -= 0.05
+            yield fault, elapsed, error, rtt
+        finally:
+            s.close()
+            device.close()
+
+
+def bench_crypt(size, rounds=5):
+    """Best of rounds GB/s for each available xor_inplace backend."""
+    import ctypes
+    from . import _native
+    backends = [('pure', lambda b: crypt._xor_pure(memoryview(b), crypt.INSTALL_KEY, 0))]
+    if crypt.numpy is not None:
+        backends.insert(0, ('numpy', lambda b: crypt._xor_numpy(memoryview(b), crypt.INSTALL_KEY, 0)))
+    if _native.available():
+        lib = _native.load()
+
+        def native(b):
+            lib.dict_crypt(ctypes.addressof((ctypes.c_char * len(b)).from_buffer(b)),
+                           len(b), crypt.INSTALL_KEY)
+        backends.append(('dict_crypt', native))
+    buf = bytearray(size)
+    for name, func in backends:
+        best = None
+        for i in range(rounds):
+            start = time.perf_counter()
+            func(buf)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        yield name, size / best / 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--device', action='store_true', help='use a real device')
+    parser.add_argument('--crypt', action='store_true', help='measure the content cipher instead')
+    parser.add_argument('--suite', action='store_true', help='send/get/list/install latency suite')
+    parser.add_argument('--download', action='store_true', help='get time vs. file size')
+    parser.add_argument('--faults', action='store_true', help='time until a failed command returns')
+    parser.add_argument('--count', type=int, default=20, help='suite: operations per row')
+    parser.add_argument('--entries', type=int, default=200, help='suite: directory entries to list')
+    parser.add_argument('--json', help='suite: also write the rows to this file')
+    parser.add_argument('--size', type=int, default=512 * 1024, help='bytes per upload')
+    parser.add_argument('--mtu', type=lambda v: int(v, 0), action='append',
+                        help='MTU to measure (repeatable)')
+    parser.add_argument('--latency', type=float, default=1.0, help='mock: ms per bulk transfer')
+    parser.add_argument('--bandwidth', type=float, default=1.0, help='mock: link MB/s')
+    parser.add_argument('--store-rate', type=float, default=4.0, help='mock: device flash MB/s')
+    args = parser.parse_args(argv)
+    if args.crypt:
+        for name, rate in bench_crypt(max(args.size, 64 << 20)):
+            print('%-10s %8.3f GB/s' % (name, rate))
+        return
+    if args.suite:
+        run_suite(args)
+        return
+    if args.download:
+        print('%8s %-8s %9s %9s' % ('MB', 'length', 'seconds', 'ms/MB'))
+        for size, hinted, elapsed in bench_download([(1 << 20) << i for i in range(7)]):
+            print('%8d %-8s %9.3f %9.2f' % (size >> 20, 'hinted' if hinted else 'none',
+                                            elapsed, elapsed * 1000 / (size >> 20)))
+        return
+    if args.faults:
+        print('%-8s %9s %9s  %s' % ('fault', 'ms', 'rtt ms', 'error'))
+        for fault, elapsed, error, rtt in bench_faults(args.latency / 1000.0):
+            print('%-8s %9.1f %9.2f  %s' % (fault, elapsed * 1000, rtt * 1000, error))
+        return
+    mtus = args.mtu or DEFAULT_MTUS
+    if args.device:
+        results = bench_device(args.size, mtus)
+    else:
+        results = bench_mock(args.size, mtus, args.latency / 1000.0,
+                             args.bandwidth * 1e6, args.store_rate * 1e6)
+    print('%8s %8s %-10s %8s' % ('request', 'used', 'mode', 'MB/s'))
+    for mtu, used, pipeline, elapsed in results:
+        print('%8d %8d %-10s %8.3f' % (mtu, used, 'pipelined' if pipeline else 'stop-wait',
+                                       args.size / elapsed / 1e6))
+
+
+def run_suite(args):
+    from .session import Session
+    mtu = args.mtu[-1] if args.mtu else 0
+    if args.device:
+        session = Session(max_mtu=mtu)
+    else:
+        device = mock.MockDevice(args.latency / 1000.0, args.bandwidth * 1e6,
+                                 args.store_rate * 1e6)
+        session = Session(max_mtu=mtu, transport=device)
+    with session:
+        rows = list(bench_suite(session, args.size, args.count, args.entries,
+                                install=not args.device))
+    if not args.device:
+        device.close()
+    print('%-14s %6s %9s %9s %9s %9s %9s' % ('op', 'count', 'MB/s', 'cpu ms/MB', 'ops/s',
+                                            'p50 ms', 'p99 ms'))
+    for r in rows:
+        mb_s = '%9.3f' % r['mb_s'] if r['mb_s'] is not None else '%9s' % '-'
+        cpu = '%9.3f' % r['cpu_ms_mb'] if r['cpu_ms_mb'] is not None else '%9s' % '-'
+        print('%-14s %6d %s %s %9.1f %9.2f %9.2f' % (r['op'], r['count'], mb_s, cpu, r['ops_s'],
+                                                    r['p50_ms'], r['p99_ms']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'device': bool(args.device), 'size': args.size, 'mtu': mtu,
+                       'latency_ms': args.latency, 'bandwidth_mb_s': args.bandwidth,
+                       'rows': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
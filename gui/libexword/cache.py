@@ -0,0 +1,118 @@
+"""Directory listing cache
+
+Every exword_list costs a setpath and a list request over USB.  A Session
+keeps the listings it has fetched in a DirCache keyed by device path, so
+going back to a directory (or re-opening a browser) is answered from
+memory.  Entries expire after `ttl` seconds and are dropped as soon as the
+Session itself changes the directory (send, remove, mkdir, install, ...).
+Operations that may touch anything bump the generation, which invalidates
+every entry at once.
+
+The free space of each storage root is cached the same way: any change
+below a root drops its capacity.
+
+The cache has its own lock, so get() can be called from the GUI thread
+while the device worker is busy with a transfer.
+"""
+import threading
+import time
+
+
+def cache_key(path):
+    return path.replace('/', '\\').rstrip('\\')
+
+
+def storage_key(path):
+    """Cache key of the storage root holding path ('\\_SD_00\\a' -> '\\_SD_00')."""
+    return '\\'.join(cache_key(path).split('\\')[:2])
+
+
+def parent_paths(path):
+    """All ancestors of path, nearest first ('\\a\\b\\c' -> '\\a\\b', '\\a', '')."""
+    parts = cache_key(path).split('\\')
+    return ['\\'.join(parts[:i]) for i in range(len(parts) - 1, 0, -1)]
+
+
+class DirCache(object):
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._capacity = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, copy=True):
+        """Cached listing of path, or None if missing or stale.
+
+        With copy=False the stored sequence itself is returned; it must not
+        be modified.
+        """
+        key = cache_key(path)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                entries, generation, stamp = item
+                fresh = self.ttl is None or time.monotonic() - stamp < self.ttl
+                if generation == self.generation and fresh:
+                    self.hits += 1
+                    return list(entries) if copy else entries
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, path, entries, generation=None):
+        """Store a listing fetched while the cache was at generation."""
+        with self._lock:
+            if generation is None:
+                generation = self.generation
+            if generation == self.generation:
+                if isinstance(entries, list):
+                    entries = tuple(entries)
+                self._entries[cache_key(path)] = (entries, generation, time.monotonic())
+
+    def get_capacity(self, root):
+        """Cached capacity of the storage holding root, or None."""
+        with self._lock:
+            item = self._capacity.get(storage_key(root))
+            if item is None:
+                return None
+            capacity, generation, stamp = item
+            if generation == self.generation and (self.ttl is None or
+                                                  time.monotonic() - stamp < self.ttl):
+                return capacity
+            del self._capacity[storage_key(root)]
+            return None
+
+    def put_capacity(self, root, capacity, generation=None):
+        with self._lock:
+            if generation is None:
+                generation = self.generation
+            if generation == self.generation:
+                self._capacity[storage_key(root)] = (capacity, generation, time.monotonic())
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(cache_key(path), None)
+            self._capacity.pop(storage_key(path), None)
+
+    def invalidate_tree(self, path):
+        """Drop path and everything below it."""
+        key = cache_key(path)
+        with self._lock:
+            self._capacity.pop(storage_key(path), None)
+            for k in list(self._entries):
+                if k == key or k.startswith(key + '\\'):
+                    del self._entries[k]
+
+    def bump(self):
+        """Invalidate every entry (for operations with unknown effects)."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._capacity.clear()
+
+    def __len__(self):
+        return len(self._entries)
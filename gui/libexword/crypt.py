@@ -0,0 +1,90 @@
+"""Add-on dictionary content cipher
+
+.htm/.bmp/.txt files of an add-on are XORed with a repeating 16 byte key
+(dict_crypt() in dict.c); applying it twice gives back the original.
+INSTALL_KEY is the key used when uploading, the key of an installed
+add-on is recovered from the first block of its diction.htm with
+crack_key().
+
+xor_inplace() uses NumPy when it is installed and a pure Python version
+otherwise.  Both work in place on any writable buffer (bytearray,
+memoryview, mmap, ...).
+"""
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KEY_SIZE = 16
+INSTALL_KEY = bytes.fromhex('5d5d5d5d5c425c425b285b285a0f5a0f')
+PLAINTEXT = b'<html>\r\n<head>\r\n'
+ENCRYPTED_EXTS = ('.htm', '.bmp', '.txt')
+_EXTS = ENCRYPTED_EXTS + tuple(e.upper() for e in ENCRYPTED_EXTS)
+
+# work in slices this size so temporaries stay small
+_CHUNK = 1 << 20
+
+
+def is_encrypted(name):
+    """True if dict.c would run name through the cipher."""
+    return os.path.splitext(name)[1] in _EXTS
+
+
+def crack_key(head):
+    """Key of an installed add-on from the first 16 bytes of diction.htm."""
+    if len(head) < KEY_SIZE:
+        raise ValueError('need %d bytes of diction.htm' % KEY_SIZE)
+    return bytes(a ^ b for a, b in zip(PLAINTEXT, head[:KEY_SIZE]))
+
+
+def _check_key(key):
+    key = bytes(key)
+    if len(key) != KEY_SIZE:
+        raise ValueError('key must be %d bytes' % KEY_SIZE)
+    return key
+
+
+def _xor_numpy(view, key, offset):
+    data = numpy.frombuffer(view, dtype=numpy.uint8)
+    # rotate so the keystream lines up with offset, then tile it to the
+    # chunk size once; every chunk starts at a multiple of 16
+    key = key[offset % KEY_SIZE:] + key[:offset % KEY_SIZE]
+    stream = numpy.frombuffer(key * (min(len(data), _CHUNK) // KEY_SIZE + 1), dtype=numpy.uint8)
+    for pos in range(0, len(data), _CHUNK):
+        part = data[pos:pos + _CHUNK]
+        numpy.bitwise_xor(part, stream[:len(part)], out=part)
+
+
+def _xor_pure(view, key, offset):
+    key = key[offset % KEY_SIZE:] + key[:offset % KEY_SIZE]
+    stream = key * (min(len(view), _CHUNK) // KEY_SIZE + 1)
+    for pos in range(0, len(view), _CHUNK):
+        part = view[pos:pos + _CHUNK]
+        n = len(part)
+        value = int.from_bytes(part, 'little') ^ int.from_bytes(stream[:n], 'little')
+        part[:] = value.to_bytes(n, 'little')
+
+
+def xor_inplace(buffer, key=INSTALL_KEY, offset=0):
+    """XOR buffer with the repeating key, in place.
+
+    offset is the position of buffer[0] in the file, so a file can be
+    processed chunk by chunk.  Returns buffer.
+    """
+    key = _check_key(key)
+    view = memoryview(buffer).cast('B')
+    if view.readonly:
+        raise TypeError('buffer is read-only')
+    if len(view):
+        if numpy is not None:
+            _xor_numpy(view, key, offset)
+        else:
+            _xor_pure(view, key, offset)
+    return buffer
+
+
+def xor(data, key=INSTALL_KEY, offset=0):
+    """Return a ciphered copy of data."""
+    return bytes(xor_inplace(bytearray(data), key, offset))
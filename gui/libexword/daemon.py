@@ -0,0 +1,895 @@
+"""Shared device daemon
+
+Only one process can claim an EX-word's USB interface, and every new
+Session pays for the claim and the OBEX connect.  The daemon owns the
+sessions instead and serves any number of local clients over a UNIX
+socket, so the GUI and scripts can use a device at the same time and a
+restarted GUI finds its session still connected:
+
+    python -m libexword.daemon &            # --mock also serves the emulator
+
+    from libexword import daemon
+    with daemon.connect(index=0) as s:      # a RemoteSession
+        s.setpath('\\\\_INTERNAL_00')
+        s.send_file('A.TXT', data)
+
+Requests and answers are small JSON frames on the socket.  File
+contents do not go through it: every connection gets two byte rings in
+shared memory (one per direction, passed as file descriptors when it is
+accepted) and uploads and downloads stream through them while the device
+worker moves the packets.  The requests of all clients of a device run
+one at a time on its DeviceWorker; each carries the client's current
+path, which is restored first, so clients do not see each other's
+setpath(), and the priority class of the calling thread (sched.py).
+
+Frames only carry plain data: bytes and the few result types in _TYPES
+are tagged and rebuilt, anything else is refused.  The socket lives in a
+directory only the user can open; both sides check its owner and mode,
+and the uid of the other end of the connection where the system reports
+it (SO_PEERCRED).  POSIX only.
+"""
+import argparse
+import json
+import mmap
+import os
+import select
+import signal
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+
+from . import sched
+from .cache import cache_key
+from .manager import SessionManager
+from .session import (Session, ExwordError, DirEntry, Model, Capacity,
+                      _stream_length, _file_reader, _iter_reader)
+from .stats import Histogram, TraceEntry
+from .worker import Cancelled
+
+RING_SIZE = 4 << 20
+EMULATOR = 'emulator'
+
+# start of the ring data; before it are the write and read counters
+_HEADER = 64
+_LENGTH = struct.Struct('!I')
+# longest frame accepted; file contents go through the rings
+_MAX_FRAME = 64 << 20
+_PEERCRED = struct.Struct('3i')
+# result types a frame may carry, rebuilt by name
+_TYPES = dict((t.__name__, t) for t in (DirEntry, Model, Capacity, Histogram, TraceEntry))
+# a side waiting for the other one polls the ring this often, backing off
+_MIN_WAIT = 0.00005
+_MAX_WAIT = 0.005
+
+# Session methods clients may call
+_CALLS = frozenset(('list', 'listdir', 'setpath', 'remove_file', 'model', 'capacity',
+                    'sd_format', 'unlock', 'lock', 'cname', 'cryptkey', 'dict_list',
+                    'dict_auth', 'dict_reset', 'dict_install', 'dict_remove',
+                    'dict_decrypt', 'mtu', 'set_pipeline', 'unit'))
+# the ones changing the device contents (setpath only with mkdir)
+_WRITES = frozenset(('send', 'remove_file', 'sd_format', 'cname', 'dict_reset',
+                     'dict_install', 'dict_remove'))
+# answered on the connection's thread, without waiting for the worker
+_DIRECT = frozenset(('stats', 'trace', 'reset_stats', 'rtt'))
+
+
+def default_socket():
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if base:
+        return os.path.join(base, 'libexword', 'daemon.sock')
+    return os.path.join(tempfile.gettempdir(), 'libexword-%d' % os.getuid(), 'daemon.sock')
+
+
+def _private_dir(directory):
+    """Fail unless directory belongs to this user and only they can use it."""
+    try:
+        st = os.lstat(directory)
+    except OSError as e:
+        raise ExwordError(-1, 'daemon directory: %s' % e)
+    if (not os.path.isdir(directory) or os.path.islink(directory)
+            or st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise ExwordError(-1, '%s is not a directory private to this user' % directory)
+
+
+def _peer_uid(sock):
+    """uid of the process at the other end, None where it cannot be told."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size)
+    return _PEERCRED.unpack(creds)[1]
+
+
+def _same_user(sock):
+    uid = _peer_uid(sock)
+    return uid is None or uid == os.getuid()
+
+
+def _connect(path):
+    """A socket connected to the daemon at path, checked to be this user's."""
+    _private_dir(os.path.dirname(os.path.abspath(path)))
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(path)
+        if not _same_user(sock):
+            raise ExwordError(-1, '%s is served by another user' % path)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _encode(obj):
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {'b': bytes(obj).hex()}
+    if isinstance(obj, tuple) and _TYPES.get(type(obj).__name__) is type(obj):
+        return {'t': type(obj).__name__, 'v': [_encode(v) for v in obj]}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(v) for v in obj]
+    if isinstance(obj, dict) and all(isinstance(k, str) for k in obj):
+        return {'d': dict((k, _encode(v)) for k, v in obj.items())}
+    raise TypeError('cannot send %s' % type(obj).__name__)
+
+
+def _decode(obj):
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if 'b' in obj:
+        return bytes.fromhex(obj['b'])
+    if 't' in obj:
+        if obj['t'] not in _TYPES:
+            raise ValueError('unknown type %r in frame' % obj['t'])
+        return _TYPES[obj['t']](*[_decode(v) for v in obj['v']])
+    return dict((k, _decode(v)) for k, v in obj['d'].items())
+
+
+def _send(sock, obj, fds=None):
+    data = json.dumps(_encode(obj), separators=(',', ':')).encode('utf-8')
+    frame = _LENGTH.pack(len(data)) + data
+    if fds:
+        sent = socket.send_fds(sock, [frame], fds)
+        sock.sendall(frame[sent:])
+    else:
+        sock.sendall(frame)
+
+
+def _recv_exact(sock, n, data=b''):
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+
+def _recv(sock, data=b''):
+    data = _recv_exact(sock, _LENGTH.size, data)
+    n = _LENGTH.unpack_from(data)[0]
+    if n > _MAX_FRAME:
+        raise ValueError('frame of %d bytes' % n)
+    data = _recv_exact(sock, _LENGTH.size + n, data)[_LENGTH.size:]
+    try:
+        return _decode(json.loads(data.decode('utf-8')))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError('malformed frame: %r' % e)
+
+
+def _recv_fds(sock, maxfds):
+    """A frame and the file descriptors sent along with it."""
+    data, fds, flags, addr = socket.recv_fds(sock, 65536, maxfds)
+    if not data:
+        raise ConnectionError('connection closed')
+    return _recv(sock, data), fds
+
+
+def _readable(sock, timeout):
+    return bool(select.select([sock], [], [], timeout)[0])
+
+
+def _error(e):
+    if isinstance(e, ExwordError):
+        return ('error', 'ExwordError', e.rsp, e.message)
+    return ('error', type(e).__name__, None, str(e))
+
+
+def _raise(reply):
+    kind, rsp, message = reply[1:4]
+    if kind == 'ExwordError':
+        raise ExwordError(rsp, message)
+    if kind == 'ValueError':
+        raise ValueError(message)
+    if kind == 'Cancelled':
+        raise Cancelled(message)
+    raise ExwordError(-1, '%s: %s' % (kind, message))
+
+
+def _shared_fd(size, directory):
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('libexword-ring', os.MFD_CLOEXEC)
+    else:
+        fd, path = tempfile.mkstemp(prefix='ring-', dir=directory)
+        os.unlink(path)
+    os.ftruncate(fd, size)
+    return fd
+
+
+class Ring(object):
+    """Single producer, single consumer byte ring in a shared mapping.
+
+    The mapping starts with the total number of bytes written and read so
+    far.  Each side only advances its own counter, after copying.
+    """
+
+    def __init__(self, fd):
+        self._map = mmap.mmap(fd, os.fstat(fd).st_size)
+        self._view = memoryview(self._map)
+        self._pos = self._view[:16].cast('Q')
+        self._data = self._view[_HEADER:]
+        self.capacity = len(self._data)
+
+    def close(self):
+        if self._map is not None:
+            self._pos.release()
+            self._data.release()
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                # a slice is still referenced (say by a traceback); the
+                # mapping goes away with it
+                pass
+            self._map = None
+
+    @property
+    def head(self):
+        return self._pos[0]
+
+    @property
+    def tail(self):
+        return self._pos[1]
+
+    def writable(self):
+        """The free space at the write position that is contiguous."""
+        head, tail = self._pos[0], self._pos[1]
+        start = head % self.capacity
+        return self._data[start:start + min(self.capacity - (head - tail), self.capacity - start)]
+
+    def commit(self, n):
+        self._pos[0] += n
+
+    def readable(self, end=None):
+        """The bytes at the read position (up to end) that are contiguous."""
+        head, tail = self._pos[0], self._pos[1]
+        if end is not None:
+            head = min(head, end)
+        start = tail % self.capacity
+        return self._data[start:start + min(head - tail, self.capacity - start)]
+
+    def consume(self, n):
+        self._pos[1] += n
+
+    def skip_to(self, pos):
+        """Drop everything written before pos (left over by a failed transfer)."""
+        if pos > self._pos[1]:
+            self._pos[1] = pos
+
+
+# --- daemon ---
+
+class _Connection(object):
+    """One client of the daemon: its socket and rings."""
+
+    def __init__(self, sock, upload, download):
+        self.sock = sock
+        self.upload = upload
+        self.download = download
+
+    def wait(self, delay):
+        """Sleep up to delay; a frame from the client during a transfer
+        can only be a cancel, and end of file means it went away."""
+        if _readable(self.sock, delay):
+            if _recv(self.sock)[0] == 'cancel':
+                raise Cancelled('transfer cancelled by the client')
+            raise ConnectionError('unexpected request during a transfer')
+
+    def readinto(self, view):
+        """send_stream() source reading the upload ring."""
+        delay = _MIN_WAIT
+        while True:
+            data = self.upload.readable()
+            if data:
+                n = min(len(data), len(view))
+                view[:n] = data[:n]
+                self.upload.consume(n)
+                return n
+            self.wait(delay)
+            delay = min(delay * 2, _MAX_WAIT)
+
+    def read(self, size):
+        buf = bytearray(size)
+        return bytes(buf[:self.readinto(buf)])
+
+    def write(self, chunk):
+        """get_stream() sink filling the download ring."""
+        chunk = memoryview(chunk)
+        delay = _MIN_WAIT
+        self.wait(0)
+        while chunk:
+            space = self.download.writable()
+            if space:
+                n = min(len(space), len(chunk))
+                space[:n] = chunk[:n]
+                self.download.commit(n)
+                chunk = chunk[n:]
+                delay = _MIN_WAIT
+                continue
+            self.wait(delay)
+            delay = min(delay * 2, _MAX_WAIT)
+
+    def close(self):
+        self.upload.close()
+        self.download.close()
+
+
+def _ensure_open(session, cwd):
+    if not session.connected:
+        session.open()
+    if cwd is not None:
+        session.chdir(cwd)
+
+
+def _reconnect(session):
+    # an interrupted PUT or GET leaves the device mid-transfer
+    try:
+        session.close()
+    except ExwordError:
+        pass
+    session.open()
+
+
+def _call(session, op, cwd, args, kwargs):
+    _ensure_open(session, cwd if op != 'setpath' else None)
+    result = getattr(session, op)
+    if callable(result):
+        result = result(*args, **kwargs)
+    return result
+
+
+def _upload(session, conn, cwd, name, length, start):
+    _ensure_open(session, cwd)
+    conn.upload.skip_to(start)
+    try:
+        session.send_stream(name, conn, length)
+    except (Cancelled, ConnectionError):
+        _reconnect(session)
+        raise
+    return length
+
+
+def _download(session, conn, cwd, name):
+    _ensure_open(session, cwd)
+    try:
+        total = session.get_stream(name, conn.write)
+    except (Cancelled, ConnectionError):
+        _reconnect(session)
+        raise
+    return total, conn.download.head
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.server.owner._serve(self.request)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon(object):
+    """Serves the devices of this machine to local clients.
+
+    devices maps a device name clients can ask for to the Session options
+    opening it (as for SessionManager.open()); other devices are named by
+    their USB index or path.  The remaining keyword arguments are the
+    default Session options.
+    """
+
+    def __init__(self, path=None, ring_size=RING_SIZE, devices=None, **session_options):
+        self.path = path or default_socket()
+        self.ring_size = ring_size
+        self.devices = dict(devices or {})
+        self.manager = SessionManager(**session_options)
+        self._generation = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def bind(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _private_dir(directory)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise ExwordError(-1, 'a daemon is already listening on %s' % self.path)
+            finally:
+                probe.close()
+        self._server = _Server(self.path, _Handler)
+        self._server.owner = self
+        os.chmod(self.path, 0o600)
+        return self
+
+    def serve_forever(self):
+        if self._server is None:
+            self.bind()
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve on a background thread."""
+        if self._server is None:
+            self.bind()
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='libexword-daemon', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._server is not None:
+            if self._thread is not None:
+                self._server.shutdown()
+                self._thread.join()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.manager.close_all()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _name(self, spec):
+        if spec.get('device'):
+            return spec['device']
+        if spec.get('path'):
+            return 'path:' + spec['path']
+        return 'index:%d' % spec.get('index', 0)
+
+    def _attach(self, spec):
+        """Name of the device spec asks for, opened if it is not yet."""
+        name = self._name(spec)
+        with self._lock:
+            job = None
+            if name not in self.manager:
+                options = self.devices.get(name)
+                if options is None:
+                    if spec.get('device'):
+                        raise ExwordError(-1, 'no device called %s' % name)
+                    options = {'path': spec['path']} if spec.get('path') else {'index': spec.get('index', 0)}
+                job = self.manager.open(name, **options)
+                self._generation.setdefault(name, 0)
+        if job is not None:
+            try:
+                job.wait()
+            except Exception:
+                self.manager.close(name)
+                raise
+        return name
+
+    def _run(self, name, func, *args, priority=sched.NORMAL):
+        return self.manager.submit(name, lambda job, session: func(session, *args),
+                                   priority=priority).wait()
+
+    def _serve(self, sock):
+        if not _same_user(sock):
+            return
+        try:
+            hello = _recv(sock)
+        except (ConnectionError, ValueError):
+            return
+        if hello[0] == 'abort':
+            name = self._name(hello[1])
+            if name in self.manager:
+                self.manager.session(name).abort()
+            _send(sock, ('ok', None, None))
+            return
+        try:
+            name = self._attach(hello[1])
+            info = self._run(name, lambda s: {'sd_inserted': s.sd_inserted, 'cwd': s.cwd})
+        except Exception as e:
+            _send(sock, _error(e))
+            return
+        fds = [_shared_fd(_HEADER + self.ring_size, os.path.dirname(self.path)) for i in range(2)]
+        try:
+            conn = _Connection(sock, Ring(fds[0]), Ring(fds[1]))
+            _send(sock, ('ok', info, self._generation[name]), fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        try:
+            while True:
+                request = _recv(sock)
+                if request[0] == 'cancel':
+                    # arrived after the transfer it was meant for had ended
+                    continue
+                _send(sock, self._request(name, conn, *request))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def _request(self, name, conn, op, cwd, args, kwargs, priority=sched.NORMAL):
+        args = tuple(args)
+        try:
+            if op in _DIRECT:
+                session = self.manager.session(name)
+                result = getattr(session, op)
+                if callable(result):
+                    result = result(*args, **kwargs)
+            elif op == 'send':
+                result = self._run(name, _upload, conn, cwd, *args, priority=priority)
+            elif op == 'get':
+                result = self._run(name, _download, conn, cwd, *args, priority=priority)
+            elif op in _CALLS:
+                result = self._run(name, _call, op, cwd, args, kwargs, priority=priority)
+            else:
+                raise ValueError('unknown request %s' % op)
+        except Exception as e:
+            return _error(e)
+        finally:
+            if op in _WRITES or (op == 'setpath' and (args[1:2] == (True,) or kwargs.get('mkdir'))):
+                with self._lock:
+                    self._generation[name] += 1
+        return ('ok', result, self._generation[name])
+
+
+# --- client ---
+
+class RemoteSession(object):
+    """A Session of the daemon, with the same methods.
+
+    Closing it only drops the connection; the device stays connected in
+    the daemon.  One request runs at a time per RemoteSession, open more
+    of them to use a device from several threads.  admini and
+    content_keys are kept here and cleared when another client changed
+    the device.
+    """
+
+    def __init__(self, index=0, path=None, device=None, socket_path=None):
+        self.spec = {'index': index, 'path': path, 'device': device}
+        self.socket_path = socket_path or default_socket()
+        self.cwd = None
+        self.sd_inserted = False
+        self.admini = {}
+        self.content_keys = {}
+        self._sock = None
+        self._upload = self._download = None
+        self._generation = None
+        self._transfer_cb = None
+        self._transfer_interval = 0.0
+        self._reported = 0.0
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def open(self):
+        with self._lock:
+            if self._sock is not None:
+                return self
+            try:
+                sock = _connect(self.socket_path)
+            except OSError as e:
+                raise ExwordError(-1, 'daemon not reachable: %s' % e)
+            try:
+                _send(sock, ('hello', self.spec))
+                reply, fds = _recv_fds(sock, 2)
+                if reply[0] != 'ok':
+                    _raise(reply)
+                try:
+                    self._upload, self._download = Ring(fds[0]), Ring(fds[1])
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+            except OSError as e:
+                sock.close()
+                raise ExwordError(-1, 'daemon not reachable: %s' % e)
+            except BaseException:
+                sock.close()
+                raise
+            self._sock = sock
+            self.sd_inserted = reply[1]['sd_inserted']
+            self.cwd = reply[1]['cwd']
+            self._generation = reply[2]
+            return self
+
+    def close(self):
+        with self._lock:
+            if self._sock is None:
+                return
+            self._sock.close()
+            self._sock = None
+            self._upload.close()
+            self._download.close()
+            self.cwd = None
+
+    def abort(self):
+        """Make the command running on the device fail promptly.  Works from
+        any thread, over a connection of its own."""
+        try:
+            sock = _connect(self.socket_path)
+        except (OSError, ExwordError):
+            return
+        try:
+            _send(sock, ('abort', self.spec))
+            _recv(sock)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def _require(self):
+        if self._sock is None:
+            raise ExwordError(-1, 'not connected')
+        return self._sock
+
+    def _reply(self, reply, write):
+        if reply[0] != 'ok':
+            _raise(reply)
+        if reply[2] != self._generation + (1 if write else 0):
+            # someone else changed the device
+            self.admini.clear()
+            self.content_keys.clear()
+        self._generation = reply[2]
+        return reply[1]
+
+    def _call(self, op, *args, **kwargs):
+        with self._lock:
+            sock = self._require()
+            try:
+                _send(sock, (op, self.cwd, args, kwargs, sched.current()))
+                reply = _recv(sock)
+            except OSError as e:
+                self.close()
+                raise ExwordError(-1, 'daemon connection lost: %s' % e)
+            return self._reply(reply, op in _WRITES)
+
+    def _push(self, name, length, read, cancel):
+        """Upload length bytes that read(view) fills into the upload ring."""
+        with self._lock:
+            sock = self._require()
+            ring = self._upload
+            _send(sock, ('send', self.cwd, (name, length, ring.head), {}, sched.current()))
+            self._reported = 0.0
+            sent = 0
+            delay = _MIN_WAIT
+            stopped = None
+            while sent < length:
+                if cancel is not None and cancel():
+                    stopped = ExwordError(-1, 'transfer cancelled')
+                    break
+                space = ring.writable()[:length - sent]
+                if space:
+                    n = read(space)
+                    if not n:
+                        stopped = ValueError('source ended after %d of %d bytes' % (sent, length))
+                        break
+                    ring.commit(n)
+                    sent += n
+                    delay = _MIN_WAIT
+                    if self._transfer_cb is not None and (sent == length or self._due()):
+                        self._transfer_cb(name, sent, length)
+                    continue
+                if _readable(sock, delay):
+                    # answered before everything was sent: an error
+                    break
+                delay = min(delay * 2, _MAX_WAIT)
+            if stopped is not None:
+                _send(sock, ('cancel',))
+            reply = _recv(sock)
+            if stopped is not None and reply[0] != 'ok':
+                raise stopped
+            return self._reply(reply, True)
+
+    def _pull(self, name, sink, cancel):
+        """Download name, passing each piece of the download ring to sink."""
+        with self._lock:
+            sock = self._require()
+            ring = self._download
+            _send(sock, ('get', self.cwd, (name,), {}, sched.current()))
+            self._reported = 0.0
+            received = 0
+            delay = _MIN_WAIT
+            reply = end = None
+            cancelled = False
+            while True:
+                data = ring.readable(end)
+                if data:
+                    sink(data)
+                    ring.consume(len(data))
+                    received += len(data)
+                    delay = _MIN_WAIT
+                    if self._transfer_cb is not None and self._due():
+                        self._transfer_cb(name, received, 0)
+                    continue
+                if reply is not None:
+                    break
+                if cancel is not None and not cancelled and cancel():
+                    _send(sock, ('cancel',))
+                    cancelled = True
+                if _readable(sock, delay):
+                    reply = _recv(sock)
+                    if reply[0] != 'ok':
+                        ring.skip_to(ring.head)
+                        break
+                    end = reply[1][1]
+                delay = min(delay * 2, _MAX_WAIT)
+            if cancelled and reply[0] != 'ok':
+                raise ExwordError(-1, 'transfer cancelled')
+            return self._reply(reply, False)[0]
+
+    # --- Session methods ---
+
+    storage_root = Session.storage_root
+    iter_file = Session.iter_file
+
+    def set_transfer_callback(self, callback, interval=0.0):
+        self._transfer_cb = callback
+        self._transfer_interval = interval
+
+    def _due(self):
+        # like the C library: the first piece, then at most once per interval
+        now = time.monotonic()
+        if now - self._reported < self._transfer_interval:
+            return False
+        self._reported = now
+        return True
+
+    @property
+    def mtu(self):
+        return self._call('mtu')
+
+    @property
+    def rtt(self):
+        return self._call('rtt')
+
+    def setpath(self, path, mkdir=False):
+        with self._lock:
+            try:
+                self._call('setpath', path, mkdir)
+            except ExwordError:
+                self.cwd = None
+                raise
+            self.cwd = path
+
+    def chdir(self, path, mkdir=False):
+        with self._lock:
+            if self.cwd is not None and cache_key(self.cwd) == cache_key(path):
+                return False
+            self.setpath(path, mkdir)
+            return True
+
+    def list(self, path=None):
+        with self._lock:
+            result = self._call('list', path)
+            if path is not None:
+                self.cwd = path
+            return result
+
+    list_view = list
+
+    def listdir(self, path, refresh=False, view=False):
+        result = self._call('listdir', path, refresh)
+        return tuple(result) if view else result
+
+    def send_file(self, name, data):
+        view = memoryview(data).cast('B')
+        pos = [0]
+
+        def read(space):
+            n = min(len(space), len(view) - pos[0])
+            space[:n] = view[pos[0]:pos[0] + n]
+            pos[0] += n
+            return n
+        self._push(name, len(view), read, None)
+
+    def send_mapped(self, name, path):
+        with open(path, 'rb') as f:
+            self.send_stream(name, f, os.fstat(f.fileno()).st_size)
+
+    def send_stream(self, name, src, length=None, cancel=None):
+        if length is None:
+            length = _stream_length(src)
+        if hasattr(src, 'read'):
+            read = _file_reader(src)
+        elif isinstance(src, (bytes, bytearray, memoryview)):
+            read = _iter_reader(iter([src]))
+        else:
+            read = _iter_reader(iter(src))
+        self._push(name, length, read, cancel)
+
+    def get_file(self, name):
+        data = bytearray()
+        self._pull(name, data.extend, None)
+        return bytes(data)
+
+    def get_stream(self, name, dst, cancel=None):
+        write = dst.write if hasattr(dst, 'write') else dst
+        return self._pull(name, lambda data: write(bytes(data)), cancel)
+
+
+def _forward(op):
+    def method(self, *args, **kwargs):
+        return self._call(op, *args, **kwargs)
+    method.__name__ = op
+    method.__doc__ = getattr(Session, op).__doc__
+    return method
+
+
+for _op in ('remove_file', 'model', 'capacity', 'sd_format', 'unlock', 'lock', 'cname',
+            'cryptkey', 'dict_list', 'dict_auth', 'dict_reset', 'dict_install', 'dict_remove',
+            'dict_decrypt', 'set_pipeline', 'stats', 'trace', 'reset_stats', 'unit'):
+    setattr(RemoteSession, _op, _forward(_op))
+del _op
+
+
+def connect(index=0, path=None, device=None, socket_path=None):
+    """An open RemoteSession for the device at USB index, path or called
+    device, served by the daemon listening on socket_path."""
+    return RemoteSession(index, path, device, socket_path).open()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', help='socket path (default %s)' % default_socket())
+    parser.add_argument('--mock', action='store_true',
+                        help='also serve the emulator as device "%s"' % EMULATOR)
+    parser.add_argument('--ring', type=int, default=RING_SIZE >> 20,
+                        help='MiB of shared memory per direction and client')
+    parser.add_argument('--max-mtu', type=lambda v: int(v, 0), default=0,
+                        help='MTU to request from devices (0: legacy)')
+    parser.add_argument('--pipeline', action='store_true', help='pipelined PUT')
+    args = parser.parse_args(argv)
+    devices = {}
+    if args.mock:
+        from . import mock
+        devices[EMULATOR] = {'transport': mock.MockDevice(0.0005, 8e6, None)}
+    daemon = Daemon(args.socket, args.ring << 20, devices,
+                    max_mtu=args.max_mtu, pipeline=args.pipeline).bind()
+    print('listening on %s' % daemon.path, flush=True)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Add-on dictionary export pipeline
+
+dict_decrypt() in dict.c copies an installed add-on to a local directory
+named after its id, deciphering the .htm/.bmp/.txt files.  decrypt()
+does the same with the work spread out: the calling thread, the only
+one touching the Session, downloads the files one after the other while
+a thread pool deciphers and writes the ones already received.  At most
+`depth` downloaded files wait for the pool.
+
+The content key is recovered from diction.htm, which has to be
+downloaded in full.  content_key() remembers it in session.content_keys
+per storage root, id and admini.inf key, so exporting the same add-on
+again skips that download.
+"""
+import collections
+import concurrent.futures
+import os
+
+from . import admini
+from . import crypt
+from .cache import cache_key
+from .session import ExwordError, join_path
+
+
+def content_key(session, id, root=None, addon=None):
+    """Content key of installed add-on id (crypt.crack_key of diction.htm)."""
+    root = root or session.storage_root()
+    if addon is None:
+        addon = admini.find(session, id, root)
+        if addon is None:
+            raise ExwordError(-1, 'No dictionary with id %s installed' % id)
+    k = (cache_key(root), id, addon.key)
+    key = session.content_keys.get(k)
+    if key is None:
+        session.chdir(join_path(root, id, '_CONTENT'))
+        try:
+            key = crypt.crack_key(session.get_file('diction.htm'))
+        except ValueError:
+            raise ExwordError(-1, 'Dictionary with id %s is invalid' % id)
+        session.content_keys[k] = key
+    return key
+
+
+class DecryptPipeline(object):
+    """Download files on this thread, decipher and write them on a pool."""
+
+    def __init__(self, session, key, workers=None, depth=4):
+        self.session = session
+        self.key = key
+        self.workers = workers
+        self.depth = max(1, depth)
+
+    def store(self, name, data, path):
+        if crypt.is_encrypted(name):
+            data = crypt.xor_inplace(bytearray(data), self.key)
+        tmp = path + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    def run(self, names, directory, job=None):
+        """Save the files names of the current device directory into
+        directory.  Returns the number of bytes written."""
+        names = list(names)
+        written = 0
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            pending = collections.deque()
+            try:
+                for done, name in enumerate(names, 1):
+                    if job is not None:
+                        job.check()
+                    data = self.session.get_file(name)
+                    pending.append(pool.submit(self.store, name, data,
+                                               os.path.join(directory, name)))
+                    # the deque bounds how many received files wait in memory
+                    while len(pending) >= self.depth:
+                        written += pending.popleft().result()
+                    if job is not None:
+                        job.progress(name, done, len(names))
+                while pending:
+                    written += pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+        return written
+
+
+def decrypt(session, id, directory='.', root=None, job=None, workers=None, depth=4):
+    """Export installed add-on id into directory/id, like `dict decrypt`.
+
+    Returns the names of the files written.  The current path is restored
+    afterwards.
+    """
+    root = root or session.storage_root()
+    cwd = session.cwd
+    try:
+        key = content_key(session, id, root)
+        try:
+            session.chdir(join_path(root, id, '_CONTENT'))
+        except ExwordError:
+            raise ExwordError(-1, 'Dictionary %s does not exist' % id)
+        names = [e.name for e in session.list()
+                 if not e.is_dir and os.path.splitext(e.name)[1].lower() != '.cjs']
+        target = os.path.join(directory, id)
+        os.makedirs(target, exist_ok=True)
+        DecryptPipeline(session, key, workers, depth).run(names, target, job)
+    finally:
+        if cwd is not None and session.connected:
+            session.chdir(cwd)
+    return names
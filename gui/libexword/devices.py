@@ -0,0 +1,134 @@
+"""Device discovery
+
+list_devices() returns every connected EX-word with its USB bus and port
+path.  The port path stays the same when a device is replugged into the
+same socket, so it names a device across reconnects; the open index used
+by exword_open_index() is only valid until the next device change.
+
+DeviceWatcher reports devices arriving and leaving.  Where libusb supports
+hotplug its thread sleeps in exword_hotplug_handle_events() until the
+kernel reports a change, so events arrive immediately and an idle watcher
+uses no CPU.  Elsewhere it falls back to comparing list_devices() every
+`interval` seconds.
+"""
+import collections
+import threading
+
+from . import _native
+from ._native import EXWORD_DEVICE_ARRIVED as ARRIVED, EXWORD_DEVICE_LEFT as LEFT
+from .session import ExwordError
+
+
+class DeviceInfo(collections.namedtuple('DeviceInfo', 'index bus address ports')):
+    """A connected device; index is None when it is not known (hotplug events)."""
+    __slots__ = ()
+
+    @property
+    def path(self):
+        """Bus and port path, e.g. '1-1.4' (the form Linux uses in sysfs)."""
+        if not self.ports:
+            return '%d' % self.bus
+        return '%d-%s' % (self.bus, '.'.join(str(p) for p in self.ports))
+
+
+def _device_info(c):
+    return DeviceInfo(c.index if c.index >= 0 else None, c.bus, c.address,
+                      tuple(c.ports[:c.port_count]))
+
+
+def list_devices():
+    """All connected EX-word devices, in exword_open_index() order."""
+    lib = _native.load()
+    size = 8
+    while True:
+        infos = (_native.exword_device_info_t * size)()
+        count = lib.exword_list_devices(infos, size)
+        if count < 0:
+            raise ExwordError(-1, 'USB enumeration failed')
+        if count <= size:
+            return [_device_info(infos[i]) for i in range(count)]
+        size = count
+
+
+def find_index(path):
+    """Current open index of the device at port path, or None."""
+    for info in list_devices():
+        if info.path == path:
+            return info.index
+    return None
+
+
+class DeviceWatcher(object):
+    """Call on_change(event, info) for every device arriving (ARRIVED) or
+    leaving (LEFT), starting with the devices already connected.
+
+    Callbacks run on the watcher thread unless post is given, e.g.
+    DeviceWorker.post to deliver them on the Tk thread.
+    """
+
+    def __init__(self, on_change, post=None, interval=1.0):
+        self.on_change = on_change
+        self.post = post
+        self.interval = interval
+        self._hotplug = None
+        self._c_callback = _native.hotplug_cb(self._on_hotplug)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def hotplug(self):
+        """True if events come from libusb hotplug rather than polling."""
+        return self._hotplug is not None
+
+    def start(self):
+        lib = _native.load()
+        # existing devices are reported from inside register
+        self._hotplug = lib.exword_hotplug_register(self._c_callback, None)
+        target = self._run_hotplug if self._hotplug else self._run_poll
+        self._thread = threading.Thread(target=target, name='libexword-hotplug', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        lib = _native.load()
+        if self._hotplug:
+            lib.exword_hotplug_stop(self._hotplug)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._hotplug:
+            lib.exword_hotplug_free(self._hotplug)
+            self._hotplug = None
+
+    def _emit(self, event, info):
+        if self.post is not None:
+            self.post(self.on_change, event, info)
+        else:
+            self.on_change(event, info)
+
+    def _on_hotplug(self, event, info, user_data):
+        self._emit(event, _device_info(info.contents))
+
+    def _run_hotplug(self):
+        lib = _native.load()
+        while not self._stopping.is_set():
+            # woken early by exword_hotplug_stop()
+            if lib.exword_hotplug_handle_events(self._hotplug, 60000) < 0:
+                break
+
+    def _run_poll(self):
+        known = {}
+        while True:
+            try:
+                current = dict((d.path, d) for d in list_devices())
+            except ExwordError:
+                current = known
+            for path in [p for p in known if p not in current]:
+                self._emit(LEFT, known.pop(path))
+            for path, info in current.items():
+                if path not in known:
+                    known[path] = info
+                    self._emit(ARRIVED, info)
+            if self._stopping.wait(self.interval):
+                break
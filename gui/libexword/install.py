@@ -0,0 +1,316 @@
+"""Add-on dictionary install pipeline
+
+dict_install() in dict.c reads, ciphers and uploads one file after the
+other, so the USB link sits idle while the next file is prepared.
+install_zip() performs the same device steps but overlaps the work: a
+thread pool inflates and ciphers upcoming files (zlib and NumPy release
+the GIL) while the calling thread, the only one touching the Session,
+uploads them in archive order.  At most `depth` prepared files wait in
+memory.  With mapped=True the archive is memory-mapped instead and each
+member is streamed into the packets as it is sent (StreamPipeline, see
+zipmap.py): no whole file is ever held in memory, so the footprint does
+not grow with the size of the pack.
+
+sync_zip() installs or updates an add-on but skips the files a
+manifest.ManifestStore says are already on the device unchanged;
+sync_library() does the same for a pack kept in a library.Library.
+"""
+import collections
+import concurrent.futures
+import functools
+import os
+import re
+import zipfile
+
+from . import admini
+from . import crypt
+from . import manifest
+from .session import ExwordError, join_path
+from .zipmap import MappedZip
+
+# dict.c key1, the key new add-ons are registered with
+KEY1 = bytes.fromhex('4272b7b59e308345c3b5415371c49500')
+
+
+def title(diction_htm):
+    """Add-on name from the <title> of diction.htm (raw bytes) or None."""
+    m = re.search(b'<title>(.*?)</title>', diction_htm, re.S)
+    return m.group(1) if m else None
+
+
+def zip_members(zf, id=None):
+    """Return (id, [ZipInfo]) for the add-on stored in zf.
+
+    The files are either at the top of the archive or inside a single
+    directory named after the id; like dict_install() only the files
+    directly inside it are installed.
+    """
+    files = [i for i in zf.infolist() if not i.is_dir()]
+    tops = set(i.filename.split('/', 1)[0] for i in files if '/' in i.filename)
+    nested = len(tops) == 1 and all('/' in i.filename for i in files)
+    if id is None:
+        if nested:
+            id = tops.pop()
+        else:
+            id = os.path.splitext(os.path.basename(zf.filename or 'dict'))[0]
+    prefix = id + '/' if nested else ''
+    members = [i for i in files
+               if i.filename.startswith(prefix) and '/' not in i.filename[len(prefix):]]
+    return id, members
+
+
+class InstallPipeline(object):
+    """Prepare files on a thread pool, upload them in order on this thread."""
+
+    def __init__(self, session, workers=None, depth=4, key=crypt.INSTALL_KEY):
+        self.session = session
+        self.workers = workers
+        self.depth = max(1, depth)
+        self.key = key
+
+    def prepare(self, name, load):
+        data = bytearray(load())
+        if crypt.is_encrypted(name):
+            crypt.xor_inplace(data, self.key)
+        return data
+
+    def run(self, items, job=None, on_file=None):
+        """Upload items, an iterable of (name, load) where load() returns
+        the plain file contents.  on_file(name) is called after each upload.
+        Returns the number of bytes sent."""
+        items = list(items)
+        cancel = (lambda: job.cancelled) if job is not None else None
+        sent = 0
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            pending = collections.deque()
+            queued = iter(items)
+
+            def fill():
+                # the deque is the bounded queue between pool and sender
+                while len(pending) < self.depth:
+                    item = next(queued, None)
+                    if item is None:
+                        return
+                    pending.append((item[0], pool.submit(self.prepare, *item)))
+            try:
+                fill()
+                done = 0
+                while pending:
+                    name, future = pending.popleft()
+                    fill()
+                    data = future.result()
+                    if job is not None:
+                        job.check()
+                    self.session.send_stream(name, memoryview(data), len(data), cancel=cancel)
+                    sent += len(data)
+                    done += 1
+                    if on_file is not None:
+                        on_file(name)
+                    if job is not None:
+                        job.progress(name, done, len(items))
+            finally:
+                for name, future in pending:
+                    future.cancel()
+        return sent
+
+
+class StreamPipeline(object):
+    """Upload members of a zipmap.MappedZip one after the other, straight
+    from the mapping: STORED members that are not ciphered go out as the
+    mapped bytes, the others are inflated and ciphered a packet at a time."""
+
+    def __init__(self, session, archive, key=crypt.INSTALL_KEY):
+        self.session = session
+        self.archive = archive
+        self.key = key
+
+    def send(self, name, info, cancel=None):
+        key = self.key if crypt.is_encrypted(name) else None
+        data = self.archive.buffer(info) if key is None else None
+        try:
+            if data is not None:
+                self.session.send_file(name, data)
+                return
+            reader = self.archive.open(info, key)
+            try:
+                self.session.send_stream(name, reader, info.file_size, cancel=cancel)
+            finally:
+                reader.close()
+        finally:
+            # the mapping cannot be closed while data exports it
+            del data
+            self.archive.release(info)
+
+    def run(self, items, job=None, on_file=None):
+        """Upload items, an iterable of (name, ZipInfo); otherwise like
+        InstallPipeline.run()."""
+        items = list(items)
+        cancel = (lambda: job.cancelled) if job is not None else None
+        sent = 0
+        for done, (name, info) in enumerate(items, 1):
+            if job is not None:
+                job.check()
+            self.send(name, info, cancel)
+            sent += info.file_size
+            if on_file is not None:
+                on_file(name)
+            if job is not None:
+                job.progress(name, done, len(items))
+        return sent
+
+
+def _open_zip(path, mapped):
+    return MappedZip(path) if mapped else zipfile.ZipFile(path)
+
+
+def install_zip(session, path, id=None, root=None, job=None, workers=None, depth=4,
+                mapped=False):
+    """Install the add-on in ZIP file path, like `dict install` does for
+    a directory.  Returns the add-on id.
+
+    mapped=True streams the members from a mapping of the archive
+    (StreamPipeline) instead of preparing whole files on a thread pool.
+    """
+    root = root or session.storage_root()
+    with _open_zip(path, mapped) as archive:
+        zf = archive.zf if mapped else archive
+        id, members = zip_members(zf, id)
+        names = dict((os.path.basename(i.filename), i) for i in members)
+        if 'diction.htm' not in names:
+            raise ExwordError(-1, '%s: missing diction.htm' % id)
+        name = title(zf.read(names['diction.htm']))
+        if name is None:
+            raise ExwordError(-1, '%s: diction.htm has no title' % id)
+        if admini.find(session, id, root) is not None:
+            raise ExwordError(-1, 'Dictionary with id %s already installed' % id)
+        size = sum(i.file_size for i in members)
+        session.setpath(root)
+        if size >= session.capacity().free:
+            raise ExwordError(-1, 'Insufficient space on device')
+        session.unlock()
+        try:
+            session.cname(name, id)
+            session.cryptkey(*admini.cryptkey_blocks(KEY1))
+            session.setpath(join_path(root, id, '_CONTENT'), mkdir=True)
+            if job is not None:
+                job.expect(size)
+            if mapped:
+                StreamPipeline(session, archive).run(
+                    ((os.path.basename(i.filename), i) for i in members), job)
+            else:
+                pipeline = InstallPipeline(session, workers, depth)
+                pipeline.run(((os.path.basename(i.filename), functools.partial(zf.read, i))
+                              for i in members), job)
+            session.setpath(join_path(root, id, '_USER'), mkdir=True)
+        except BaseException:
+            try:
+                session.lock()
+            except ExwordError:
+                pass
+            raise
+        session.lock()
+    return id
+
+
+SyncResult = collections.namedtuple('SyncResult', 'id uploaded skipped removed sent')
+
+
+def sync_zip(session, path, store, device=None, id=None, root=None, job=None,
+             workers=None, depth=4, mapped=False):
+    """Install the add-on in ZIP file path, or bring an installed copy up
+    to date, transferring only missing or changed files.
+
+    store is a manifest.ManifestStore; device names the device in it
+    (default manifest.device_key(session)).  A file is skipped when it is
+    listed in _CONTENT and the manifest has the same size and CRC-32 as
+    the archive member; files no longer in the archive are removed.
+    Without a manifest for an installed add-on every file is sent again.
+    mapped works as in install_zip().  Returns a SyncResult.
+    """
+    with _open_zip(path, mapped) as archive:
+        zf = archive.zf if mapped else archive
+        id, members = zip_members(zf, id)
+        names = dict((os.path.basename(i.filename), i) for i in members)
+        if 'diction.htm' not in names:
+            raise ExwordError(-1, '%s: missing diction.htm' % id)
+        name = title(zf.read(names['diction.htm']))
+        if name is None:
+            raise ExwordError(-1, '%s: diction.htm has no title' % id)
+        local = dict((n, list(manifest.zip_digest(i))) for n, i in names.items())
+        if mapped:
+            return _sync(session, id, name, local, names, store, device, root, job,
+                         StreamPipeline(session, archive))
+        loaders = dict((n, functools.partial(zf.read, i)) for n, i in names.items())
+        return _sync(session, id, name, local, loaders, store, device, root, job,
+                     InstallPipeline(session, workers, depth))
+
+
+def sync_library(session, library, pack, store, device=None, root=None, job=None,
+                 workers=None, depth=4):
+    """sync_zip() for pack in a library.Library; files are read from its
+    blob store."""
+    info = library.get(pack)
+    if info is None:
+        raise ExwordError(-1, '%s: not in the library' % pack)
+    files = library.files(pack)
+    if not info.id or not info.title or 'diction.htm' not in [f.name for f in files]:
+        raise ExwordError(-1, '%s: missing diction.htm' % pack)
+    local = library.digests(pack)
+    loaders = dict((f.name, functools.partial(library.read, f.blob)) for f in files)
+    return _sync(session, info.id, info.title, local, loaders, store, device, root, job,
+                 InstallPipeline(session, workers, depth))
+
+
+def _sync(session, id, name, local, loaders, store, device, root, job, pipeline):
+    # loaders holds what pipeline.run() takes with each name
+    root = root or session.storage_root()
+    if device is None:
+        device = manifest.device_key(session)
+    addon = admini.find(session, id, root)
+    key = addon.key if addon is not None else KEY1
+    known = store.load(device, root, id) if addon is not None else None
+    if known is None or known.key != key:
+        known = manifest.Manifest(id, name, key)
+    known.name = name
+    known.complete = False
+    session.setpath(root)
+    session.unlock()
+    try:
+        session.cname(name, id)
+        session.cryptkey(*admini.cryptkey_blocks(key))
+        session.setpath(join_path(root, id, '_CONTENT'), mkdir=True)
+        present = set(e.name for e in session.list() if not e.is_dir)
+        upload = [n for n in loaders if n not in present or known.files.get(n) != local[n]]
+        removed = sorted(present - set(loaders))
+        size = sum(local[n][0] for n in upload)
+        # the rule planner.plan() uses: files replaced or removed give back
+        # what the manifest recorded for them
+        freed = sum(known.files[n][0] for n in set(upload) | set(removed)
+                    if n in present and n in known.files)
+        if size and max(0, size - freed) >= session.capacity().free:
+            raise ExwordError(-1, 'Insufficient space on device')
+        for n in removed:
+            session.remove_file(n)
+            known.files.pop(n, None)
+        # a half written file must not look up to date after a failure
+        for n in upload:
+            known.files.pop(n, None)
+        store.save(device, root, known)
+
+        def uploaded(n):
+            known.files[n] = local[n]
+            store.save(device, root, known)
+        if job is not None:
+            job.expect(size)
+        sent = pipeline.run(((n, loaders[n]) for n in upload), job, uploaded)
+        session.setpath(join_path(root, id, '_USER'), mkdir=True)
+    except BaseException:
+        try:
+            session.lock()
+        except ExwordError:
+            pass
+        raise
+    session.lock()
+    known.complete = True
+    store.save(device, root, known)
+    return SyncResult(id, upload, len(loaders) - len(upload), removed, sent)
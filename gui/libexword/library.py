@@ -0,0 +1,279 @@
+"""Host-side dictionary library
+
+The manager list keeps every add-on pack the user has collected.  Its
+metadata lives in a SQLite database and the files in a content-addressed
+blob directory, so identical files shared by several packs or revisions
+are stored once and opening the manager is a single indexed query
+instead of a directory scan:
+
+    <directory>/library.db
+    <directory>/blobs/ab/abcdef...      (SHA-256 of the plain file)
+
+    lib = Library()
+    lib.add_zip('/path/to/pack.zip')
+    for pack in lib.packs():
+        print(pack.name, pack.source)
+    install.sync_library(session, lib, 'pack', ManifestStore())
+
+Files are kept as they are in the pack, before the install cipher is
+applied.  Each file also records its CRC-32 so manifest digests of
+packs installed from the library match those of install.sync_zip().
+"""
+import collections
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+from . import install
+from . import manifest
+from .session import ExwordError
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS packs (
+    pack INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    id TEXT,
+    title BLOB,
+    source TEXT NOT NULL,
+    origin TEXT,
+    revision INTEGER NOT NULL DEFAULT 1,
+    added REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packs_id ON packs (id);
+CREATE INDEX IF NOT EXISTS packs_source ON packs (source);
+CREATE INDEX IF NOT EXISTS packs_origin ON packs (origin);
+CREATE TABLE IF NOT EXISTS files (
+    pack INTEGER NOT NULL REFERENCES packs (pack) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    crc32 INTEGER NOT NULL,
+    blob TEXT NOT NULL,
+    PRIMARY KEY (pack, name)
+);
+CREATE INDEX IF NOT EXISTS files_blob ON files (blob);
+'''
+
+Pack = collections.namedtuple('Pack', 'name id title source origin revision added')
+PackFile = collections.namedtuple('PackFile', 'name size crc32 blob')
+
+_PACK_COLUMNS = 'name, id, title, source, origin, revision, added'
+
+
+def default_directory():
+    base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'libexword', 'library')
+
+
+def _pack(row):
+    return Pack(row[0], row[1], bytes(row[2]) if row[2] is not None else None, *row[3:])
+
+
+class Library(object):
+    """Packs and their files; safe to share between threads."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_directory()
+        self.blob_dir = os.path.join(self.directory, 'blobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.directory, 'library.db'),
+                                   check_same_thread=False)
+        self._lock = threading.RLock()
+        # held from writing blobs until the files referencing them are
+        # committed, so a concurrent remove() cannot collect them; lookups
+        # only take _lock and never wait for an import
+        self._blob_lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute('PRAGMA foreign_keys = ON')
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _query(self, sql, *args):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    # --- lookup ---
+
+    def __contains__(self, name):
+        return bool(self._query('SELECT 1 FROM packs WHERE name = ?', name))
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM packs')[0][0]
+
+    def packs(self, source=None):
+        """All packs (or those from source) ordered by name."""
+        if source is None:
+            rows = self._query('SELECT %s FROM packs ORDER BY name' % _PACK_COLUMNS)
+        else:
+            rows = self._query('SELECT %s FROM packs WHERE source = ? ORDER BY name'
+                               % _PACK_COLUMNS, source)
+        return [_pack(r) for r in rows]
+
+    def get(self, name):
+        """The pack called name or None."""
+        rows = self._query('SELECT %s FROM packs WHERE name = ?' % _PACK_COLUMNS, name)
+        return _pack(rows[0]) if rows else None
+
+    def by_id(self, id):
+        """Packs holding the add-on with dictionary id."""
+        rows = self._query('SELECT %s FROM packs WHERE id = ? ORDER BY name' % _PACK_COLUMNS, id)
+        return [_pack(r) for r in rows]
+
+    def by_origin(self, origin):
+        rows = self._query('SELECT %s FROM packs WHERE origin = ? ORDER BY name'
+                           % _PACK_COLUMNS, origin)
+        return [_pack(r) for r in rows]
+
+    def files(self, name):
+        """[PackFile] of pack name, ordered by file name."""
+        return [PackFile(*r) for r in self._query(
+            'SELECT f.name, f.size, f.crc32, f.blob FROM files f JOIN packs p USING (pack) '
+            'WHERE p.name = ? ORDER BY f.name', name)]
+
+    def sizes(self):
+        """{pack name: total size of its files}, packs without files omitted."""
+        return dict(self._query('SELECT p.name, SUM(f.size) FROM packs p JOIN files f USING (pack) '
+                                'GROUP BY p.pack'))
+
+    def blob_path(self, blob):
+        return os.path.join(self.blob_dir, blob[:2], blob)
+
+    def read(self, blob):
+        with open(self.blob_path(blob), 'rb') as f:
+            return f.read()
+
+    def usage(self):
+        """(bytes referenced by packs, bytes stored after dedupe)."""
+        rows = self._query('SELECT COALESCE(SUM(size), 0) FROM files')
+        stored = self._query('SELECT COALESCE(SUM(size), 0) FROM '
+                             '(SELECT blob, MAX(size) AS size FROM files GROUP BY blob)')
+        return rows[0][0], stored[0][0]
+
+    # --- changes ---
+
+    def _put_blob(self, load):
+        """Store the data load() returns; returns (size, crc32, blob)."""
+        data = load()
+        blob = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(blob)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        return len(data), zlib.crc32(data) & 0xffffffff, blob
+
+    def add(self, name, source, origin=None, id=None, title=None, items=()):
+        """Add pack name, or a new revision of it when it already exists.
+
+        items is an iterable of (file name, load) where load() returns the
+        file contents.  Returns the Pack.
+        """
+        with self._blob_lock:
+            return self._add(name, source, origin, id, title, items)
+
+    def _add(self, name, source, origin, id, title, items):
+        stored = [(n,) + self._put_blob(load) for n, load in items]
+        old = []
+        with self._lock, self._db:
+            row = self._db.execute('SELECT pack, revision FROM packs WHERE name = ?',
+                                   (name,)).fetchone()
+            if row is None:
+                cur = self._db.execute(
+                    'INSERT INTO packs (name, id, title, source, origin, added) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (name, id, title, source, origin, time.time()))
+                pack = cur.lastrowid
+            else:
+                pack = row[0]
+                self._db.execute(
+                    'UPDATE packs SET id = ?, title = ?, source = ?, origin = ?, revision = ?, '
+                    'added = ? WHERE pack = ?',
+                    (id, title, source, origin, row[1] + 1, time.time(), pack))
+                old = [r[0] for r in self._db.execute('SELECT blob FROM files WHERE pack = ?',
+                                                      (pack,))]
+                self._db.execute('DELETE FROM files WHERE pack = ?', (pack,))
+            self._db.executemany('INSERT INTO files (pack, name, size, crc32, blob) '
+                                 'VALUES (?, ?, ?, ?, ?)', [(pack,) + s for s in stored])
+        self._collect(old)
+        return self.get(name)
+
+    def add_zip(self, path, name=None, id=None, source='zip'):
+        """Import the add-on in ZIP file path (laid out as for install_zip)."""
+        with zipfile.ZipFile(path) as zf:
+            id, members = install.zip_members(zf, id)
+            items = [(os.path.basename(i.filename), lambda i=i: zf.read(i)) for i in members]
+            htm = [i for i in members if os.path.basename(i.filename) == 'diction.htm']
+            htm_title = install.title(zf.read(htm[0])) if htm else None
+            return self.add(name or id, source, os.path.abspath(path), id, htm_title, items)
+
+    def add_folder(self, path, name=None, id=None, source='folder'):
+        """Import the files directly inside directory path."""
+        path = os.path.abspath(path)
+        id = id or os.path.basename(path.rstrip('/\\'))
+        files = sorted(f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f)))
+
+        def reader(f):
+            def load():
+                with open(os.path.join(path, f), 'rb') as fp:
+                    return fp.read()
+            return load
+        htm_title = install.title(reader('diction.htm')()) if 'diction.htm' in files else None
+        return self.add(name or id, source, path, id, htm_title, [(f, reader(f)) for f in files])
+
+    def rename(self, name, new_name):
+        with self._lock, self._db:
+            try:
+                cur = self._db.execute('UPDATE packs SET name = ? WHERE name = ?', (new_name, name))
+            except sqlite3.IntegrityError:
+                raise ExwordError(-1, '%s already exists' % new_name)
+        return cur.rowcount > 0
+
+    def remove(self, name):
+        """Delete pack name; blobs no other pack uses are deleted too."""
+        with self._blob_lock:
+            with self._lock, self._db:
+                row = self._db.execute('SELECT pack FROM packs WHERE name = ?', (name,)).fetchone()
+                if row is None:
+                    return False
+                blobs = [r[0] for r in self._db.execute('SELECT blob FROM files WHERE pack = ?', row)]
+                self._db.execute('DELETE FROM files WHERE pack = ?', row)
+                self._db.execute('DELETE FROM packs WHERE pack = ?', row)
+            self._collect(blobs)
+        return True
+
+    def _collect(self, blobs):
+        # only after the transaction dropping the rows has committed: a
+        # failed commit must not leave rows pointing at deleted blobs.
+        # The caller holds _blob_lock, so no _put_blob() revives one meanwhile.
+        with self._lock:
+            unused = [blob for blob in set(blobs)
+                      if not self._db.execute('SELECT 1 FROM files WHERE blob = ? LIMIT 1',
+                                              (blob,)).fetchone()]
+        for blob in unused:
+            try:
+                os.remove(self.blob_path(blob))
+            except OSError:
+                pass
+
+    def digests(self, name):
+        """{file name: [size, digest]} as recorded in device manifests."""
+        return dict((f.name, [f.size, manifest.crc32_digest(f.crc32)]) for f in self.files(name))
@@ -0,0 +1,108 @@
+"""Directory listings in one buffer
+
+exword_list() allocates every entry name separately and list() turns
+each one into a DirEntry straight away, which is slow for SD card
+directories with thousands of files.  exword_list_arena() parses the
+List body into a single block (fixed size records followed by the raw
+names); a Listing reads that block in place and decodes a name only
+when it is asked for:
+
+    listing = session.list_view()
+    len(listing)                    # no names decoded yet
+    listing.name(10)                # decodes one name
+    listing.records['flags']        # NumPy structured array, if installed
+
+The block is freed once neither the Listing nor any view into it
+(records, memoryviews from raw_name()) is referenced any more.
+"""
+import collections.abc
+import ctypes
+import struct
+import weakref
+
+from . import _native
+from ._native import LIST_F_DIR
+from .session import DirEntry, _decode_name
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RECORD = struct.Struct('=IHBB')
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([('offset', '=u4'), ('length', '=u2'),
+                                ('flags', 'u1'), ('reserved', 'u1')])
+
+
+class Listing(collections.abc.Sequence):
+    """Read-only sequence of DirEntry over one exword_list_arena() block."""
+
+    def __init__(self, records, names, count):
+        self._records = records
+        self._names_buf = names
+        self._count = count
+        self._names = [None] * count
+        if numpy is not None:
+            self.records = numpy.frombuffer(records, dtype=RECORD_DTYPE, count=count)
+        else:
+            self.records = None
+
+    @classmethod
+    def from_native(cls, lib, ptr):
+        """Wrap the exword_listing_t ptr; frees it with exword_free_buffer."""
+        if not ptr:
+            return cls(memoryview(b''), memoryview(b''), 0)
+        header = ptr.contents
+        base = ctypes.addressof(header)
+        first = ctypes.cast(header.entries, ctypes.c_void_p).value - base
+        size = first + header.count * RECORD.size + header.names_size
+        block = (ctypes.c_ubyte * size).from_address(base)
+        # views keep block alive, so it is freed only after the last of them
+        weakref.finalize(block, lib.exword_free_buffer, ctypes.cast(base, _native._buffer))
+        view = memoryview(block).cast('B')
+        names = first + header.count * RECORD.size
+        return cls(view[first:names], view[names:], header.count)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('listing index out of range')
+        return DirEntry(self.name(index), self.flags(index))
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._records, index * RECORD.size)
+
+    def flags(self, index):
+        return self._records[index * RECORD.size + 6]
+
+    def is_dir(self, index):
+        return bool(self.flags(index) & LIST_F_DIR)
+
+    def raw_name(self, index):
+        """The undecoded name as a memoryview into the block."""
+        offset, length = self._record(index)[:2]
+        return self._names_buf[offset:offset + length]
+
+    def name(self, index):
+        name = self._names[index]
+        if name is None:
+            name = self._names[index] = _decode_name(self.raw_name(index).tobytes(),
+                                                     self.flags(index))
+        return name
+
+    def names(self):
+        return [self.name(i) for i in range(self._count)]
+
+    def dirs(self):
+        """Indexes of the directories, without decoding any name."""
+        if self.records is not None:
+            return numpy.flatnonzero(self.records['flags'] & LIST_F_DIR).tolist()
+        return [i for i in range(self._count) if self.is_dir(i)]
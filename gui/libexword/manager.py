@@ -0,0 +1,134 @@
+"""Several devices at once
+
+SessionManager keeps one Session and one DeviceWorker per device.  Each
+exword handle has its own libusb context and ctypes releases the GIL
+while C code runs, so jobs on different devices proceed in parallel while
+jobs for the same device stay serialised on its worker.
+
+    manager = SessionManager()
+    manager.open('USB0', index=0)
+    manager.open('USB1', index=1)
+    jobs = manager.run_all(lambda job, session: install_zip(session, path, job=job))
+    results = manager.wait(jobs)
+"""
+import functools
+import threading
+
+from .session import Session
+from .worker import DeviceWorker
+
+
+class _Device(object):
+
+    def __init__(self, name, session, worker, owned):
+        self.name = name
+        self.session = session
+        self.worker = worker
+        self.owned = owned
+
+
+class SessionManager(object):
+    """Sessions and workers keyed by a device name of the caller's choice.
+
+    widget, if given, is passed to DeviceWorker.attach() so callbacks of
+    every worker run on the Tk thread.  Other keyword arguments are the
+    default Session options.
+    """
+
+    def __init__(self, widget=None, **session_options):
+        self.widget = widget
+        self.session_options = session_options
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._devices
+
+    def __len__(self):
+        return len(self._devices)
+
+    def names(self):
+        with self._lock:
+            return list(self._devices)
+
+    def session(self, name):
+        return self._devices[name].session
+
+    def worker(self, name):
+        return self._devices[name].worker
+
+    def open(self, name, index=0, on_done=None, on_error=None, **options):
+        """Open device number index as name on a new worker; returns the job."""
+        with self._lock:
+            if name in self._devices:
+                raise ValueError('%s is already open' % name)
+            kw = dict(self.session_options, index=index)
+            kw.update(options)
+            session = Session(**kw)
+            worker = DeviceWorker(name='libexword-' + name)
+            if self.widget is not None:
+                worker.attach(self.widget)
+            self._devices[name] = _Device(name, session, worker, True)
+        session.set_transfer_callback(worker.report_transfer, worker.progress_interval)
+        return worker.submit(lambda job: session.open(), name='open ' + name,
+                             on_done=on_done, on_error=on_error)
+
+    def add(self, name, session, worker):
+        """Manage an already open session and its worker.
+
+        They stay owned by the caller: close() and remove() leave both running.
+        """
+        with self._lock:
+            if name in self._devices:
+                raise ValueError('%s is already open' % name)
+            self._devices[name] = _Device(name, session, worker, False)
+
+    def remove(self, name):
+        with self._lock:
+            return self._devices.pop(name, None)
+
+    def close(self, name, wait=False):
+        """Close name after its queued jobs finished."""
+        device = self.remove(name)
+        if device is None or not device.owned:
+            return
+        device.worker.submit(lambda job: device.session.close(), name='close ' + name)
+        device.worker.stop(wait=wait, cancel=False)
+
+    def close_all(self, wait=True):
+        for name in self.names():
+            self.close(name, wait)
+
+    def submit(self, name, func, *args, on_done=None, on_error=None, on_progress=None, **kwargs):
+        """Queue func(job, session, *args, **kwargs) on name's worker."""
+        device = self._devices[name]
+        return device.worker.submit(func, device.session, *args, name=name,
+                                    on_done=on_done, on_error=on_error,
+                                    on_progress=on_progress, **kwargs)
+
+    def run_all(self, func, names=None, on_done=None, on_error=None, on_progress=None,
+                on_transfer=None):
+        """Queue func(job, session) on every device (or on names).
+
+        Callbacks receive the device name first: on_done(name, result),
+        on_error(name, exc), on_progress(name, *info),
+        on_transfer(name, job_progress, device_progress).  Returns {name: job}.
+        """
+        jobs = {}
+        for name in (self.names() if names is None else names):
+            bind = lambda cb: functools.partial(cb, name) if cb is not None else None
+            jobs[name] = self.submit(name, func, on_done=bind(on_done),
+                                     on_error=bind(on_error), on_progress=bind(on_progress),
+                                     on_transfer=bind(on_transfer))
+        return jobs
+
+    @staticmethod
+    def wait(jobs, timeout=None):
+        """Wait for {name: job}; returns {name: result or exception}."""
+        results = {}
+        for name, job in jobs.items():
+            try:
+                results[name] = job.wait(timeout)
+            except Exception as e:
+                results[name] = e
+        return results
@@ -0,0 +1,113 @@
+"""Per-device manifests of installed add-ons
+
+A manifest records, for one add-on on one device, the size and content
+hash of every file as it was before the install cipher was applied.
+_List only reports names, so together with a listing of _CONTENT the
+manifest tells which files are already on the device unchanged;
+install.sync_zip() then uploads only the rest.  Files are recorded one by
+one as their upload finishes, so an interrupted install resumes where it
+stopped.
+
+Manifests are JSON files on the host:
+    <directory>/<device>/<root>/<id>.json
+"""
+import json
+import os
+import re
+import zlib
+
+
+def crc32_digest(crc):
+    return 'crc32:%08x' % (crc & 0xffffffff)
+
+
+def file_digest(path, bufsize=1 << 20):
+    """(size, digest) of a local file, the same digest ZIP members get."""
+    crc = 0
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(bufsize)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+    return size, crc32_digest(crc)
+
+
+def zip_digest(info):
+    """(size, digest) of a ZipInfo, from the central directory (no inflate)."""
+    return info.file_size, crc32_digest(info.CRC)
+
+
+class Manifest(object):
+    """files maps a file name to [size, digest]; complete is false while an
+    install or update is in progress."""
+
+    def __init__(self, id, name=b'', key=b'', files=None, complete=False):
+        self.id = id
+        self.name = name
+        self.key = key
+        self.files = files if files is not None else {}
+        self.complete = complete
+
+    def to_json(self):
+        return {'id': self.id, 'name': self.name.hex(), 'key': self.key.hex(),
+                'files': self.files, 'complete': self.complete}
+
+    @classmethod
+    def from_json(cls, d):
+        files = dict((k, list(v)) for k, v in d.get('files', {}).items())
+        return cls(d['id'], bytes.fromhex(d.get('name', '')), bytes.fromhex(d.get('key', '')),
+                   files, d.get('complete', False))
+
+
+def device_key(session):
+    """Default device name: model and sub model, then the unit
+    (Session.unit(), e.g. its USB port path) so that two devices of the
+    same model keep separate manifests.  Raises ValueError when the unit
+    cannot be told; pass a device name of your own then."""
+    m = session.model()
+    unit = session.unit()
+    if unit is None:
+        raise ValueError('cannot tell which device the session is connected to; '
+                         'pass a device name')
+    return '%s@%s' % ('-'.join(p for p in (m.model, m.sub_model, m.ext_model) if p), unit)
+
+
+def _safe(part):
+    return re.sub(r'[^0-9A-Za-z._-]+', '_', part.strip('\\/')) or '_'
+
+
+class ManifestStore(object):
+    """Manifests kept under directory (default: the user cache directory)."""
+
+    def __init__(self, directory=None):
+        if directory is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            directory = os.path.join(base, 'libexword', 'manifests')
+        self.directory = directory
+
+    def path(self, device, root, id):
+        return os.path.join(self.directory, _safe(device), _safe(root), _safe(id) + '.json')
+
+    def load(self, device, root, id):
+        try:
+            with open(self.path(device, root, id)) as f:
+                return Manifest.from_json(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, device, root, manifest):
+        path = self.path(device, root, manifest.id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest.to_json(), f)
+        os.replace(tmp, path)
+
+    def remove(self, device, root, id):
+        try:
+            os.remove(self.path(device, root, id))
+        except OSError:
+            pass
@@ -0,0 +1,553 @@
+"""In-process EX-word emulator
+
+MockDevice implements the device side of the sequence numbered OBEX
+dialect described in protocol.txt: Connect with the mode and region
+bytes, Setpath, Put/Get of files, and the _Cap, _Model, _List, _Remove,
+_SdFormat, _AuthChallenge, _AuthInfo, _UserId, _Unlock, _Lock, _CName and
+_CryptKey commands.  Every packet is acknowledged by echoing its sequence
+byte before the response is sent.  Installing an add-on (Unlock, CName,
+CryptKey, uploads, Lock) registers it in the storage's admini*.inf the way
+the device does.
+
+It also models the USB link (per transfer latency and bandwidth) and the
+flash (time to store each packet), so transfer strategies can be compared
+without hardware.  Pass the device to Session(transport=...) to drive the
+real C library through exword_open_transport():
+
+    device = MockDevice(latency=0.0005, bandwidth=8e6)
+    with Session(transport=device) as s:
+        s.send_file('A.TXT', b'hello')
+
+MockClient is a Python model of obex.c's PUT path; it is used to compare
+stop-and-wait with pipelined uploads, which the C library only does on
+real USB.
+"""
+import hashlib
+import os
+import queue
+import struct
+import threading
+import time
+
+OBEX_CMD_CONNECT = 0x00
+OBEX_CMD_DISCONNECT = 0x01
+OBEX_CMD_PUT = 0x02
+OBEX_CMD_GET = 0x03
+OBEX_CMD_SETPATH = 0x05
+OBEX_FINAL = 0x80
+OBEX_RSP_CONTINUE = 0x10
+OBEX_RSP_SUCCESS = 0x20
+OBEX_RSP_BAD_REQUEST = 0x40
+OBEX_RSP_UNAUTHORIZED = 0x41
+OBEX_RSP_FORBIDDEN = 0x43
+OBEX_RSP_NOT_FOUND = 0x44
+OBEX_RSP_DATABASE_FULL = 0x60
+
+OBEX_HDR_NAME = 0x01
+OBEX_HDR_LENGTH = 0xc3
+OBEX_HDR_BODY = 0x48
+OBEX_HDR_BODY_END = 0x49
+OBEX_HDR_AUTHINFO = 0x70
+OBEX_HDR_CRYPTKEY = 0x71
+
+INTERNAL = '_INTERNAL_00'
+SD = '_SD_00'
+
+# admini*.inf name per region byte (see admini.ADMINI_FILES)
+ADMINI_BY_REGION = {0x20: 'admini.inf', 0x40: 'adminikr.inf', 0x60: 'adminicn.inf',
+                    0x80: 'adminide.inf', 0xa0: 'adminies.inf', 0xc0: 'adminifr.inf',
+                    0xe0: 'adminiru.inf'}
+ADMINI_RECORD = struct.Struct('32s16s132s')
+
+
+class MockDevice(object):
+    """Simulated device on the other end of the bulk pipes.
+
+    latency      seconds added to every bulk transfer
+    bandwidth    link speed in bytes per second (None: unlimited)
+    store_rate   bytes per second the device can write to flash (None: unlimited)
+    max_mtu      largest packet the device accepts (also its connect answer)
+    pipeline     whether a packet may arrive before the previous response
+                 was read; if not, such a packet is answered with an error
+    capacity     size of internal memory in bytes
+    sd_capacity  size of the SD card, None if no card is inserted
+    auth_key     20 byte key _AuthChallenge must match, None to accept any
+    length_header whether Get answers start with a Length header
+    serial       name of the unit for Session.unit() (default: a new one
+                 per instance, like the contents)
+    """
+
+    def __init__(self, latency=0.001, bandwidth=1000000, store_rate=4000000,
+                 max_mtu=65535, pipeline=True, capacity=64 << 20, sd_capacity=None,
+                 model='XD-EMU', sub_model='EMU', capabilities=('SW', 'P', 'F', 'C'),
+                 auth_key=None, length_header=True, serial=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.store_rate = store_rate
+        self.max_mtu = max_mtu
+        self.pipeline = pipeline
+        self.model = model
+        self.sub_model = sub_model
+        self.capabilities = capabilities
+        self.auth_key = auth_key
+        self.serial = serial or 'EMU-' + os.urandom(4).hex().upper()
+        self.length_header = length_header
+        self.capacity = {INTERNAL: capacity}
+        self.storage = {INTERNAL: {}}
+        if sd_capacity is not None:
+            self.capacity[SD] = sd_capacity
+            self.storage[SD] = {}
+        self.user_id = None
+        self.unplugged = False
+        self.wedged = False
+        self._reset()
+        self._inbox = queue.Queue()
+        self._outbox = queue.Queue()
+        self._partial = None
+        self._unread = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='mock-device', daemon=True)
+        self._thread.start()
+
+    def _reset(self):
+        self.connected = False
+        self.version = 0
+        self.region = 0x20
+        self.mtu = 4096
+        self.cwd = [INTERNAL]
+        self.authenticated = self.auth_key is None
+        self.unlocked = False
+        self._cname = None
+        self._key = None
+        self._request = None
+        self._reply = None
+
+    def close(self):
+        self._inbox.put(None)
+        self._thread.join()
+
+    def unplug(self):
+        """Make every further transfer fail as if the cable was pulled."""
+        self.unplugged = True
+
+    def wedge(self):
+        """Keep accepting packets but never answer them again."""
+        self.wedged = True
+
+    @property
+    def files(self):
+        """Contents of the current directory (internal memory at the top level)."""
+        node = self._node(self.cwd)
+        return node if node is not None else self.storage[INTERNAL]
+
+    # --- host side (what obex_bulk_write / obex_bulk_read see) ---
+
+    def _delay(self, size):
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def write(self, packet):
+        if self.unplugged:
+            raise ConnectionError('device unplugged')
+        self._delay(len(packet))
+        self._inbox.put(bytes(packet))
+        return len(packet)
+
+    def read(self, size=None, timeout=None):
+        """Next message from the device, at most size bytes of it; None on timeout."""
+        if self.unplugged:
+            raise ConnectionError('device unplugged')
+        if self._partial is not None:
+            data, response = self._partial
+        else:
+            try:
+                data, response = self._outbox.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            self._delay(len(data))
+        self._partial = None
+        if size is not None and len(data) > size:
+            self._partial = (data[size:], response)
+            return data[:size]
+        if response:
+            with self._lock:
+                self._unread -= 1
+        return data
+
+    # --- device side ---
+
+    def _run(self):
+        while True:
+            packet = self._inbox.get()
+            if packet is None:
+                break
+            if self.wedged:
+                continue
+            self._outbox.put((packet[:1], False))
+            with self._lock:
+                overlapped = self._unread > 0
+                self._unread += 1
+            if overlapped and not self.pipeline:
+                rsp = _response(OBEX_RSP_BAD_REQUEST | OBEX_FINAL)
+            else:
+                rsp = self._handle(packet)
+            self._outbox.put((rsp, True))
+
+    def _handle(self, packet):
+        opcode = packet[1]
+        length = struct.unpack('>H', packet[2:4])[0]
+        if len(packet) > self.max_mtu or length != len(packet) - 1:
+            return _response(OBEX_RSP_BAD_REQUEST | OBEX_FINAL)
+        cmd = opcode & ~OBEX_FINAL
+        if cmd == OBEX_CMD_CONNECT:
+            self._reset()
+            self.version, flags, mtu, unknown, self.region = struct.unpack('>BBHHB', packet[4:11])
+            self.mtu = min(mtu, self.max_mtu)
+            self.connected = True
+            return _response(OBEX_RSP_SUCCESS | OBEX_FINAL,
+                             struct.pack('>BBHI', 0x10, 0, self.mtu, 0))
+        if not self.connected:
+            return _response(OBEX_RSP_BAD_REQUEST | OBEX_FINAL)
+        if cmd == OBEX_CMD_DISCONNECT:
+            self.connected = False
+            return _response(OBEX_RSP_SUCCESS | OBEX_FINAL)
+        if cmd == OBEX_CMD_SETPATH:
+            return _response(self._setpath(packet[4], _header_dict(packet[6:])) | OBEX_FINAL)
+        if cmd not in (OBEX_CMD_PUT, OBEX_CMD_GET):
+            return _response(OBEX_RSP_BAD_REQUEST | OBEX_FINAL)
+        if cmd == OBEX_CMD_GET and self._reply is not None and len(packet) == 4:
+            return self._next_reply()
+        if self._request is None or self._request[0] != cmd:
+            self._request = (cmd, {}, bytearray())
+        headers, body = self._request[1], self._request[2]
+        for hi, value in _headers(packet[4:]):
+            if hi in (OBEX_HDR_BODY, OBEX_HDR_BODY_END):
+                body += value
+                if cmd == OBEX_CMD_PUT and self.store_rate:
+                    time.sleep(len(value) / self.store_rate)
+            else:
+                headers[hi] = value
+        if not opcode & OBEX_FINAL:
+            return _response(OBEX_RSP_CONTINUE | OBEX_FINAL)
+        self._request = None
+        name = headers.get(OBEX_HDR_NAME, b'').decode('utf-16-be').rstrip('\x00')
+        if cmd == OBEX_CMD_PUT:
+            return _response(self._put(name, bytes(body)) | OBEX_FINAL)
+        rsp, data = self._get(name, headers)
+        if rsp != OBEX_RSP_SUCCESS:
+            return _response(rsp | OBEX_FINAL)
+        self._reply = (data, 0)
+        return self._next_reply()
+
+    def _next_reply(self):
+        data, pos = self._reply
+        extra = b''
+        if pos == 0 and self.length_header:
+            extra = struct.pack('>BI', OBEX_HDR_LENGTH, len(data))
+        room = self.mtu - 3 - len(extra) - 3
+        chunk = data[pos:pos + room]
+        pos += len(chunk)
+        if pos >= len(data):
+            self._reply = None
+            return _response(OBEX_RSP_SUCCESS | OBEX_FINAL,
+                             extra + _byte_header(OBEX_HDR_BODY_END, chunk))
+        self._reply = (data, pos)
+        return _response(OBEX_RSP_CONTINUE | OBEX_FINAL, extra + _byte_header(OBEX_HDR_BODY, chunk))
+
+    # --- file system ---
+
+    def _node(self, path):
+        if not path or path[0] not in self.storage:
+            return None
+        node = self.storage[path[0]]
+        for part in path[1:]:
+            node = node.get(part)
+            if not isinstance(node, dict):
+                return None
+        return node
+
+    def _used(self, node):
+        return sum(self._used(v) if isinstance(v, dict) else len(v) for v in node.values())
+
+    def _setpath(self, flags, headers):
+        raw = headers.get(OBEX_HDR_NAME, b'')
+        path = [p for p in raw.decode('utf-16-be').rstrip('\x00').replace('/', '\\').split('\\') if p]
+        if not path:
+            self.cwd = []
+            return OBEX_RSP_SUCCESS
+        if path[0] not in self.storage:
+            return OBEX_RSP_NOT_FOUND
+        node = self.storage[path[0]]
+        for part in path[1:]:
+            child = node.get(part)
+            if child is None and flags & 2 == 0:
+                child = node[part] = {}
+            if not isinstance(child, dict):
+                return OBEX_RSP_NOT_FOUND
+            node = child
+        self.cwd = path
+        return OBEX_RSP_SUCCESS
+
+    def _listing(self):
+        if not self.cwd:
+            names = [(name, True) for name in self.storage]
+        else:
+            names = [(name, isinstance(v, dict)) for name, v in self._node(self.cwd).items()]
+        out = bytearray(struct.pack('>H', len(names)))
+        for name, is_dir in names:
+            flags = 1 if is_dir else 0
+            try:
+                raw = name.encode('ascii') + b'\x00'
+            except UnicodeEncodeError:
+                raw = name.encode('utf-16-be') + b'\x00\x00'
+                flags |= 2
+            out += struct.pack('>HB', len(raw) + 3, flags) + raw
+        return bytes(out)
+
+    def _model(self):
+        out = self.model.encode('ascii').ljust(14, b'\x00')
+        out += self.sub_model.encode('ascii').ljust(9, b'\x00')
+        for cap in self.capabilities:
+            out += cap.encode('ascii') + b'\x00'
+        return out
+
+    # --- commands ---
+
+    def _put(self, name, body):
+        if name == '_AuthChallenge':
+            if self.auth_key is None or body[:20] == self.auth_key:
+                self.authenticated = True
+                return OBEX_RSP_SUCCESS
+            return OBEX_RSP_UNAUTHORIZED
+        if name == '_UserId':
+            self.user_id = body.split(b'\x00', 1)[0]
+            return OBEX_RSP_SUCCESS
+        if not self.authenticated:
+            return OBEX_RSP_UNAUTHORIZED
+        if name == '_Unlock':
+            self.unlocked = True
+            self._cname = self._key = None
+            return OBEX_RSP_SUCCESS
+        if name == '_Lock':
+            if self._cname is not None:
+                self._register(*self._cname)
+            self.unlocked = False
+            self._cname = self._key = None
+            return OBEX_RSP_SUCCESS
+        if name == '_CName':
+            if not self.unlocked or not self.cwd:
+                return OBEX_RSP_FORBIDDEN
+            id, title = body.split(b'\x00')[:2]
+            self._cname = (self.cwd[0], id.decode('ascii', 'replace'), title)
+            return OBEX_RSP_SUCCESS
+        if name == '_SdFormat':
+            if SD not in self.storage:
+                return OBEX_RSP_NOT_FOUND
+            self.storage[SD] = {}
+            if self.cwd[:1] == [SD]:
+                self.cwd = [SD]
+            return OBEX_RSP_SUCCESS
+        node = self._node(self.cwd)
+        if node is None:
+            return OBEX_RSP_FORBIDDEN
+        if name == '_Remove':
+            if body[:1] == b'\x00':
+                target = body.decode('utf-16-be', 'replace').rstrip('\x00')
+            else:
+                target = body.split(b'\x00', 1)[0].decode('shift_jis', 'replace')
+            if target not in node:
+                return OBEX_RSP_NOT_FOUND
+            del node[target]
+            return OBEX_RSP_SUCCESS
+        old = node.get(name)
+        if isinstance(old, dict):
+            return OBEX_RSP_FORBIDDEN
+        grow = len(body) - (len(old) if old is not None else 0)
+        storage = self.cwd[0]
+        if self._used(self.storage[storage]) + grow > self.capacity[storage]:
+            return OBEX_RSP_DATABASE_FULL
+        node[name] = body
+        return OBEX_RSP_SUCCESS
+
+    def _get(self, name, headers):
+        if name == '_Model':
+            return OBEX_RSP_SUCCESS, self._model()
+        if name == '_List':
+            if self.cwd and self._node(self.cwd) is None:
+                return OBEX_RSP_NOT_FOUND, None
+            return OBEX_RSP_SUCCESS, self._listing()
+        if name == '_AuthInfo':
+            blocks = headers.get(OBEX_HDR_AUTHINFO, b'')
+            self.auth_key = hashlib.sha1(blocks).digest()
+            self.authenticated = True
+            self._clear_addons()
+            return OBEX_RSP_SUCCESS, self.auth_key
+        if not self.authenticated:
+            return OBEX_RSP_UNAUTHORIZED, None
+        if name == '_Cap':
+            storage = self.cwd[0] if self.cwd else INTERNAL
+            total = self.capacity[storage]
+            free = max(0, total - self._used(self.storage[storage]))
+            return OBEX_RSP_SUCCESS, struct.pack('>II', total, free)
+        if name == '_CryptKey':
+            blocks = headers.get(OBEX_HDR_CRYPTKEY, b'').ljust(28, b'\x00')
+            blk1, blk2 = blocks[:16], blocks[16:28]
+            # the add-on key these blocks were made from (dict.c key layout)
+            self._key = blk1[0:2] + blk2[0:8] + blk1[10:12] + blk2[8:12]
+            mix = b'\x00\x00' + blk2[0:8] + b'\x00\x00'
+            return OBEX_RSP_SUCCESS, bytes((a + b) & 0xff for a, b in zip(blk1[:12], mix))
+        node = self._node(self.cwd)
+        data = node.get(name) if node is not None else None
+        if data is None or isinstance(data, dict):
+            return OBEX_RSP_NOT_FOUND, None
+        return OBEX_RSP_SUCCESS, data
+
+    # --- add-on registry ---
+
+    def _admini_name(self):
+        return ADMINI_BY_REGION.get(self.region, 'admini.inf')
+
+    def _records(self, storage):
+        data = self.storage[storage].get(self._admini_name(), b'')
+        return [data[i:i + ADMINI_RECORD.size]
+                for i in range(0, len(data) - ADMINI_RECORD.size + 1, ADMINI_RECORD.size)]
+
+    def _register(self, storage, id, title):
+        """On Lock: add the add-on named by CName if it was installed, or
+        drop its record if its directory was removed."""
+        root = self.storage[storage]
+        records = [r for r in self._records(storage)
+                   if r[:32].split(b'\x00', 1)[0].decode('ascii', 'replace') != id]
+        if isinstance(root.get(id), dict):
+            records.append(ADMINI_RECORD.pack(id.encode('ascii'), self._key or bytes(16), title))
+        root[self._admini_name()] = b''.join(records)
+
+    def _clear_addons(self):
+        for storage, root in self.storage.items():
+            for record in self._records(storage):
+                root.pop(record[:32].split(b'\x00', 1)[0].decode('ascii', 'replace'), None)
+            root.pop(self._admini_name(), None)
+
+
+def _response(rsp, extra=b''):
+    return struct.pack('>BH', rsp, 3 + len(extra)) + extra
+
+
+def _byte_header(hi, value):
+    return struct.pack('>BH', hi, len(value) + 3) + value
+
+
+def _headers(data):
+    pos = 0
+    while pos < len(data):
+        hi = data[pos]
+        kind = hi & 0xc0
+        if kind in (0x00, 0x40):
+            hl = struct.unpack('>H', data[pos + 1:pos + 3])[0]
+            yield hi, data[pos + 3:pos + hl]
+            pos += max(hl, 3)
+        elif kind == 0x80:
+            yield hi, data[pos + 1:pos + 2]
+            pos += 2
+        else:
+            yield hi, data[pos + 1:pos + 5]
+            pos += 5
+
+
+def _header_dict(data):
+    return dict(_headers(data))
+
+
+class MockClient(object):
+    """Host side of the OBEX dialect, built the way obex.c builds packets."""
+
+    def __init__(self, device, mtu=0, pipeline=False):
+        self.device = device
+        self.requested_mtu = mtu
+        self.pipeline = pipeline
+        self.mtu_tx = 0x4006
+        self.seq = 0
+
+    def _packet(self, opcode, payload):
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xff
+        return struct.pack('>BBH', seq, opcode, len(payload) + 3) + payload
+
+    def _ack(self, packet):
+        if self.device.read() != packet[:1]:
+            raise IOError('sequence mismatch')
+
+    def _response(self):
+        data = self.device.read()
+        return data[0] & ~OBEX_FINAL, data[3:]
+
+    def connect(self):
+        mtu = self.requested_mtu or 4096
+        payload = struct.pack('>BBHBBB', 0x10, 0x40, mtu, 0x40, 0, 0x20)
+        packet = self._packet(OBEX_CMD_CONNECT | OBEX_FINAL, payload)
+        self.device.write(packet)
+        self._ack(packet)
+        rsp, data = self._response()
+        if rsp != OBEX_RSP_SUCCESS:
+            return rsp
+        if self.requested_mtu:
+            self.mtu_tx = min(self.requested_mtu, struct.unpack('>H', data[2:4])[0])
+        else:
+            self.mtu_tx = 0x4006
+        return rsp
+
+    def _put_packets(self, name, data):
+        first = bytearray()
+        raw = (name + '\x00').encode('utf-16-be')
+        first += struct.pack('>BH', OBEX_HDR_NAME, len(raw) + 3) + raw
+        first += struct.pack('>BI', OBEX_HDR_LENGTH, len(data))
+        pos = 0
+        while True:
+            room = self.mtu_tx - 4 - len(first) - 3
+            chunk = data[pos:pos + room]
+            pos += len(chunk)
+            last = pos >= len(data)
+            hi = OBEX_HDR_BODY_END if last else OBEX_HDR_BODY
+            first += struct.pack('>BH', hi, len(chunk) + 3) + chunk
+            opcode = OBEX_CMD_PUT | (OBEX_FINAL if last else 0)
+            yield self._packet(opcode, bytes(first))
+            if last:
+                break
+            first = bytearray()
+
+    def put(self, name, data):
+        if self.pipeline:
+            return self._put_pipelined(name, data)
+        for packet in self._put_packets(name, data):
+            self.device.write(packet)
+            self._ack(packet)
+            rsp, _ = self._response()
+            if rsp not in (OBEX_RSP_CONTINUE, OBEX_RSP_SUCCESS):
+                return rsp
+        return rsp
+
+    def _put_pipelined(self, name, data):
+        # like obex_request_pipelined(): the next packet goes out on a
+        # second thread while the previous response is being read
+        packets = self._put_packets(name, data)
+        current = next(packets)
+        self.device.write(current)
+        self._ack(current)
+        while True:
+            following = next(packets, None)
+            writer = None
+            if following is not None:
+                writer = threading.Thread(target=self.device.write, args=(following,))
+                writer.start()
+            rsp, _ = self._response()
+            if writer is None:
+                return rsp
+            writer.join()
+            self._ack(following)
+            if rsp != OBEX_RSP_CONTINUE:
+                self._response()
+                return rsp
+            current = following
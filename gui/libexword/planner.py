@@ -0,0 +1,177 @@
+"""Placement of add-ons across internal memory and the SD card
+
+dict_install() sums the size of a staged add-on with a stat() of every
+file and only then asks the device for its free space, one add-on at a
+time.  plan() decides where a whole selection goes before anything is
+sent:
+
+    sizes = SizeCache()
+    items = [Item(name, sizes.size(path)) for name, path in selection]
+    placement = plan(session, items)
+    placement.check()               # ExwordError if something does not fit
+    for item, root in placement.assigned:
+        install.sync_zip(session, path_of(item), store, root=root)
+
+Sizes of ZIP files and directories are cached and recomputed only when
+their mtime changes; packs in a library.Library carry their sizes
+already.  Free space comes from Session.capacity(root), which is cached
+per storage root until something is written there.
+"""
+import collections
+import json
+import os
+import zipfile
+
+from . import admini
+from . import manifest
+from ._native import INTERNAL_MEM, SD_CARD
+from .install import zip_members
+from .session import ExwordError
+
+
+class Item(collections.namedtuple('Item', 'name size id')):
+    """One add-on to place; id (if known) pins it to the root it is
+    already installed on."""
+    __slots__ = ()
+
+    def __new__(cls, name, size, id=None):
+        return super().__new__(cls, name, size, id)
+
+
+class Placement(collections.namedtuple('Placement', 'assigned rejected free')):
+    """assigned is [(Item, root)] in install order, rejected the items
+    that fit nowhere and free the bytes left on each root afterwards."""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return not self.rejected
+
+    def root_of(self, name):
+        for item, root in self.assigned:
+            if item.name == name:
+                return root
+        return None
+
+    def check(self):
+        if self.rejected:
+            raise ExwordError(-1, 'Insufficient space on device for %s (%d bytes)' % (
+                ', '.join(i.name for i in self.rejected), sum(i.size for i in self.rejected)))
+        return self
+
+
+def roots(session):
+    """Storage roots of session: internal memory, then the SD card if inserted."""
+    result = [INTERNAL_MEM + '\\']
+    if session.sd_inserted:
+        result.append(SD_CARD + '\\')
+    return result
+
+
+def pack(items, free, pinned=None):
+    """Best fit decreasing: the largest item goes first, into the root
+    that has the least space left that still holds it.
+
+    free is {root: bytes}; pinned maps an item name to the only root it
+    may use.  Like install_zip() an add-on needs strictly less than the
+    free space.  Returns a Placement; assigned follows the order of items.
+    """
+    pinned = pinned or {}
+    left = dict(free)
+    where = {}
+    rejected = []
+    for item in sorted(items, key=lambda i: -i.size):
+        candidates = [pinned[item.name]] if item.name in pinned else list(left)
+        fits = [r for r in candidates if item.size < left.get(r, 0)]
+        if not fits:
+            rejected.append(item)
+            continue
+        root = min(fits, key=lambda r: left[r])
+        left[root] -= item.size
+        where[item.name] = root
+    assigned = [(i, where[i.name]) for i in items if i.name in where]
+    order = dict((i.name, n) for n, i in enumerate(items))
+    rejected.sort(key=lambda i: order[i.name])
+    return Placement(assigned, rejected, left)
+
+
+def plan(session, items, targets=None, reserve=0, store=None, device=None):
+    """Place items on session's storage roots (or on targets).
+
+    reserve bytes are kept free on every root.  Items whose id is already
+    installed stay on that root.  With a manifest.ManifestStore (and the
+    device name used in it) such an update only needs the bytes it adds
+    over the installed copy; otherwise its full size is counted.
+    """
+    targets = targets or roots(session)
+    free = dict((r, max(0, session.capacity(r).free - reserve)) for r in targets)
+    if store is not None and device is None:
+        device = manifest.device_key(session)
+    pinned = {}
+    needed = []
+    for item in items:
+        need = item
+        for r in (targets if item.id is not None else ()):
+            if admini.find(session, item.id, r) is not None:
+                pinned[item.name] = r
+                known = store.load(device, r, item.id) if store is not None else None
+                if known is not None:
+                    installed = sum(size for size, digest in known.files.values())
+                    need = item._replace(size=max(0, item.size - installed))
+                break
+        needed.append(need)
+    placement = pack(needed, free, pinned)
+    original = dict((i.name, i) for i in items)
+    return Placement([(original[i.name], r) for i, r in placement.assigned],
+                     [original[i.name] for i in placement.rejected], placement.free)
+
+
+def tree_size(path):
+    """Bytes install_zip() or dict_install() would send for path: the
+    members of a ZIP file, or the files directly inside a directory."""
+    if os.path.isdir(path):
+        total = 0
+        for entry in os.scandir(path):
+            if entry.is_file():
+                total += entry.stat().st_size
+        return total
+    with zipfile.ZipFile(path) as zf:
+        return sum(i.file_size for i in zip_members(zf)[1])
+
+
+class SizeCache(object):
+    """Sizes of local add-ons, kept until the path's mtime changes.
+
+    A directory's mtime changes when files are added, removed or replaced
+    (as unzip and most tools do), not when a file is rewritten in place.
+    If path is given the cache is loaded from and saved to that file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._sizes = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._sizes = dict((k, tuple(v)) for k, v in json.load(f).items())
+            except (OSError, ValueError):
+                pass
+
+    def size(self, path):
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        item = self._sizes.get(path)
+        if item is not None and item[0] == mtime:
+            return item[1]
+        size = tree_size(path)
+        self._sizes[path] = (mtime, size)
+        return size
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._sizes, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,118 @@
+"""Transfer progress: byte counts, rates and ETA
+
+The C library reports a transfer through the session's transfer callback
+(filename, transferred, length).  A Meter folds those calls into a byte
+count across files and turns it into Progress snapshots:
+
+    meter = Meter('install')
+    meter.update('a.dat', 65536, 1 << 20)
+    p = meter.snapshot()
+    print(p.bytes, p.mb_s, p.smoothed_mb_s, p.eta)
+
+rate is measured since the previous snapshot, smoothed is an exponential
+average of it with time constant TAU seconds.  DeviceWorker keeps one
+Meter per job and one for the device and posts snapshots at most
+progress_hz times a second (see worker.py).  Registered with
+
+    session.set_transfer_callback(worker.report_transfer, worker.progress_interval)
+
+the C library skips the callback for the packets in between, so Python is
+not entered for every packet of a large file.
+"""
+import collections
+import math
+import time
+
+TAU = 2.0
+# a pause longer than this is not counted in the rates
+IDLE = 1.0
+
+
+class Progress(collections.namedtuple(
+        'Progress', 'name filename transferred length bytes total rate smoothed eta')):
+    """Snapshot of a Meter; rates in bytes per second, eta in seconds.
+
+    transferred and length are those of the current file, bytes counts
+    every file so far, total is the expected byte count (None if not
+    known) and eta is None when it cannot be estimated.
+    """
+    __slots__ = ()
+
+    @property
+    def mb_s(self):
+        return self.rate / 1e6
+
+    @property
+    def smoothed_mb_s(self):
+        return self.smoothed / 1e6
+
+    @property
+    def fraction(self):
+        """Part done, of the whole job if total is known, else of the file."""
+        if self.total:
+            return min(self.bytes / float(self.total), 1.0)
+        if self.length:
+            return min(self.transferred / float(self.length), 1.0)
+        return None
+
+
+class Meter(object):
+    """Bytes moved by a job (or a device) over possibly many files.
+
+    update() is called from the thread doing the transfer and snapshot()
+    from the one reporting it; callers serialise them.
+    """
+
+    def __init__(self, name, total=None, tau=TAU):
+        self.name = name
+        self.total = total
+        self.tau = tau
+        self.filename = None
+        self.transferred = 0
+        self.length = 0
+        self.bytes = 0
+        self.smoothed = None
+        self.updated = None         # time.monotonic() of the last update()
+        self._mark = None
+        self._mark_bytes = 0
+
+    def update(self, filename, transferred, length, now=None):
+        now = time.monotonic() if now is None else now
+        if filename != self.filename or transferred < self.transferred:
+            # a new file: its first count is all new bytes
+            delta = transferred
+        else:
+            delta = transferred - self.transferred
+        if self.updated is None or now - self.updated > IDLE:
+            # start measuring here; the bytes of this call took an unknown time
+            self._mark = now
+            self._mark_bytes = self.bytes + delta
+        self.updated = now
+        self.filename = filename
+        self.transferred = transferred
+        self.length = length
+        self.bytes += delta
+
+    def snapshot(self, now=None):
+        now = time.monotonic() if now is None else now
+        rate = 0.0
+        if self._mark is not None and now > self._mark:
+            rate = (self.bytes - self._mark_bytes) / (now - self._mark)
+            if self.smoothed is None:
+                self.smoothed = rate or None
+            else:
+                alpha = 1.0 - math.exp(-(now - self._mark) / self.tau)
+                self.smoothed += alpha * (rate - self.smoothed)
+            if self.updated is not None and now - self.updated <= IDLE:
+                self._mark = now
+                self._mark_bytes = self.bytes
+        smoothed = self.smoothed or 0.0
+        if self.total:
+            remaining = max(self.total - self.bytes, 0)
+        elif self.length:
+            remaining = max(self.length - self.transferred, 0)
+        else:
+            remaining = None
+        eta = remaining / smoothed if remaining is not None and smoothed > 0 else None
+        return Progress(self.name, self.filename, self.transferred, self.length,
+                        self.bytes, self.total, rate, smoothed, eta)
@@ -0,0 +1,159 @@
+"""Priority classes for device access
+
+A Session serialises its commands on a lock.  With a plain lock a quick
+list or capacity check from the file explorer waits behind a whole
+install; the session's PriorityLock instead hands the device to the
+waiting command of the best class:
+
+    INTERACTIVE     what the user is looking at (listings, capacity)
+    NORMAL          everything else (the default)
+    BULK            installs and other long transfers
+
+A command holds the lock from its first to its last packet, because an
+OBEX PUT or GET cannot be interleaved with another request.  A bulk job
+made of many commands (install_zip() sends one file per command) gives
+the device up between them, so an interactive command waits at most for
+the file being sent.  The class of a command is that of the thread
+issuing it:
+
+    with sched.priority(sched.BULK):
+        install.install_zip(session, path)
+
+DeviceWorker.submit(priority=...) runs a job in its class, and INTERACTIVE
+jobs on a second thread so they do not queue behind a bulk job.  The time
+each class waited for the device is reported by Session.stats() as
+'queue interactive', 'queue normal' and 'queue bulk'.
+"""
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from ._native import EXWORD_HIST_BUCKETS
+from .stats import Histogram
+
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+CLASSES = ('interactive', 'normal', 'bulk')
+
+_local = threading.local()
+
+
+def current():
+    """Priority class of the calling thread."""
+    return getattr(_local, 'priority', NORMAL)
+
+
+@contextlib.contextmanager
+def priority(cls):
+    """Run the block's device commands in priority class cls."""
+    previous = current()
+    _local.priority = cls
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class DelayHistogram(object):
+    """Waiting times in the bucket layout of the C latency histograms."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * EXWORD_HIST_BUCKETS
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[min(max(us.bit_length() - 1, 0), EXWORD_HIST_BUCKETS - 1)] += 1
+
+    def histogram(self):
+        return Histogram(self.count, 0, self.total, self.max, tuple(self.buckets))
+
+
+class PriorityLock(object):
+    """Reentrant lock handed to the waiter of the best class, FIFO within
+    a class.
+
+    on_acquire(thread) and on_release(thread) are called when a thread
+    takes and gives up the outermost level; on_acquire runs holding the
+    lock.
+    """
+
+    def __init__(self, on_acquire=None, on_release=None):
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.delays = [DelayHistogram() for cls in CLASSES]
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self._depth = 0
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def acquire(self, cls=None):
+        me = threading.current_thread()
+        with self._cond:
+            if self._owner is me:
+                self._depth += 1
+                return True
+            if cls is None:
+                cls = current()
+            start = time.perf_counter()
+            if self._owner is not None or self._waiting:
+                entry = (cls, next(self._seq), me)
+                heapq.heappush(self._waiting, entry)
+                while self._owner is not None or self._waiting[0] is not entry:
+                    self._cond.wait()
+                heapq.heappop(self._waiting)
+            self._owner = me
+            self._depth = 1
+            self.delays[cls].record(time.perf_counter() - start)
+        if self.on_acquire is not None:
+            try:
+                self.on_acquire(me)
+            except BaseException:
+                self.release()
+                raise
+        return True
+
+    def release(self):
+        me = threading.current_thread()
+        with self._cond:
+            if self._owner is not me:
+                raise RuntimeError('cannot release un-acquired lock')
+            if self._depth > 1:
+                self._depth -= 1
+                return
+        if self.on_release is not None:
+            self.on_release(me)
+        with self._cond:
+            self._depth = 0
+            self._owner = None
+            if self._waiting:
+                self._cond.notify_all()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def stats(self):
+        """{'queue <class>': stats.Histogram} of the time spent waiting."""
+        with self._cond:
+            return dict(('queue ' + name, self.delays[i].histogram())
+                        for i, name in enumerate(CLASSES))
+
+    def reset_stats(self):
+        with self._cond:
+            for d in self.delays:
+                d.reset()
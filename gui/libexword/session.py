@@ -0,0 +1,825 @@
+"""Long lived device session
+
+A Session owns one exword_t handle.  The USB interface is claimed and the
+OBEX connect is sent once in open(); every later call reuses them, so a
+batch of file operations only pays the connection cost a single time.
+"""
+import collections
+import ctypes
+import mmap
+import os
+import queue
+import threading
+import weakref
+
+from . import _native, sched
+from .cache import DirCache, cache_key, parent_paths
+from ._native import (INTERNAL_MEM, SD_CARD, ROOT, LIST_F_DIR, LIST_F_UNICODE,
+                      OPEN_LIBRARY, LOCALE_JA, RSP_SUCCESS)
+
+
+class ExwordError(Exception):
+    """A device command returned something other than 0x20 (OK, Success)."""
+
+    def __init__(self, rsp, message=None):
+        self.rsp = rsp
+        if message is None:
+            message = response_to_string(rsp)
+        self.message = message
+        super().__init__('%s (0x%02x)' % (message, rsp & 0xff))
+
+
+def response_to_string(rsp):
+    try:
+        lib = _native.load()
+    except OSError:
+        return 'Unknown response'
+    return _native.decode(lib.exword_response_to_string(rsp))
+
+
+class DirEntry(collections.namedtuple('DirEntry', 'name flags')):
+    __slots__ = ()
+
+    @property
+    def is_dir(self):
+        return bool(self.flags & LIST_F_DIR)
+
+    @property
+    def is_unicode(self):
+        return bool(self.flags & LIST_F_UNICODE)
+
+
+Model = collections.namedtuple('Model', 'model sub_model ext_model capabilities')
+Capacity = collections.namedtuple('Capacity', 'total free')
+
+
+def _decode_name(raw, flags):
+    if flags & LIST_F_UNICODE:
+        return raw.decode('utf-16-be', 'replace').rstrip('\x00')
+    return raw.split(b'\x00', 1)[0].decode('shift_jis', 'replace')
+
+
+def join_path(root, *parts):
+    """Build a device path the way main.c's _setpath() does ('\\' separated)."""
+    path = root
+    for p in parts:
+        p = p.replace('/', '\\').strip('\\')
+        if p:
+            path = path.rstrip('\\') + '\\' + p
+    return path
+
+
+def _stream_length(src):
+    if hasattr(src, 'seek') and hasattr(src, 'tell'):
+        try:
+            pos = src.tell()
+            end = src.seek(0, 2)
+            src.seek(pos)
+            return end - pos
+        except (OSError, ValueError):
+            pass
+    try:
+        return len(src)
+    except TypeError:
+        raise ValueError('length is required for this source')
+
+
+def _c_buffer(data):
+    """data in a form exword_send_file() accepts, copied only if it has to be."""
+    if isinstance(data, (bytes, ctypes.Array)):
+        return data
+    view = memoryview(data)
+    if view.readonly or not view.c_contiguous or not view.nbytes:
+        return view.tobytes()
+    return (ctypes.c_char * view.nbytes).from_buffer(view.cast('B'))
+
+
+def _file_reader(f):
+    readinto = getattr(f, 'readinto', None)
+
+    def read(view):
+        n = 0
+        while n < len(view):
+            if readinto is not None:
+                got = readinto(view[n:])
+            else:
+                data = f.read(len(view) - n)
+                got = len(data)
+                view[n:n + got] = data
+            if not got:
+                break
+            n += got
+        return n
+    return read
+
+
+def _iter_reader(chunks):
+    """Adapt an iterator of bytes to fixed sized reads, keeping the leftover."""
+    pending = [memoryview(b'')]
+
+    def read(view):
+        n = 0
+        while n < len(view):
+            data = pending[0]
+            if not data:
+                try:
+                    data = memoryview(next(chunks)).cast('B')
+                except StopIteration:
+                    break
+            take = min(len(data), len(view) - n)
+            view[n:n + take] = data[:take]
+            pending[0] = data[take:]
+            n += take
+        return n
+    return read
+
+
+def _bulk_callbacks(transport):
+    """C write/read callbacks for exword_open_transport() around transport."""
+    def write(data, length, actual, timeout, user_data):
+        try:
+            actual[0] = transport.write(ctypes.string_at(data, length))
+        except ConnectionError:
+            return _native.LIBUSB_ERROR_NO_DEVICE
+        except Exception:
+            return _native.LIBUSB_ERROR_IO
+        return 0
+
+    def read(data, length, actual, timeout, user_data):
+        try:
+            chunk = transport.read(length, timeout / 1000.0)
+        except ConnectionError:
+            return _native.LIBUSB_ERROR_NO_DEVICE
+        except Exception:
+            return _native.LIBUSB_ERROR_IO
+        if not chunk:
+            actual[0] = 0
+            return _native.LIBUSB_ERROR_TIMEOUT
+        ctypes.memmove(data, chunk, len(chunk))
+        actual[0] = len(chunk)
+        return 0
+    return _native.bulk_cb(write), _native.bulk_cb(read)
+
+
+class Session(object):
+    """One connected EX-word device.
+
+    All methods are serialised on an internal lock because the C handle is
+    not thread safe.  Use as a context manager or call open()/close().
+
+    max_mtu and pipeline opt in to the high throughput mode (see
+    exword_set_max_mtu / exword_set_pipeline); both are off by default
+    because not every model accepts them.
+
+    Directory listings are cached in self.dircache (see cache.py); pass
+    cache_ttl=0 to always ask the device.
+
+    index selects which of several connected devices to open (USB
+    enumeration order).
+
+    Reads wait for a response with a timeout adapted to the measured
+    round trip time, between timeout_min and timeout_max seconds; a
+    response that does not start within 16 round trips (at least 0.3 s,
+    at most timeout_max) fails the command.
+    request_timeout, if set, limits each whole command.  A disconnected
+    device fails at once and closes the session; abort() stops a running
+    command from another thread.
+    """
+
+    def __init__(self, mode=OPEN_LIBRARY, region=LOCALE_JA, debug=0,
+                 max_mtu=0, pipeline=False, cache_ttl=30.0, index=0, path=None,
+                 transport=None, timeout_min=0.1, timeout_max=0.8, request_timeout=None):
+        self.index = index
+        # USB port path (devices.DeviceInfo.path); takes precedence over index
+        self.path = path
+        # object with write(data) and read(size, timeout), e.g. mock.MockDevice;
+        # replaces USB entirely
+        self.transport = transport
+        self._c_bulk = None
+        self.mode = mode
+        self.region = region
+        self.debug = debug
+        self.max_mtu = max_mtu
+        self.pipeline = pipeline
+        self.timeout_min = timeout_min
+        self.timeout_max = timeout_max
+        self.request_timeout = request_timeout
+        self.cwd = None
+        self.sd_inserted = False
+        self._handle = None
+        self._lib = None
+        self._lock = sched.PriorityLock(self._recall_path, self._remember_path)
+        # device path each thread last left the session at, see _restore_path()
+        self._paths = weakref.WeakKeyDictionary()
+        # path to restore before the current hold's first command, if any
+        self._restore = None
+        self._unrestored = False
+        # guards the handle for abort(), which must not wait for self._lock
+        self._handle_lock = threading.Lock()
+        self.dircache = DirCache(cache_ttl)
+        # parsed admini.inf per storage root, filled by admini.index()
+        self.admini = {}
+        # recovered content keys, see decrypt.content_key()
+        self.content_keys = {}
+        self._transfer_cb = None
+        self._transfer_interval = 0.0
+        self._c_transfer_cb = _native.file_cb(self._on_transfer)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def connected(self):
+        return self._handle is not None
+
+    def _remember_path(self, thread):
+        if self._unrestored:
+            # keep the path that could not be restored, so the thread's
+            # commands on the current path fail until it sets its own
+            self._unrestored = False
+            return
+        self._paths[thread] = self.cwd
+
+    def _recall_path(self, thread):
+        # a thread issuing several commands (install_zip() sending one file
+        # per command) may have been preempted by another that changed the
+        # device path in between.  Only commands acting on the current path
+        # put it back, and only unless the thread sets its own path first.
+        self._restore = self._paths.get(thread)
+        self._unrestored = False
+
+    def _restore_path(self):
+        path, self._restore = self._restore, None
+        if (path is None or self._handle is None
+                or (self.cwd is not None and cache_key(self.cwd) == cache_key(path))):
+            return
+        try:
+            self.setpath(path)
+        except ExwordError:
+            # the directory went away meanwhile; fail the command rather
+            # than run it wherever the device is
+            self._unrestored = True
+            raise
+
+    def _check(self, rsp):
+        if rsp != RSP_SUCCESS:
+            if rsp == _native.LIBUSB_ERROR_NO_DEVICE:
+                self._release(disconnect=False)
+            raise ExwordError(rsp)
+        return rsp
+
+    def _require(self):
+        if self._handle is None:
+            raise ExwordError(-1, 'not connected')
+        return self._lib, self._handle
+
+    def open(self):
+        with self._lock:
+            if self._handle is not None:
+                return self
+            lib = _native.load()
+            if self.transport is not None:
+                self._c_bulk = _bulk_callbacks(self.transport)
+                handle = lib.exword_open_transport(self.mode | self.region,
+                                                   self._c_bulk[0], self._c_bulk[1], None)
+            else:
+                index = self.index
+                if self.path is not None:
+                    from .devices import find_index
+                    index = find_index(self.path)
+                    if index is None:
+                        raise ExwordError(-1, 'device %s not found' % self.path)
+                handle = lib.exword_open_index(self.mode | self.region, index)
+            if not handle:
+                raise ExwordError(-1, 'device not found')
+            lib.exword_set_debug(handle, self.debug)
+            lib.exword_set_max_mtu(handle, self.max_mtu)
+            self._set_timeouts(lib, handle)
+            if lib.exword_set_pipeline(handle, 1 if self.pipeline else 0) != 0:
+                lib.exword_close(handle)
+                raise MemoryError('cannot allocate pipeline buffer')
+            lib.exword_register_callbacks(handle, self._c_transfer_cb, self._c_transfer_cb, None)
+            lib.exword_set_callback_interval(handle, int(self._transfer_interval * 1000))
+            rsp = lib.exword_connect(handle)
+            if rsp != RSP_SUCCESS:
+                lib.exword_close(handle)
+                raise ExwordError(rsp)
+            with self._handle_lock:
+                self._lib, self._handle = lib, handle
+            try:
+                self.sd_inserted = any(e.name == '_SD_00' for e in self.list(ROOT))
+                self.setpath(INTERNAL_MEM + '\\')
+            except ExwordError:
+                self.close()
+                raise
+            return self
+
+    def close(self):
+        self._release(disconnect=True)
+
+    def _release(self, disconnect):
+        with self._lock:
+            if self._handle is None:
+                return
+            lib, handle = self._lib, self._handle
+            with self._handle_lock:
+                self._handle = None
+            self.cwd = None
+            self._paths.clear()
+            self.dircache.bump()
+            self.admini.clear()
+            self.content_keys.clear()
+            if disconnect:
+                lib.exword_disconnect(handle)
+            lib.exword_close(handle)
+
+    def abort(self):
+        """Make the command running on another thread fail promptly.
+
+        Does not wait for the session lock; the command ends with
+        LIBUSB_ERROR_INTERRUPTED within one read timeout.  With no
+        command running it does nothing.
+        """
+        with self._handle_lock:
+            if self._handle is not None:
+                self._lib.exword_abort(self._handle)
+
+    def _set_timeouts(self, lib, handle):
+        lib.exword_set_timeouts(handle, int(self.timeout_min * 1000), int(self.timeout_max * 1000),
+                                int((self.request_timeout or 0) * 1000))
+
+    def set_timeouts(self, timeout_min=None, timeout_max=None, request_timeout=None):
+        """Change the timeouts (in seconds); None keeps a value, 0 for
+        request_timeout removes the limit."""
+        with self._handle_lock:
+            if timeout_min is not None:
+                self.timeout_min = timeout_min
+            if timeout_max is not None:
+                self.timeout_max = timeout_max
+            if request_timeout is not None:
+                self.request_timeout = request_timeout
+            if self._handle is not None:
+                self._set_timeouts(self._lib, self._handle)
+
+    def trace(self, since=0):
+        """Requests recorded by the C trace ring with id >= since, oldest
+        first, as stats.TraceEntry tuples.  Does not wait for the session
+        lock."""
+        from .stats import trace_entry
+        entries = (_native.exword_trace_t * _native.OBEX_TRACE_SIZE)()
+        with self._handle_lock:
+            if self._handle is None:
+                return []
+            n = self._lib.exword_get_trace(self._handle, entries, len(entries), since)
+        return [trace_entry(entries[i]) for i in range(n)]
+
+    def stats(self):
+        """{command: stats.Histogram} of the exword_* calls made so far,
+        followed by the time each priority class waited for the device."""
+        from .stats import histogram
+        stats = (_native.exword_stats_t * len(_native.STAT_COMMANDS))()
+        with self._handle_lock:
+            if self._handle is not None:
+                self._lib.exword_get_stats(self._handle, stats, len(stats))
+        result = collections.OrderedDict(
+            (name, histogram(stats[i])) for i, name in enumerate(_native.STAT_COMMANDS))
+        result.update(self._lock.stats())
+        return result
+
+    def reset_stats(self):
+        with self._handle_lock:
+            if self._handle is not None:
+                self._lib.exword_reset_stats(self._handle)
+        self._lock.reset_stats()
+
+    @property
+    def rtt(self):
+        """Smoothed packet round trip time in seconds (0 until measured)."""
+        with self._handle_lock:
+            if self._handle is None:
+                return 0.0
+            return self._lib.exword_get_rtt(self._handle) / 1e6
+
+    def set_debug(self, level):
+        with self._lock:
+            self.debug = level
+            if self._handle is not None:
+                self._lib.exword_set_debug(self._handle, level)
+
+    def set_transfer_callback(self, callback, interval=0.0):
+        """Install callback(filename, transferred, length) for send/get progress.
+
+        It is called from whichever thread runs the transfer, once per
+        OBEX packet, or with interval (seconds) only for the first and last
+        packet of a file and at most once per interval in between.  Pass
+        None to remove it.
+        """
+        self._transfer_cb = callback
+        self._transfer_interval = interval
+        with self._handle_lock:
+            if self._handle is not None:
+                self._lib.exword_set_callback_interval(self._handle, int(interval * 1000))
+
+    def _on_transfer(self, filename, transferred, length, user_data):
+        cb = self._transfer_cb
+        if cb is not None:
+            try:
+                cb(_native.decode(filename or b''), transferred, length)
+            except Exception:
+                # exceptions cannot propagate through the C callback
+                pass
+
+    @property
+    def mtu(self):
+        """Packet size negotiated on connect (0 while closed)."""
+        with self._lock:
+            if self._handle is None:
+                return 0
+            return self._lib.exword_get_mtu(self._handle)
+
+    def set_pipeline(self, enable):
+        with self._lock:
+            self.pipeline = enable
+            if self._handle is not None:
+                if self._lib.exword_set_pipeline(self._handle, 1 if enable else 0) != 0:
+                    raise MemoryError('cannot allocate pipeline buffer')
+
+    def setpath(self, path, mkdir=False):
+        with self._lock:
+            lib, handle = self._require()
+            self._restore = None
+            rsp = lib.exword_setpath(handle, _native.encode(path), 1 if mkdir else 0)
+            # after a failed request the device path is unknown
+            self.cwd = path if rsp == RSP_SUCCESS else None
+            self._check(rsp)
+            if mkdir:
+                for parent in parent_paths(path):
+                    self.dircache.invalidate(parent)
+
+    def chdir(self, path, mkdir=False):
+        """setpath() unless the device is already at path; returns whether
+        a request was sent."""
+        with self._lock:
+            if self.cwd is not None and cache_key(self.cwd) == cache_key(path):
+                return False
+            self.setpath(path, mkdir)
+            return True
+
+    def unit(self):
+        """Name of the connected unit that stays the same across
+        reconnects: its USB port path (devices.DeviceInfo.path), or the
+        serial of the transport.  None if it cannot be told."""
+        if self.transport is not None:
+            return getattr(self.transport, 'serial', None)
+        if self.path is not None:
+            return self.path
+        from .devices import list_devices
+        for info in list_devices():
+            if info.index == self.index:
+                return info.path
+        return None
+
+    def storage_root(self):
+        """Root used by the dict_* calls, derived from the current path."""
+        if self.cwd is not None and self.cwd.startswith(SD_CARD):
+            return SD_CARD + '\\'
+        return INTERNAL_MEM + '\\'
+
+    def list(self, path=None):
+        """List the current directory (or path, which becomes current).
+
+        Always asks the device; the result refreshes the cache.
+        """
+        return list(self.list_view(path))
+
+    def list_view(self, path=None):
+        """list() as a listing.Listing: the entries stay in the single
+        buffer the C library parsed them into and names are decoded on
+        access."""
+        from .listing import Listing
+        with self._lock:
+            lib, handle = self._require()
+            if path is not None:
+                self.chdir(path)
+            else:
+                self._restore_path()
+            generation = self.dircache.generation
+            ptr = ctypes.POINTER(_native.exword_listing_t)()
+            self._check(lib.exword_list_arena(handle, ctypes.byref(ptr)))
+            result = Listing.from_native(lib, ptr)
+            self.dircache.put(self.cwd, result, generation)
+            return result
+
+    def listdir(self, path, refresh=False, view=False):
+        """List path, from the cache when possible.
+
+        Unlike list() a cache hit costs no USB round trip and leaves the
+        current path unchanged.  With view=True the result is the cached
+        sequence itself (a listing.Listing when it came from the device)
+        instead of a list of DirEntry.
+        """
+        if not refresh:
+            entries = self.dircache.get(path, copy=not view)
+            if entries is not None:
+                return entries
+        result = self.list_view(path)
+        return result if view else list(result)
+
+    def send_file(self, name, data):
+        """Upload data, which may be bytes or any writable buffer.
+
+        The packets are filled straight from data, so bytes, bytearrays,
+        ctypes arrays and mmaps are not copied first; other read-only
+        buffers are.
+        """
+        with self._lock:
+            lib, handle = self._require()
+            self._restore_path()
+            data = _c_buffer(data)
+            self.dircache.invalidate(self.cwd or '')
+            self._check(lib.exword_send_file(handle, _native.encode(name), data, len(data)))
+
+    def send_mapped(self, name, path):
+        """Upload local file path from a memory mapping of it.
+
+        The file is never read into a Python object; the pages are read
+        as the packets are filled.  Unlike send_stream() there is no
+        Python callback per packet and no cancel.
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return self.send_file(name, b'')
+            # ACCESS_COPY maps are writable for ctypes but never written
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) as m:
+                data = (ctypes.c_char * size).from_buffer(m)
+                try:
+                    self.send_file(name, data)
+                finally:
+                    # the mapping cannot be closed while data exports it
+                    del data
+
+    def get_file(self, name):
+        with self._lock:
+            lib, handle = self._require()
+            self._restore_path()
+            buf = _native._buffer()
+            length = ctypes.c_int()
+            rsp = lib.exword_get_file(handle, _native.encode(name), ctypes.byref(buf), ctypes.byref(length))
+            try:
+                self._check(rsp)
+                return ctypes.string_at(buf, length.value) if buf else b''
+            finally:
+                if buf:
+                    lib.exword_free_buffer(buf)
+
+    # --- streaming transfers ---
+    # The C side asks for / hands over one OBEX packet at a time, so only
+    # about one MTU of file data is held in memory regardless of file size.
+
+    def send_stream(self, name, src, length=None, cancel=None):
+        """Upload from a file object or an iterable of bytes chunks.
+
+        length is required for iterables and for file objects that cannot
+        report their size.  cancel, if given, is polled once per packet and
+        aborts the transfer when it returns true; the device is then left
+        mid-upload, so reconnect before doing anything else.
+        """
+        if length is None:
+            length = _stream_length(src)
+        if hasattr(src, 'read'):
+            read = _file_reader(src)
+        elif isinstance(src, (bytes, bytearray, memoryview)):
+            read = _iter_reader(iter([src]))
+        else:
+            read = _iter_reader(iter(src))
+        state = {'sent': 0, 'error': None}
+
+        def callback(buffer, size, user_data):
+            try:
+                if cancel is not None and cancel():
+                    return -1
+                size = min(size, length - state['sent'])
+                view = memoryview((ctypes.c_char * size).from_address(buffer)).cast('B')
+                n = read(view)
+                state['sent'] += n
+                return n
+            except Exception as e:
+                state['error'] = e
+                return -1
+        c_callback = _native.stream_read_cb(callback)
+        with self._lock:
+            lib, handle = self._require()
+            self._restore_path()
+            self.dircache.invalidate(self.cwd or '')
+            rsp = lib.exword_send_file_stream(handle, _native.encode(name), length, c_callback, None)
+        self._stream_done(rsp, state['error'], cancel)
+
+    def get_stream(self, name, dst, cancel=None):
+        """Download into a file object (or callable taking bytes chunks).
+
+        Returns the number of bytes written.  cancel works as in send_stream().
+        """
+        write = dst.write if hasattr(dst, 'write') else dst
+        state = {'received': 0, 'error': None}
+
+        def callback(buffer, size, user_data):
+            try:
+                if cancel is not None and cancel():
+                    return -1
+                write(ctypes.string_at(buffer, size))
+                state['received'] += size
+                return size
+            except Exception as e:
+                state['error'] = e
+                return -1
+        c_callback = _native.stream_write_cb(callback)
+        with self._lock:
+            lib, handle = self._require()
+            self._restore_path()
+            rsp = lib.exword_get_file_stream(handle, _native.encode(name), c_callback, None)
+        self._stream_done(rsp, state['error'], cancel)
+        return state['received']
+
+    def iter_file(self, name, window=4):
+        """Yield the contents of name as bytes chunks (one per OBEX packet).
+
+        The download runs on a helper thread and at most `window` chunks are
+        buffered ahead of the consumer.  Closing the generator early aborts
+        the transfer.
+        """
+        chunks = queue.Queue(window)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def run():
+            try:
+                self.get_stream(name, put, cancel=stop.is_set)
+            except Exception as e:
+                put(e)
+            else:
+                put(end)
+        thread = threading.Thread(target=run, name='libexword-iter', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def _stream_done(self, rsp, error, cancel):
+        if error is not None:
+            raise error
+        if rsp != RSP_SUCCESS and cancel is not None and cancel():
+            raise ExwordError(rsp, 'transfer cancelled')
+        self._check(rsp)
+
+    def remove_file(self, name, convert_to_unicode=False):
+        with self._lock:
+            lib, handle = self._require()
+            self._restore_path()
+            self.dircache.invalidate(self.cwd or '')
+            self._check(lib.exword_remove_file(handle, _native.encode(name), 1 if convert_to_unicode else 0))
+
+    def model(self):
+        with self._lock:
+            lib, handle = self._require()
+            m = _native.exword_model_t()
+            self._check(lib.exword_get_model(handle, ctypes.byref(m)))
+            return Model(_native.decode(m.model), _native.decode(m.sub_model),
+                         _native.decode(m.ext_model), m.capabilities & 0xffff)
+
+    def capacity(self, root=None, refresh=False):
+        """Capacity of the storage holding root (default: the current path).
+
+        Cached per storage root until something below it changes; a root
+        other than the current one is visited and the path restored.
+        """
+        with self._lock:
+            lib, handle = self._require()
+            if root is None:
+                self._restore_path()
+            path = root if root is not None else (self.cwd or self.storage_root())
+            if not refresh:
+                cached = self.dircache.get_capacity(path)
+                if cached is not None:
+                    return cached
+            generation = self.dircache.generation
+            cwd = self.cwd
+            if root is not None:
+                self.chdir(root)
+            try:
+                cap = _native.exword_capacity_t()
+                self._check(lib.exword_get_capacity(handle, ctypes.byref(cap)))
+            finally:
+                if root is not None and cwd is not None and self.connected:
+                    self.chdir(cwd)
+            result = Capacity(cap.total, cap.free)
+            self.dircache.put_capacity(path, result, generation)
+            return result
+
+    def sd_format(self):
+        with self._lock:
+            lib, handle = self._require()
+            self.dircache.invalidate_tree(SD_CARD)
+            self._check(lib.exword_sd_format(handle))
+
+    # --- add-on install primitives (what dict_install() sends) ---
+
+    def unlock(self):
+        with self._lock:
+            lib, handle = self._require()
+            self._check(lib.exword_unlock(handle))
+
+    def lock(self):
+        with self._lock:
+            lib, handle = self._require()
+            self._check(lib.exword_lock(handle))
+
+    def cname(self, name, dir):
+        """Register the display name of the add-on installed in dir."""
+        with self._lock:
+            lib, handle = self._require()
+            self._restore_path()
+            self.dircache.invalidate(self.cwd or '')
+            # cname rewrites admini.inf of the current root
+            self.admini.pop(cache_key(self.cwd or ''), None)
+            self._check(lib.exword_cname(handle, _native.encode(name), _native.encode(dir)))
+
+    def cryptkey(self, blk1, blk2):
+        """Send the two CryptKey input blocks, return the generated 12 byte key."""
+        if len(blk1) != 16 or len(blk2) != 12:
+            raise ValueError('CryptKey blocks must be 16 and 12 bytes')
+        with self._lock:
+            lib, handle = self._require()
+            ck = _native.exword_cryptkey_t()
+            ctypes.memmove(ck.blk1, bytes(blk1), 16)
+            ctypes.memmove(ck.blk2, bytes(blk2), 12)
+            self._check(lib.exword_cryptkey(handle, ctypes.byref(ck)))
+            return bytes(ck.key)
+
+    # --- add-on dictionaries (dict.c) ---
+    # The dict_* functions change the device path; like the exword shell we
+    # restore the previous path afterwards.
+
+    # dict_* calls that change the device contents
+    _DICT_WRITES = ('dict_install', 'dict_remove', 'dict_reset')
+
+    def _dict_call(self, fname, *args):
+        with self._lock:
+            lib, handle = self._require()
+            cwd = self.cwd
+            if fname in self._DICT_WRITES:
+                self.dircache.bump()
+                self.admini.clear()
+            try:
+                return getattr(lib, fname)(handle, *args)
+            finally:
+                if cwd is not None:
+                    if lib.exword_setpath(handle, _native.encode(cwd), 0) != RSP_SUCCESS:
+                        root = self.storage_root()
+                        self.cwd = None
+                        self._check(lib.exword_setpath(handle, _native.encode(root), 0))
+                        self.cwd = root
+
+    def dict_list(self, root=None):
+        return self._dict_call('dict_list', _native.encode(root or self.storage_root()))
+
+    def dict_auth(self, user, key=None):
+        if key is not None and len(key) != 20:
+            raise ValueError('authkey must be 20 bytes')
+        return bool(self._dict_call('dict_auth', _native.encode(user), key))
+
+    def dict_reset(self, user):
+        return bool(self._dict_call('dict_reset', _native.encode(user)))
+
+    def dict_install(self, id, root=None):
+        """Install the add-on staged in directory `id` (relative to the cwd)."""
+        return bool(self._dict_call('dict_install', _native.encode(root or self.storage_root()),
+                                    _native.encode(id)))
+
+    def dict_remove(self, id, root=None):
+        return bool(self._dict_call('dict_remove', _native.encode(root or self.storage_root()),
+                                    _native.encode(id)))
+
+    def dict_decrypt(self, id, root=None):
+        return bool(self._dict_call('dict_decrypt', _native.encode(root or self.storage_root()),
+                                    _native.encode(id)))
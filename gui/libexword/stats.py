@@ -0,0 +1,139 @@
+"""Request trace and latency histograms
+
+The C library records every OBEX request in a 256 entry ring (opcode,
+bytes, MTU, retries and the time spent writing, waiting for the sequence
+echo and reading) and keeps a log2 latency histogram per exword_* command.
+Both are read without taking the session lock, so a stats view can poll
+them while a transfer runs:
+
+    log = TraceLog(session)
+    log.poll()                      # collect requests since the last poll
+    for name, h in session.stats().items():
+        print(name, h.count, h.percentile(99))
+    export_chrome('trace.json', log.entries)
+
+The exported file opens in chrome://tracing or https://ui.perfetto.dev.
+"""
+import collections
+import json
+
+from ._native import STAT_COMMANDS
+
+OPCODES = {0x00: 'connect', 0x01: 'disconnect', 0x02: 'put', 0x03: 'get', 0x05: 'setpath'}
+
+
+class TraceEntry(collections.namedtuple(
+        'TraceEntry', 'id start command opcode mtu rsp packets retries tx_bytes rx_bytes '
+                      'write seq read total')):
+    """One OBEX request; start is seconds since the epoch, times in seconds."""
+    __slots__ = ()
+
+    @property
+    def op(self):
+        return OPCODES.get(self.opcode & 0x7f, '0x%02x' % self.opcode)
+
+    @property
+    def ok(self):
+        return self.rsp & 0x7f == 0x20
+
+
+class Histogram(collections.namedtuple('Histogram', 'count errors total max buckets')):
+    """Latencies of one command; bucket i holds calls of 2**i to 2**(i+1)-1 us.
+
+    total and max are in seconds.
+    """
+    __slots__ = ()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Upper bound in seconds of the bucket holding the p-th percentile."""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(2 ** (i + 1) / 1e6, self.max)
+        return self.max
+
+
+def trace_entry(e):
+    command = STAT_COMMANDS[e.command] if e.command < len(STAT_COMMANDS) else str(e.command)
+    return TraceEntry(e.id, e.start_us / 1e6, command, e.opcode, e.mtu, e.rsp, e.packets,
+                      e.retries, e.tx_bytes, e.rx_bytes, e.write_us / 1e6, e.seq_us / 1e6,
+                      e.read_us / 1e6, e.total_us / 1e6)
+
+
+def histogram(s):
+    return Histogram(s.count, s.errors, s.total_us / 1e6, s.max_us / 1e6, tuple(s.buckets))
+
+
+class TraceLog(object):
+    """Requests of a session collected across polls (the C ring only keeps
+    the last 256).  dropped counts requests that were overwritten before
+    poll() saw them."""
+
+    def __init__(self, session, limit=10000):
+        self.session = session
+        self.entries = collections.deque(maxlen=limit)
+        self.dropped = 0
+        self._next = 0
+
+    def poll(self):
+        """Fetch the requests recorded since the last call; returns them."""
+        new = []
+        while True:
+            batch = self.session.trace(self._next)
+            if not batch:
+                break
+            self.dropped += batch[0].id - self._next
+            self._next = batch[-1].id + 1
+            new.extend(batch)
+        self.entries.extend(new)
+        return new
+
+    def clear(self):
+        self.entries.clear()
+        self.dropped = 0
+
+
+def chrome_trace(entries, name='libexword', stats=None):
+    """Chrome trace event format dict for entries.
+
+    Each request becomes a complete event with its write, sequence echo and
+    read time as consecutive child slices (the phases of one request
+    interleave per packet; the slices show their totals).
+    """
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 1,
+               'args': {'name': name}}]
+    for e in entries:
+        ts = e.start * 1e6
+        args = {'id': e.id, 'opcode': '0x%02x' % e.opcode, 'rsp': e.rsp, 'mtu': e.mtu,
+                'packets': e.packets, 'retries': e.retries,
+                'tx_bytes': e.tx_bytes, 'rx_bytes': e.rx_bytes}
+        events.append({'name': '%s %s' % (e.command, e.op), 'cat': 'obex', 'ph': 'X',
+                       'pid': 1, 'tid': 1, 'ts': ts, 'dur': e.total * 1e6, 'args': args})
+        for phase in ('write', 'seq', 'read'):
+            dur = getattr(e, phase) * 1e6
+            if dur > 0:
+                events.append({'name': phase, 'cat': 'phase', 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': ts, 'dur': dur})
+                ts += dur
+    result = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    if stats is not None:
+        result['otherData'] = {'stats': dict(
+            (k, {'count': h.count, 'errors': h.errors, 'mean_ms': h.mean * 1000,
+                 'p50_ms': h.percentile(50) * 1000, 'p99_ms': h.percentile(99) * 1000,
+                 'max_ms': h.max * 1000})
+            for k, h in stats.items() if h.count)}
+    return result
+
+
+def export_chrome(path, entries, name='libexword', stats=None):
+    """Write entries (and optionally session.stats()) as a Chrome trace file."""
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(entries, name, stats), f)
@@ -0,0 +1,266 @@
+"""Device I/O worker thread
+
+USB transfers block for a long time (obex.c waits up to the session's
+timeout_max, 800 ms by default, for each response), so they must not run
+on the Tk thread.  A
+DeviceWorker runs jobs one at a time on its own thread; completion, error
+and progress notifications are queued and delivered on the GUI thread by
+pump(), which attach() schedules with after().
+
+    worker = DeviceWorker()
+    worker.attach(root)
+    worker.submit(lambda job: session.send_file(name, data),
+                  on_done=lambda result: ...)
+
+Transfer progress from the session's callback is coalesced: report_transfer()
+only updates a progress.Meter of the job and one of the device, and a
+job's on_progress(filename, transferred, length) and on_transfer(job_progress,
+device_progress) are posted at most progress_hz times a second, plus once
+when the job ends.
+
+Jobs run in the priority class (see sched.py) they were submitted with.
+INTERACTIVE jobs have a second thread of their own, so a listing does not
+wait for the install queued before it; on the session they then get the
+device at the next command boundary of that install.
+"""
+import queue
+import threading
+import time
+
+from . import progress, sched
+
+
+class Cancelled(Exception):
+    """Raised inside a job when it has been cancelled."""
+
+
+class Job(object):
+    """A unit of work for DeviceWorker.
+
+    func is called as func(job, *args, **kwargs) on the worker thread.  Long
+    running jobs should call job.check() between steps and job.progress()
+    to report how far they are, and job.expect() with the byte count they
+    will transfer if they know it, for the ETA.
+    """
+
+    def __init__(self, worker, func, args, kwargs, name=None,
+                 on_done=None, on_error=None, on_progress=None, priority=sched.NORMAL,
+                 on_transfer=None):
+        self.name = name or getattr(func, '__name__', 'job')
+        self.priority = priority
+        self.on_transfer = on_transfer
+        self.meter = progress.Meter(self.name)
+        self._reported = None
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self._worker = worker
+        self._cancel = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def __repr__(self):
+        return '<Job %s>' % self.name
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled(self.name)
+
+    def progress(self, *info):
+        """Queue a progress notification (delivered to on_progress(*info))."""
+        if self.on_progress is not None:
+            self._worker._post(self.on_progress, info)
+
+    def expect(self, nbytes):
+        """Announce the bytes the job will transfer in all."""
+        self.meter.total = nbytes
+
+    def _report(self, now):
+        # called with the worker's meter lock held
+        self._reported = now
+        job, device = self.meter.snapshot(now), self._worker.meter.snapshot(now)
+        if self.on_progress is not None:
+            self._worker._post(self.on_progress, (job.filename, job.transferred, job.length))
+        if self.on_transfer is not None:
+            self._worker._post(self.on_transfer, (job, device))
+
+    def _flush(self):
+        """Report what was transferred since the last notification."""
+        with self._worker._meter_lock:
+            if self.meter.updated is not None and self.meter.updated != self._reported:
+                self._report(time.monotonic())
+
+    def wait(self, timeout=None):
+        """Block until the job finished.  Not for use on the GUI thread."""
+        self.done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _Lane(threading.Thread):
+    """The thread running the INTERACTIVE jobs of a DeviceWorker."""
+
+    def __init__(self, worker):
+        super().__init__(name=worker.name + '-interactive', daemon=True)
+        self._worker = worker
+        self._jobs = queue.Queue()
+        self.current = None
+        self.start()
+
+    def run(self):
+        self._worker._run_jobs(self)
+
+
+class DeviceWorker(threading.Thread):
+    """Single thread that owns all device I/O, fed by a FIFO job queue
+    (plus a second one for INTERACTIVE jobs, started when first needed)."""
+
+    def __init__(self, name='libexword-worker', progress_hz=10):
+        super().__init__(name=name, daemon=True)
+        # for Session.set_transfer_callback(worker.report_transfer, worker.progress_interval)
+        self.progress_interval = 1.0 / progress_hz
+        self.meter = progress.Meter(name)
+        self._meter_lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._widget = None
+        self._interval = 16
+        self._interactive = None
+        self._lanes_lock = threading.Lock()
+        self.current = None
+        self.start()
+
+    def _lanes(self):
+        return [lane for lane in (self, self._interactive) if lane is not None]
+
+    def submit(self, func, *args, name=None, on_done=None, on_error=None,
+               on_progress=None, on_transfer=None, priority=sched.NORMAL, **kwargs):
+        job = Job(self, func, args, kwargs, name, on_done, on_error, on_progress, priority,
+                  on_transfer)
+        lane = self
+        if priority == sched.INTERACTIVE:
+            with self._lanes_lock:
+                if self._interactive is None:
+                    self._interactive = _Lane(self)
+                lane = self._interactive
+        lane._jobs.put(job)
+        return job
+
+    def cancel_all(self):
+        """Cancel the running jobs and everything still queued."""
+        for lane in self._lanes():
+            current = lane.current
+            if current is not None:
+                current.cancel()
+            pending = []
+            while True:
+                try:
+                    pending.append(lane._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            for job in pending:
+                if job is None:
+                    lane._jobs.put(None)
+                    continue
+                job.cancel()
+                lane._jobs.put(job)
+
+    def stop(self, wait=True, cancel=True):
+        """End the threads, cancelling outstanding jobs unless cancel is false."""
+        if cancel:
+            self.cancel_all()
+        with self._lanes_lock:
+            lanes = self._lanes()
+        for lane in lanes:
+            lane._jobs.put(None)
+        if wait:
+            for lane in lanes:
+                if threading.current_thread() is not lane:
+                    lane.join()
+
+    def report_transfer(self, filename, transferred, length):
+        """Transfer callback for Session: account it to the running job."""
+        job = self.current
+        if self._interactive is not None and threading.current_thread() is self._interactive:
+            job = self._interactive.current
+        now = time.monotonic()
+        with self._meter_lock:
+            self.meter.update(filename, transferred, length, now)
+            if job is None:
+                return
+            job.meter.update(filename, transferred, length, now)
+            if job._reported is None or now - job._reported >= self.progress_interval:
+                job._report(now)
+
+    def run(self):
+        self._run_jobs(self)
+
+    def _run_jobs(self, lane):
+        while True:
+            job = lane._jobs.get()
+            if job is None:
+                break
+            lane.current = job
+            try:
+                job.check()
+                with sched.priority(job.priority):
+                    job.result = job.func(job, *job.args, **job.kwargs)
+            except Exception as e:
+                job.error = e
+                job._flush()
+                if job.on_error is not None:
+                    self._post(job.on_error, (e,))
+            else:
+                job._flush()
+                if job.on_done is not None:
+                    self._post(job.on_done, (job.result,))
+            finally:
+                lane.current = None
+                job.done.set()
+
+    # --- GUI side ---
+
+    def _post(self, callback, args):
+        self._events.put((callback, args))
+
+    def post(self, callback, *args):
+        """Run callback(*args) on the GUI thread; may be called from any thread."""
+        self._post(callback, args)
+
+    def pump(self):
+        """Deliver queued notifications.  Call on the GUI thread."""
+        while True:
+            try:
+                callback, args = self._events.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+
+    def attach(self, widget, interval=16):
+        """Pump events from widget's Tk event loop every interval ms."""
+        self._widget = widget
+        self._interval = interval
+        widget.after(interval, self._tick)
+
+    def _tick(self):
+        try:
+            self.pump()
+        finally:
+            if self._widget is not None:
+                try:
+                    self._widget.after(self._interval, self._tick)
+                except Exception:
+                    # widget already destroyed (TclError)
+                    self._widget = None
@@ -0,0 +1,188 @@
+"""ZIP members read from a memory mapping of the archive
+
+zipfile.ZipFile.read() inflates a whole member into a bytes object, and
+dict_install() in dict.c wants the files extracted to a directory and
+reads each back whole.  MappedZip maps the archive instead and hands out
+members without extracting them or holding them in memory:
+
+    with MappedZip(path) as mz:
+        for info in mz.zf.infolist():
+            data = mz.buffer(info)          # STORED: the mapped bytes
+            if data is None:
+                r = mz.open(info, key)      # others: inflate as read
+                r.readinto(packet)
+
+buffer() is a ctypes array over the mapping (the pages are read as the
+packets are filled, see Session.send_file()).  open() returns a reader
+that inflates DEFLATE members straight from the mapping a chunk at a
+time, optionally XORs with the add-on cipher (crypt.py) and checks the
+CRC-32 at the end.  release() gives the pages of a member back, so the
+resident size stays flat however big the archive is.
+"""
+import ctypes
+import mmap
+import struct
+import zipfile
+import zlib
+
+from . import crypt
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_MAGIC = b'PK\003\004'
+# compressed bytes given to zlib at a time; unconsumed_tail copies them
+_INPUT = 1 << 16
+
+
+class MappedZip(object):
+    """An archive mapped into memory, with its zipfile.ZipFile in zf."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self.zf = zipfile.ZipFile(self._file)
+            # ACCESS_COPY maps are writable for ctypes but never written
+            self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zf.close()
+        try:
+            self.mm.close()
+        except BufferError:
+            # a traceback still holds a buffer() array; the mapping goes
+            # away with it
+            pass
+        self._file.close()
+
+    def read(self, info):
+        """Whole contents of a (small) member."""
+        return self.zf.read(info)
+
+    def offset(self, info):
+        """Position of the member's data in the archive."""
+        header = _LOCAL_HEADER.unpack_from(self.mm, info.header_offset)
+        if header[0] != _LOCAL_MAGIC:
+            raise zipfile.BadZipFile('%s: bad local file header' % info.filename)
+        return info.header_offset + _LOCAL_HEADER.size + header[10] + header[11]
+
+    def _check(self, info):
+        if info.flag_bits & 0x1:
+            raise zipfile.BadZipFile('%s: encrypted members are not supported' % info.filename)
+
+    def buffer(self, info):
+        """The member's bytes in place as a ctypes array, or None unless
+        it is STORED.  The CRC-32 is checked first.  Delete the array
+        before close(): the mapping cannot be closed while it is in use.
+        """
+        self._check(info)
+        if info.compress_type != zipfile.ZIP_STORED or not info.file_size:
+            return None
+        start = self.offset(info)
+        if zlib.crc32(memoryview(self.mm)[start:start + info.file_size]) != info.CRC:
+            raise zipfile.BadZipFile('Bad CRC-32 for file %r' % info.filename)
+        return (ctypes.c_char * info.file_size).from_buffer(self.mm, start)
+
+    def open(self, info, key=None):
+        """Reader of the member's contents, XORed with key if given."""
+        self._check(info)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            start = self.offset(info)
+            return _Inflater(info, memoryview(self.mm)[start:start + info.compress_size], key)
+        if info.compress_type == zipfile.ZIP_STORED:
+            start = self.offset(info)
+            return _Reader(info, memoryview(self.mm)[start:start + info.file_size], key)
+        # other methods: let zipfile decompress, still a chunk at a time
+        return _Reader(info, self.zf.open(info), key)
+
+    def release(self, info):
+        """Drop the pages of the member's compressed data from memory."""
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        start = info.header_offset - info.header_offset % mmap.PAGESIZE
+        end = min(self.offset(info) + info.compress_size, len(self.mm))
+        self.mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+class _Reader(object):
+    """File-like reader of a member; src is a memoryview of the stored
+    bytes or a file object producing the contents."""
+
+    def __init__(self, info, src, key):
+        self.name = info.filename
+        self.length = info.file_size
+        self._crc = info.CRC
+        self._src = src
+        self._key = key
+        self._out = 0
+        self._sum = 0
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        # the archive's mapping cannot be closed while src views it
+        if isinstance(self._src, memoryview):
+            self._src.release()
+        else:
+            self._src.close()
+
+    def _fill(self, view):
+        if isinstance(self._src, memoryview):
+            n = min(len(view), self.length - self._out)
+            view[:n] = self._src[self._out:self._out + n]
+            return n
+        return self._src.readinto(view)
+
+    def readinto(self, view):
+        view = memoryview(view).cast('B')
+        n = self._fill(view)
+        if n:
+            self._sum = zlib.crc32(view[:n], self._sum)
+            if self._key is not None:
+                crypt.xor_inplace(view[:n], self._key, self._out)
+            self._out += n
+        if self._out >= self.length and self._sum != self._crc:
+            raise zipfile.BadZipFile('Bad CRC-32 for file %r' % self.name)
+        return n
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.length - self._out
+        buf = bytearray(size)
+        return bytes(buf[:self.readinto(buf)])
+
+
+class _Inflater(_Reader):
+    """_Reader of a DEFLATE member, inflated from the mapping as read."""
+
+    def __init__(self, info, src, key):
+        super().__init__(info, src, key)
+        self._z = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._pos = 0
+        self._tail = b''
+
+    def close(self):
+        self._tail = b''
+        super().close()
+
+    def _fill(self, view):
+        n = 0
+        while n < len(view):
+            if not self._tail:
+                if self._pos >= len(self._src):
+                    break
+                self._tail = self._src[self._pos:self._pos + _INPUT]
+                self._pos += len(self._tail)
+            data = self._z.decompress(self._tail, len(view) - n)
+            self._tail = self._z.unconsumed_tail
+            view[n:n + len(data)] = data
+            n += len(data)
+        return n
@@ -0,0 +1,92 @@
+import unittest
+
+import libexword
+from libexword.batch import Batch
+
+
+class DependencyTest(unittest.TestCase):
+
+    def test_remove_waits_for_ops_inside_removed_directory(self):
+        b = Batch()
+        b.get('\\_INTERNAL_00\\A\\B', 'old.txt')
+        b.remove('\\_INTERNAL_00\\A', 'B')
+        self.assertEqual(b.dependencies()[1], {0})
+        self.assertEqual(b.schedule('\\_INTERNAL_00\\A'), [0, 1])
+
+    def test_ops_inside_removed_directory_wait_for_remove(self):
+        b = Batch()
+        b.send('\\_INTERNAL_00\\A\\B\\C', 'x.txt', b'x')
+        b.remove('\\_INTERNAL_00\\A', 'B')
+        b.mkdir('\\_INTERNAL_00\\A\\B')
+        b.list('\\_INTERNAL_00\\A\\B')
+        deps = b.dependencies()
+        self.assertEqual(deps[1], {0})
+        self.assertIn(1, deps[2])
+        self.assertIn(1, deps[3])
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class MockRunTest(unittest.TestCase):
+
+    def test_get_before_remove_of_its_directory(self):
+        from libexword import mock
+        device = mock.MockDevice(0, None, None)
+        try:
+            with libexword.Session(transport=device) as s:
+                s.setpath('\\_INTERNAL_00\\A\\B', mkdir=True)
+                s.send_file('old.txt', b'old')
+                s.setpath('\\_INTERNAL_00\\A')
+                b = Batch()
+                b.get('\\_INTERNAL_00\\A\\B', 'old.txt')
+                b.remove('\\_INTERNAL_00\\A', 'B')
+                result = b.run(s)
+                self.assertEqual(result.order, [0, 1])
+                self.assertEqual(result.errors, [])
+                self.assertEqual(result.results[0], b'old')
+        finally:
+            device.close()
+
+    def test_mkdir_setpaths_are_counted(self):
+        from libexword import mock
+        device = mock.MockDevice(0, None, None)
+        try:
+            with libexword.Session(transport=device) as s:
+                b = Batch()
+                b.mkdir('\\_INTERNAL_00\\N')
+                b.send('\\_INTERNAL_00\\N', 'a.txt', b'a')
+                result = b.run(s)
+                self.assertEqual(result.setpaths, 1)
+                self.assertEqual(result.saved, 1)
+        finally:
+            device.close()
+
+    def test_local_failures_do_not_stop_the_batch(self):
+        import os
+        import shutil
+        import tempfile
+        from libexword import mock
+        tmp = tempfile.mkdtemp()
+        device = mock.MockDevice(0, None, None)
+        try:
+            with libexword.Session(transport=device) as s:
+                s.setpath('\\_INTERNAL_00')
+                s.send_file('b.txt', b'b')
+                b = Batch()
+                b.send('\\_INTERNAL_00', 'a.txt', os.path.join(tmp, 'missing.txt'))
+                b.get('\\_INTERNAL_00', 'b.txt', os.path.join(tmp, 'no', 'dir', 'b.txt'))
+                b.get('\\_INTERNAL_00', 'nope.txt', os.path.join(tmp, 'nope.txt'))
+                b.get('\\_INTERNAL_00', 'b.txt')
+                result = b.run(s)
+                self.assertIsInstance(result.results[0], FileNotFoundError)
+                self.assertIsInstance(result.results[1], FileNotFoundError)
+                self.assertIsInstance(result.results[2], libexword.ExwordError)
+                self.assertFalse(os.path.exists(os.path.join(tmp, 'nope.txt')))
+                self.assertEqual(result.results[3], b'b')
+                self.assertEqual([i for i, e in result.errors], [0, 1, 2])
+        finally:
+            device.close()
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
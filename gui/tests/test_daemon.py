@@ -0,0 +1,161 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import libexword
+from libexword import daemon
+from libexword.session import DirEntry, ExwordError, Model
+
+
+class FrameTest(unittest.TestCase):
+
+    def round_trip(self, obj):
+        a, b = socket.socketpair()
+        try:
+            daemon._send(a, obj)
+            return daemon._recv(b)
+        finally:
+            a.close()
+            b.close()
+
+    def test_plain_data_and_result_types(self):
+        obj = ('ok', {'entries': [DirEntry(b'A.TXT\x00', 0)], 'key': b'\x00\xff'},
+               Model('XD-EMU', 'EMU', '', 15))
+        reply = self.round_trip(obj)
+        self.assertEqual(reply, ['ok', {'entries': [DirEntry(b'A.TXT\x00', 0)], 'key': b'\x00\xff'},
+                                 Model('XD-EMU', 'EMU', '', 15)])
+        self.assertIsInstance(reply[2], Model)
+
+    def test_other_objects_are_refused(self):
+        self.assertRaises(TypeError, daemon._send, None, ('ok', object()))
+        self.assertRaises(ValueError, daemon._decode, {'t': 'Popen', 'v': []})
+
+    def test_oversized_frame_is_refused(self):
+        a, b = socket.socketpair()
+        try:
+            a.sendall(daemon._LENGTH.pack(daemon._MAX_FRAME + 1))
+            self.assertRaises(ValueError, daemon._recv, b)
+        finally:
+            a.close()
+            b.close()
+
+
+class PrivateDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_private_directory_passes(self):
+        daemon._private_dir(self.dir)
+
+    def test_shared_directory_is_refused(self):
+        os.chmod(self.dir, 0o755)
+        self.assertRaises(ExwordError, daemon._private_dir, self.dir)
+        self.assertRaises(ExwordError, daemon._connect, os.path.join(self.dir, 'daemon.sock'))
+
+    def test_symlink_is_refused(self):
+        link = os.path.join(tempfile.gettempdir(), 'libexword-test-%d' % os.getpid())
+        os.symlink(self.dir, link)
+        try:
+            self.assertRaises(ExwordError, daemon._private_dir, link)
+        finally:
+            os.unlink(link)
+
+    @unittest.skipUnless(hasattr(socket, 'SO_PEERCRED'), 'no SO_PEERCRED')
+    def test_peer_uid(self):
+        a, b = socket.socketpair(socket.AF_UNIX)
+        try:
+            self.assertEqual(daemon._peer_uid(a), os.getuid())
+        finally:
+            a.close()
+            b.close()
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class DaemonTest(unittest.TestCase):
+    RING = 64 << 10
+
+    def setUp(self):
+        from libexword import mock
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run', 'daemon.sock')
+        self.device = mock.MockDevice(0, None, None)
+        self.daemon = daemon.Daemon(self.path, self.RING,
+                                    {daemon.EMULATOR: {'transport': self.device}}).start()
+        self.a = self.client()
+        self.b = self.client()
+        self.a.setpath('\\_INTERNAL_00\\A', mkdir=True)
+        self.b.setpath('\\_INTERNAL_00')
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        self.daemon.close()
+        self.device.close()
+        shutil.rmtree(self.dir)
+
+    def client(self):
+        return daemon.connect(device=daemon.EMULATOR, socket_path=self.path)
+
+    def test_round_trip_across_ring_wraparound(self):
+        for n in (0, 1, self.RING - 1, self.RING, 3 * self.RING + 7):
+            data = os.urandom(n)
+            self.a.send_file('X.BIN', data)
+            self.assertEqual(self.a.get_file('X.BIN'), data)
+        self.assertEqual(self.a.model().model, 'XD-EMU')
+        self.assertIsInstance(self.a.capacity(), libexword.Capacity)
+        # each client keeps its own path
+        names = [e.name for e in self.b.list()]
+        self.assertIn('A', names)
+        self.assertNotIn('X.BIN', names)
+
+    def test_cancelled_upload(self):
+        calls = [0]
+
+        def cancel():
+            calls[0] += 1
+            return calls[0] > 3
+        big = bytes(8 * self.RING)
+        self.assertRaises(ExwordError, self.a.send_stream, 'BIG.BIN', big, len(big), cancel=cancel)
+        # what was left in the ring is skipped by the next upload
+        data = os.urandom(self.RING + 5)
+        self.a.send_file('Y.BIN', data)
+        self.assertEqual(self.a.get_file('Y.BIN'), data)
+
+    def test_cancelled_download(self):
+        big = os.urandom(8 * self.RING)
+        self.a.send_file('BIG.BIN', big)
+        chunks = []
+        self.assertRaises(ExwordError, self.a.get_stream, 'BIG.BIN', chunks.append,
+                          cancel=lambda: bool(chunks))
+        self.assertEqual(self.a.get_file('BIG.BIN'), big)
+
+    def test_short_source(self):
+        self.assertRaises(ValueError, self.a.send_stream, 'S.BIN', io.BytesIO(b'abc'), 10)
+        self.a.send_file('S.BIN', b'abcdefghij')
+        self.assertEqual(self.a.get_file('S.BIN'), b'abcdefghij')
+
+    def test_error_reply(self):
+        self.assertRaises(ExwordError, self.a.get_file, 'NOPE.BIN')
+        self.a.send_file('Z.BIN', b'z')
+        self.assertEqual(self.a.get_file('Z.BIN'), b'z')
+
+    def test_other_clients_writes_invalidate(self):
+        self.a.admini['x'] = 1
+        self.a.content_keys['y'] = 2
+        self.a.send_file('OWN.BIN', b'own')
+        self.assertEqual(self.a.admini, {'x': 1})
+        self.b.send_file('B.BIN', b'b')
+        self.a.model()
+        self.assertEqual(self.a.admini, {})
+        self.assertEqual(self.a.content_keys, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
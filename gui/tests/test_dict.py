@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import libexword
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class KeyCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        from libexword import install, mock
+        self.dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        path = os.path.join(self.dir, 'mydic.zip')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('mydic/diction.htm', b'<html>\r\n<head>\r\n<title>T</title>' + bytes(4000))
+            z.writestr('mydic/a.txt', b'a' * 1000)
+        self.device = mock.MockDevice(0, None, None)
+        with libexword.Session(transport=self.device) as s:
+            install.install_zip(s, path)
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.device.close()
+        shutil.rmtree(self.dir)
+
+    def gets(self, session):
+        session.reset_stats()
+        session.setpath(libexword.INTERNAL_MEM + '\\')
+        self.assertEqual(session.dict_decrypt('mydic'), 1)
+        return session.stats()['get_file'].count
+
+    def test_keys_are_kept_per_handle(self):
+        with libexword.Session(transport=self.device) as s:
+            first = self.gets(s)
+            # the key is not recovered from diction.htm again
+            self.assertEqual(self.gets(s), first - 1)
+        with libexword.Session(transport=self.device) as s:
+            self.assertEqual(self.gets(s), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import libexword
+from libexword import crypt, install, manifest, planner
+from libexword.zipmap import MappedZip
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class StreamPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        from libexword import mock
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'pack.zip')
+        self.files = {'A.DAT': os.urandom(100000), 'B.TXT': os.urandom(150000) + bytes(1000),
+                      'C.BMP': b'', 'D.DAT': bytes(70000)}
+        with zipfile.ZipFile(self.path, 'w') as z:
+            for i, (name, data) in enumerate(sorted(self.files.items())):
+                z.writestr('P/' + name, data, zipfile.ZIP_STORED if i % 2 else zipfile.ZIP_DEFLATED)
+        self.device = mock.MockDevice(0, None, None)
+        self.session = libexword.Session(transport=self.device, max_mtu=65535).open()
+        self.session.setpath('\\_INTERNAL_00\\T', mkdir=True)
+
+    def tearDown(self):
+        self.session.close()
+        self.device.close()
+        shutil.rmtree(self.dir)
+
+    def items(self, mz):
+        return [(name, mz.zf.getinfo('P/' + name)) for name in sorted(self.files)]
+
+    def test_uploads_plain_and_ciphered_members(self):
+        done = []
+        with MappedZip(self.path) as mz:
+            sent = install.StreamPipeline(self.session, mz).run(self.items(mz), on_file=done.append)
+        self.assertEqual(sent, sum(len(d) for d in self.files.values()))
+        self.assertEqual(done, sorted(self.files))
+        stored = self.device.storage['_INTERNAL_00']['T']
+        for name, data in self.files.items():
+            expected = crypt.xor(data) if crypt.is_encrypted(name) else data
+            self.assertEqual(stored[name], expected, name)
+
+    def test_cancel(self):
+        class Job(object):
+            cancelled = True
+
+            def check(self):
+                pass
+
+            def progress(self, *args):
+                pass
+        with MappedZip(self.path) as mz:
+            self.assertRaises(libexword.ExwordError,
+                              install.StreamPipeline(self.session, mz).run, self.items(mz), Job())
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class SyncSpaceTest(unittest.TestCase):
+
+    def setUp(self):
+        from libexword import mock
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'mydic.zip')
+        self.store = manifest.ManifestStore(os.path.join(self.dir, 'manifests'))
+        self.device = mock.MockDevice(0, None, None)
+        self.session = libexword.Session(transport=self.device).open()
+
+    def tearDown(self):
+        self.session.close()
+        self.device.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        with zipfile.ZipFile(self.path, 'w') as z:
+            z.writestr('mydic/diction.htm', b'<html>\r\n<head>\r\n<title>T</title>')
+            z.writestr('mydic/big.dat', data)
+
+    def test_update_counts_only_what_it_adds(self):
+        self.write(bytes(100000))
+        install.sync_zip(self.session, self.path, self.store)
+        from libexword.mock import INTERNAL
+        self.device.capacity[INTERNAL] = self.device._used(self.device.storage[INTERNAL]) + 1000
+        self.write(os.urandom(100000))
+        item = planner.Item('mydic', planner.tree_size(self.path), 'mydic')
+        self.assertTrue(planner.plan(self.session, [item], store=self.store).ok)
+        result = install.sync_zip(self.session, self.path, self.store)
+        self.assertEqual(result.uploaded, ['big.dat'])
+        # growing by more than is free fails in both
+        self.write(os.urandom(102000))
+        item = planner.Item('mydic', planner.tree_size(self.path), 'mydic')
+        self.assertFalse(planner.plan(self.session, [item], store=self.store).ok)
+        self.assertRaises(libexword.ExwordError, install.sync_zip, self.session, self.path, self.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
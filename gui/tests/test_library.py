@@ -0,0 +1,64 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from libexword import library
+
+
+class _FailingCommit(object):
+    """The library's connection, except that transactions fail to commit."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._db.rollback()
+        raise sqlite3.OperationalError('database is locked')
+
+
+class CollectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lib = library.Library(self.dir)
+        self.lib.add('a', 'zip', items=[('A.TXT', lambda: b'a'), ('S.TXT', lambda: b's')])
+        self.lib.add('b', 'zip', items=[('S.TXT', lambda: b's')])
+
+    def tearDown(self):
+        self.lib.close()
+        shutil.rmtree(self.dir)
+
+    def blobs(self, name):
+        return [self.lib.blob_path(f.blob) for f in self.lib.files(name)]
+
+    def test_remove_keeps_shared_blobs(self):
+        a, s = self.blobs('a')
+        self.assertTrue(self.lib.remove('a'))
+        self.assertFalse(os.path.exists(a))
+        self.assertTrue(os.path.exists(s))
+        self.assertFalse(self.lib.remove('a'))
+
+    def test_failed_commit_keeps_blobs(self):
+        paths = self.blobs('a')
+        db, self.lib._db = self.lib._db, _FailingCommit(self.lib._db)
+        try:
+            self.assertRaises(sqlite3.OperationalError, self.lib.remove, 'a')
+            self.assertRaises(sqlite3.OperationalError, self.lib.add, 'a', 'zip',
+                              items=[('B.TXT', lambda: b'b')])
+        finally:
+            self.lib._db = db
+        self.assertEqual(self.blobs('a'), paths)
+        for path in paths:
+            self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
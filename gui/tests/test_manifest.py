@@ -0,0 +1,34 @@
+import unittest
+
+import libexword
+from libexword import manifest
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class DeviceKeyTest(unittest.TestCase):
+
+    def test_units_of_the_same_model_differ(self):
+        from libexword import mock
+        keys = []
+        for serial in ('A1', 'A2'):
+            device = mock.MockDevice(0, None, None, serial=serial)
+            try:
+                with libexword.Session(transport=device) as s:
+                    keys.append(manifest.device_key(s))
+            finally:
+                device.close()
+        self.assertEqual(keys, ['XD-EMU-EMU@A1', 'XD-EMU-EMU@A2'])
+
+    def test_unknown_unit_needs_a_name(self):
+        from libexword import mock
+        device = mock.MockDevice(0, None, None)
+        device.serial = None
+        try:
+            with libexword.Session(transport=device) as s:
+                self.assertRaises(ValueError, manifest.device_key, s)
+        finally:
+            device.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
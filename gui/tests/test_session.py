@@ -0,0 +1,120 @@
+import threading
+import unittest
+
+import libexword
+
+
+def _in_thread(fn):
+    t = threading.Thread(target=fn)
+    t.start()
+    t.join()
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class RestorePathTest(unittest.TestCase):
+
+    def setUp(self):
+        from libexword import mock
+        self.device = mock.MockDevice(0, None, None)
+        self.session = libexword.Session(transport=self.device)
+        self.session.open()
+        self.session.setpath('\\_INTERNAL_00\\B', mkdir=True)
+        self.session.setpath('\\_INTERNAL_00\\A', mkdir=True)
+
+    def tearDown(self):
+        self.session.close()
+        self.device.close()
+
+    def setpaths(self):
+        return self.session.stats()['setpath'].count
+
+    def test_restores_path_for_command_on_current_path(self):
+        s = self.session
+        _in_thread(lambda: s.setpath('\\_INTERNAL_00\\B'))
+        s.send_file('a.txt', b'a')
+        self.assertEqual(s.cwd, '\\_INTERNAL_00\\A')
+        self.assertIn('a.txt', self.device.storage['_INTERNAL_00']['A'])
+
+    def test_own_setpath_skips_restore(self):
+        s = self.session
+        _in_thread(lambda: s.setpath('\\_INTERNAL_00\\B'))
+        s.reset_stats()
+        s.setpath('\\_INTERNAL_00\\B')
+        s.list()
+        self.assertEqual(self.setpaths(), 1)
+
+    def test_removed_path_fails_the_command(self):
+        s = self.session
+
+        def other():
+            s.setpath('\\_INTERNAL_00')
+            s.remove_file('A')
+        _in_thread(other)
+        self.assertRaises(libexword.ExwordError, s.send_file, 'a.txt', b'a')
+        self.assertRaises(libexword.ExwordError, s.send_file, 'a.txt', b'a')
+        self.assertNotIn('a.txt', self.device.storage['_INTERNAL_00'])
+        self.assertNotIn('a.txt', self.device.storage['_INTERNAL_00']['B'])
+        # until the thread sets a path of its own
+        s.setpath('\\_INTERNAL_00\\B')
+        s.send_file('a.txt', b'a')
+        self.assertIn('a.txt', self.device.storage['_INTERNAL_00']['B'])
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class AbortTest(unittest.TestCase):
+
+    def test_abort_between_commands_is_dropped(self):
+        from libexword import mock
+        device = mock.MockDevice(0, None, None)
+        try:
+            with libexword.Session(transport=device) as s:
+                s.model()
+                s.abort()
+                self.assertEqual(s.model().model, 'XD-EMU')
+        finally:
+            device.close()
+
+    def test_abort_ends_the_running_command(self):
+        import time
+        from libexword import _native, mock
+        device = mock.MockDevice(0, None, None)
+        try:
+            with libexword.Session(transport=device) as s:
+                s.model()
+                device.wedge()
+                timer = threading.Timer(0.05, s.abort)
+                timer.start()
+                start = time.monotonic()
+                with self.assertRaises(libexword.ExwordError) as cm:
+                    s.model()
+                timer.join()
+                self.assertEqual(cm.exception.rsp, _native.LIBUSB_ERROR_INTERRUPTED)
+                self.assertLess(time.monotonic() - start, 0.25)
+        finally:
+            device.close()
+
+
+@unittest.skipUnless(libexword.available(), 'libexword shared library not found')
+class TimeoutTest(unittest.TestCase):
+
+    def test_wedged_device_fails_after_a_few_round_trips(self):
+        import time
+        from libexword import _native, mock
+        device = mock.MockDevice(0.001, None, None)
+        try:
+            with libexword.Session(transport=device) as s:
+                for i in range(20):
+                    s.model()
+                device.wedge()
+                start = time.monotonic()
+                with self.assertRaises(libexword.ExwordError) as cm:
+                    s.model()
+                self.assertEqual(cm.exception.rsp, _native.LIBUSB_ERROR_TIMEOUT)
+                # the 0.3 s floor, well before timeout_max
+                self.assertLess(time.monotonic() - start, 0.6)
+        finally:
+            device.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from libexword import crypt
+from libexword.zipmap import MappedZip
+
+
+class MappedZipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'pack.zip')
+        # incompressible, so the DEFLATE member spans several input chunks
+        self.data = os.urandom(200000) + bytes(50000)
+        with zipfile.ZipFile(self.path, 'w') as z:
+            z.writestr('P/STORED.DAT', self.data, zipfile.ZIP_STORED)
+            z.writestr('P/DEFLATED.TXT', self.data, zipfile.ZIP_DEFLATED)
+            z.writestr('P/EMPTY.DAT', b'', zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read_chunks(self, reader, size):
+        out = bytearray()
+        buf = bytearray(size)
+        while True:
+            n = reader.readinto(buf)
+            if not n:
+                return bytes(out)
+            out += buf[:n]
+
+    def test_buffer_only_for_stored_members(self):
+        with MappedZip(self.path) as mz:
+            data = mz.buffer(mz.zf.getinfo('P/STORED.DAT'))
+            self.assertEqual(bytes(data), self.data)
+            del data
+            self.assertIsNone(mz.buffer(mz.zf.getinfo('P/DEFLATED.TXT')))
+            self.assertIsNone(mz.buffer(mz.zf.getinfo('P/EMPTY.DAT')))
+
+    def test_open_stored_and_deflated(self):
+        with MappedZip(self.path) as mz:
+            for name in ('P/STORED.DAT', 'P/DEFLATED.TXT', 'P/EMPTY.DAT'):
+                reader = mz.open(mz.zf.getinfo(name))
+                try:
+                    self.assertEqual(self.read_chunks(reader, 4096), mz.read(name))
+                finally:
+                    reader.close()
+
+    def test_xor_offset_across_chunks(self):
+        expected = crypt.xor(self.data, crypt.INSTALL_KEY)
+        with MappedZip(self.path) as mz:
+            for name in ('P/STORED.DAT', 'P/DEFLATED.TXT'):
+                # 4093 is not a multiple of the key size
+                reader = mz.open(mz.zf.getinfo(name), crypt.INSTALL_KEY)
+                try:
+                    self.assertEqual(self.read_chunks(reader, 4093), expected)
+                finally:
+                    reader.close()
+
+    def test_crc_mismatch(self):
+        with MappedZip(self.path) as mz:
+            info = mz.zf.getinfo('P/STORED.DAT')
+            start = mz.offset(info)
+        with open(self.path, 'r+b') as f:
+            f.seek(start + 1000)
+            byte = f.read(1)
+            f.seek(start + 1000)
+            f.write(bytes([byte[0] ^ 0xff]))
+        with MappedZip(self.path) as mz:
+            info = mz.zf.getinfo('P/STORED.DAT')
+            self.assertRaises(zipfile.BadZipFile, mz.buffer, info)
+            reader = mz.open(info)
+            try:
+                self.assertRaises(zipfile.BadZipFile, self.read_chunks, reader, 65536)
+            finally:
+                reader.close()
+
+    def test_encrypted_member_is_refused(self):
+        with MappedZip(self.path) as mz:
+            info = mz.zf.getinfo('P/STORED.DAT')
+            info.flag_bits |= 0x1
+            self.assertRaises(zipfile.BadZipFile, mz.buffer, info)
+            self.assertRaises(zipfile.BadZipFile, mz.open, info)
+
+
+if __name__ == '__main__':
+    unittest.main()
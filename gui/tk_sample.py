@@ -7,6 +7,9 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox, filedialog
 
+import libexword
+from libexword import sched
+
 class LibexwordApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -14,9 +17,19 @@ class LibexwordApp(tk.Tk):
         self.geometry('900x520')
 
         self.language_var = tk.StringVar(value='ja')
+        # all device I/O runs on this thread; results come back via after()
+        self.worker = libexword.DeviceWorker()
+        self.worker.attach(self)
+        # other devices used at the same time, each on its own worker
+        self.manager = libexword.SessionManager(self)
+        # what each device already holds, so re-installs only send changed files
+        self.manifests = libexword.ManifestStore()
+        # the manager list: packs and their files, deduplicated on disk
+        self.library = libexword.Library()
         self._create_menu()
         self._create_widgets()
         self._populate_mock()
+        self._start_device_watch()
 
     def _create_widgets(self):
         # Paned window
@@ -29,6 +42,10 @@ class LibexwordApp(tk.Tk):
         ttk.Label(left_frame, text='Own Devices').pack(anchor='nw')
         # Connected indicator
         self.connected_device = None
+        # libexword.Session for the connected device (None in mock mode)
+        self.session = None
+        # admini index records shown in device_files_listbox (real device)
+        self.device_addons = []
         self.connected_device_var = tk.StringVar(value='Connected: (none)')
         ttk.Label(left_frame, textvariable=self.connected_device_var).pack(anchor='nw', pady=(0,4))
         self.device_listbox = tk.Listbox(left_frame, height=20)
@@ -58,7 +75,7 @@ class LibexwordApp(tk.Tk):
         manager_frame = ttk.Frame(lists_frame)
         manager_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         ttk.Label(manager_frame, text='マネージャ内の追加辞書データ').pack(anchor='w')
-        self.manager_listbox = tk.Listbox(manager_frame)
+        self.manager_listbox = tk.Listbox(manager_frame, selectmode=tk.EXTENDED)
         manager_scroll = ttk.Scrollbar(manager_frame, orient=tk.VERTICAL, command=self.manager_listbox.yview)
         self.manager_listbox.config(yscrollcommand=manager_scroll.set)
         self.manager_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -105,11 +122,17 @@ class LibexwordApp(tk.Tk):
         ttk.Button(ops_frame, text='Install ZIP', command=self.on_install_zip).pack(side=tk.LEFT, padx=4)
         ttk.Button(ops_frame, text='File Explorer', command=self.on_file_explorer).pack(side=tk.LEFT, padx=4)
         ttk.Button(ops_frame, text='Link (Auth)', command=self.on_link_auth).pack(side=tk.LEFT, padx=4)
+        ttk.Button(ops_frame, text='Cancel', command=self.on_cancel).pack(side=tk.RIGHT, padx=4)
 
-        # Status bar
+        # Status bar: message, transfer rate and progress of the running job
         self.status = tk.StringVar(value='Ready')
-        status_bar = ttk.Label(self, textvariable=self.status, relief=tk.SUNKEN, anchor='w')
-        status_bar.pack(fill=tk.X, side=tk.BOTTOM)
+        self.rate = tk.StringVar(value='')
+        status_frame = ttk.Frame(self, relief=tk.SUNKEN)
+        status_frame.pack(fill=tk.X, side=tk.BOTTOM)
+        self.progress = ttk.Progressbar(status_frame, length=160, maximum=1.0)
+        self.progress.pack(side=tk.RIGHT, padx=4, pady=2)
+        ttk.Label(status_frame, textvariable=self.rate, anchor='e').pack(side=tk.RIGHT, padx=4)
+        ttk.Label(status_frame, textvariable=self.status, anchor='w').pack(side=tk.LEFT, fill=tk.X, expand=True)
 
     def _create_menu(self):
         # Menu bar
@@ -124,6 +147,7 @@ class LibexwordApp(tk.Tk):
         # View menu
         viewmenu = tk.Menu(menubar, tearoff=0)
         viewmenu.add_command(label='Refresh', command=self.on_refresh)
+        viewmenu.add_command(label='統計...', command=self.on_show_stats)
         menubar.add_cascade(label='View', menu=viewmenu)
         # Settings menu (設定)
         settings = tk.Menu(menubar, tearoff=0)
@@ -143,6 +167,8 @@ class LibexwordApp(tk.Tk):
         dictmenu.add_command(label='追加 (From ZIP)...', command=self.on_add_from_zip)
         dictmenu.add_command(label='追加 (From folder)...', command=self.on_add_from_folder)
         dictmenu.add_command(label='追加 (From Github release)...', command=self.on_add_from_github)
+        dictmenu.add_command(label='全デバイスに ZIP をインストール...', command=self.on_install_zip_all)
+        dictmenu.add_command(label='選択した辞書を復号して保存...', command=self.on_decrypt_addon)
         dictmenu.add_separator()
         dictmenu.add_command(label='マネージャの一覧を表示', command=self.on_show_manager_list)
         dictmenu.add_command(label='マネージャ内の辞書を削除', command=self.on_delete_from_manager)
@@ -188,11 +214,6 @@ class LibexwordApp(tk.Tk):
         # remember last selected device (to avoid losing selection when clicking other widgets)
         self.last_selected_device = None
 
-        # Manager DB (mock): list of dict entries (name, source)
-        self.manager_db = [
-            {'name': 'core_dict', 'source': 'builtin'},
-            {'name': 'korean_pack', 'source': 'zip'},
-        ]
         # Auth DB: device -> {username, key}
         self.auth_db = {
             # example: 'EX-word (USB0)': {'username': 'user1234', 'key': 'abcd...'}
@@ -207,13 +228,24 @@ class LibexwordApp(tk.Tk):
             return
         fname = filedialog.askopenfilename(title='Select file to upload')
         if fname:
-            # Mock: add to device files
             import os, time
             name = os.path.basename(fname)
-            self.device_info_map.setdefault(dev_name, {}).setdefault('files', []).append((name, f'{os.path.getsize(fname)//1024}KB', time.strftime('%Y-%m-%d')))
-            self.on_device_select(None)
-            self.status.set(f'Upload: {fname} to {dev_name}')
-            print('Upload pressed:', fname)
+            session = self.session
+
+            def _upload(job):
+                size = os.path.getsize(fname)
+                if session:
+                    with open(fname, 'rb') as f:
+                        session.send_stream(name, f, size, cancel=lambda: job.cancelled)
+                return size
+
+            def _done(size):
+                # Mock: add to device files
+                self.device_info_map.setdefault(dev_name, {}).setdefault('files', []).append((name, f'{size//1024}KB', time.strftime('%Y-%m-%d')))
+                self.on_device_select(None)
+                self.status.set(f'Upload: {fname} to {dev_name}')
+                print('Upload pressed:', fname)
+            self._submit(_upload, f'Uploading {name}', _done, priority=sched.BULK)
 
     def on_download(self):
         dev_name = self._require_connected()
@@ -247,28 +279,43 @@ class LibexwordApp(tk.Tk):
             return
         # Realistic install mock: extract zip to a temp folder and add entries for each file
         import os, zipfile, time
-        try:
+        session = self.session
+
+        def _install(job):
+            if session is not None:
+                # inflate/cipher on a pool, upload in order on this worker;
+                # files the device already has unchanged are skipped
+                from libexword import install
+                result = install.sync_zip(session, path, self.manifests, job=job, mapped=True)
+                print(f'Sync {result.id}: {len(result.uploaded)} sent, {result.skipped} unchanged')
+                return [result.id]
+            newfiles = []
             with zipfile.ZipFile(path, 'r') as z:
                 namelist = z.namelist()
                 # add each top-level file as dict entry (mock behavior)
-                for fn in namelist:
+                for i, fn in enumerate(namelist):
+                    job.check()
                     base = os.path.splitext(os.path.basename(fn))[0]
                     if base:
-                        newfile = f'{base}.dict'
-                        self.device_info_map[dev_name]['files'].append((newfile, '4KB', time.strftime('%Y-%m-%d')))
-        except Exception as e:
-            messagebox.showerror('Error', f'Failed to install ZIP: {e}')
-            return
-        # ensure connection selection is shown
-        try:
-            idx = list(self.device_listbox.get(0, tk.END)).index(dev_name)
-            self.device_listbox.selection_clear(0, tk.END)
-            self.device_listbox.selection_set(idx)
-        except ValueError:
-            pass
-        self.on_device_select(None)
-        self.status.set(f'Installed ZIP: {os.path.basename(path)} to {dev_name}')
-        print('Install ZIP:', path, 'to', dev_name)
+                        newfiles.append(f'{base}.dict')
+                    job.progress(fn, i + 1, len(namelist))
+            return newfiles
+
+        def _done(newfiles):
+            for newfile in newfiles:
+                self.device_info_map[dev_name]['files'].append((newfile, '4KB', time.strftime('%Y-%m-%d')))
+            # ensure connection selection is shown
+            try:
+                idx = list(self.device_listbox.get(0, tk.END)).index(dev_name)
+                self.device_listbox.selection_clear(0, tk.END)
+                self.device_listbox.selection_set(idx)
+            except ValueError:
+                pass
+            self.on_device_select(None)
+            self.status.set(f'Installed ZIP: {os.path.basename(path)} to {dev_name}')
+            print('Install ZIP:', path, 'to', dev_name)
+        self._submit(_install, f'Installing {os.path.basename(path)}', _done,
+                     error_title='Failed to install ZIP', priority=sched.BULK)
 
     def on_file_explorer(self):
         # Show a dialog with files on the connected device (mock)
@@ -285,6 +332,26 @@ class LibexwordApp(tk.Tk):
                   '/mem': ['..'] + [f[0] for f in files_flat]}
             self.device_info_map[dev_name]['fs'] = fs
         current_path = ['/']  # use list for mutability in closure
+        session = self.session
+        # explorer path -> device path (real device only)
+        roots = {'/SD': libexword.SD_CARD, '/mem': libexword.INTERNAL_MEM}
+
+        def _device_path(path):
+            top = '/' + path.strip('/').split('/')[0]
+            return libexword.join_path(roots[top], path[len(top):])
+
+        def _entries(path):
+            if session is None:
+                return fs.get(path)
+            if path == '/':
+                return fs['/']
+            try:
+                # the window waits on this; go ahead of a running install
+                with sched.priority(sched.INTERACTIVE):
+                    entries = session.listdir(_device_path(path), view=True)
+            except (KeyError, libexword.ExwordError):
+                return None
+            return ['..'] + [f'{e.name} <directory>' if e.is_dir else e.name for e in entries]
 
         top = tk.Toplevel(self)
         top.title(f'File Explorer - {dev_name}')
@@ -304,13 +371,14 @@ class LibexwordApp(tk.Tk):
         def _refresh_list():
             lb.delete(0, tk.END)
             p = current_path[0]
-            entries = fs.get(p, [])
-            for e in entries:
-                lb.insert(tk.END, e)
+            entries = _entries(p) or []
+            # one call for the whole directory; per item inserts are slow for large SD folders
+            if entries:
+                lb.insert(tk.END, *entries)
             path_label.config(text=f'Path: {p}')
 
         def _change_path(path):
-            if path not in fs:
+            if _entries(path) is None:
                 messagebox.showinfo('Info', f'No such directory: {path}')
                 return
             current_path[0] = path
@@ -367,6 +435,9 @@ class LibexwordApp(tk.Tk):
             if item.endswith('<directory>'):
                 # navigate into directory
                 name = item.replace(' <directory>', '')
+                if session is not None and current_path[0] != '/':
+                    _change_path(current_path[0].rstrip('/') + '/' + name)
+                    return
                 newpath = ('/' + name) if not item.startswith('/') else name
                 if newpath not in fs:
                     # create empty directory
@@ -379,11 +450,72 @@ class LibexwordApp(tk.Tk):
             dest = filedialog.asksaveasfilename(title='Save file as', initialfile=fname)
             if not dest:
                 return
+            if session is not None:
+                device_path = _device_path(current_path[0])
+
+                def _get(job):
+                    session.chdir(device_path)
+                    try:
+                        with open(dest, 'wb') as f:
+                            session.get_stream(fname, f, cancel=lambda: job.cancelled)
+                    except Exception:
+                        import os
+                        os.remove(dest)
+                        raise
+                self._submit(_get, f'Getting {fname}',
+                             lambda _: self.status.set(f'Saved {fname} to {dest}'),
+                             error_title=f'Failed to get {fname}')
+                return
             messagebox.showinfo('Get', f"(Mock) Saved {fname} to {dest}")
             self.status.set(f'Saved {fname} to {dest}')
 
         lb.bind('<Double-Button-1>', on_item_activate)
 
+        def _run_batch(b, desc):
+            """Run batch b on the worker and refresh the listing afterwards."""
+            def _done(result):
+                _refresh_list()
+                if result.errors:
+                    messagebox.showerror('Error', f'{desc}: {result.errors[0][1]}')
+                self.status.set(f'{desc}: {len(b)} ops, {result.setpaths} setpath '
+                                f'({result.saved} saved)')
+            self._submit(lambda job: b.run(session, job), desc, _done)
+
+        def send_file():
+            if current_path[0] == '/':
+                messagebox.showinfo('Info', 'Open SD or mem first')
+                return
+            names = filedialog.askopenfilenames(title='Send files')
+            if not names:
+                return
+            import os
+            if session is not None:
+                b = libexword.Batch()
+                for n in names:
+                    b.send(_device_path(current_path[0]), os.path.basename(n), n)
+                _run_batch(b, f'Sending {len(names)} files')
+                return
+            fs.setdefault(current_path[0], ['..']).extend(os.path.basename(n) for n in names)
+            _refresh_list()
+
+        def delete_file():
+            if not ensure_selection():
+                messagebox.showinfo('Info', 'No file selected')
+                return
+            item = lb.get(lb.curselection()[0])
+            if item == '..' or item.endswith('<directory>'):
+                return
+            fname = item.split('\t')[0]
+            if not messagebox.askyesno('Confirm', f'Delete {fname}?'):
+                return
+            if session is not None:
+                b = libexword.Batch()
+                b.remove(_device_path(current_path[0]), fname)
+                _run_batch(b, f'Deleting {fname}')
+                return
+            fs[current_path[0]] = [e for e in fs.get(current_path[0], []) if e != item]
+            _refresh_list()
+
         # Initial populate
         _refresh_list()
 
@@ -438,6 +570,11 @@ class LibexwordApp(tk.Tk):
         self.last_selected_device = name
         # Update device files list
         self.device_files_listbox.delete(0, tk.END)
+        self.device_addons = []
+        if self.session is not None and name == self.connected_device:
+            self._show_addons(self.session)
+            self.refresh_manager_listview()
+            return
         for f in info.get('files', []):
             # consider only add-on dictionary files (mock: files ending with .dict)
             if f[0].endswith('.dict'):
@@ -445,10 +582,29 @@ class LibexwordApp(tk.Tk):
         # refresh manager list
         self.refresh_manager_listview()
 
+    def _show_addons(self, session):
+        """Fill device_files_listbox from the cached admini index.
+
+        Only the first call after connecting (or after an install/remove)
+        reads admini.inf from the device.
+        """
+        from libexword import admini
+        addons = admini.cached(session)
+        if addons is None:
+            def _loaded(_):
+                if session is self.session:
+                    self.on_device_select(None)
+            self._submit(lambda job: admini.index(session), 'Reading add-on list', _loaded,
+                         priority=sched.INTERACTIVE)
+            return
+        self.device_addons = list(addons.values())
+        for addon in self.device_addons:
+            self.device_files_listbox.insert(tk.END, f'{addon.title} ({addon.id})')
+
     def refresh_manager_listview(self):
         self.manager_listbox.delete(0, tk.END)
-        for d in self.manager_db:
-            self.manager_listbox.insert(tk.END, d['name'])
+        for pack in self.library.packs():
+            self.manager_listbox.insert(tk.END, pack.name)
 
     def get_active_device(self):
         # Prefer the connected device; otherwise use currently selected device or last selected device
@@ -479,26 +635,89 @@ class LibexwordApp(tk.Tk):
         if not sel:
             messagebox.showinfo('Info', 'Select manager entry')
             return
-        mgr_name = self.manager_listbox.get(sel[0])
+        names = [self.manager_listbox.get(i) for i in sel]
         dev_name = self._require_connected()
         if not dev_name:
             return
         # move from manager to device as .dict
         import time
-        self.device_info_map[dev_name]['files'].append((f'{mgr_name}.dict', '4KB', time.strftime('%Y-%m-%d')))
-        # remove from manager_db
-        self.manager_db = [m for m in self.manager_db if m['name'] != mgr_name]
-        self.refresh_manager_listview()
-        # ensure device selection is shown after action (highlight connected device)
-        try:
-            idx = list(self.device_listbox.get(0, tk.END)).index(dev_name)
-            self.device_listbox.selection_clear(0, tk.END)
-            self.device_listbox.selection_set(idx)
-        except ValueError:
-            pass
-        self.on_device_select(None)
-        self.status.set(f'Added {mgr_name} to {dev_name}')
-        print('Add to device:', mgr_name, '->', dev_name)
+        label = names[0] if len(names) == 1 else f'{len(names)} dictionaries'
+
+        def _done(_):
+            for mgr_name in names:
+                self.device_info_map[dev_name]['files'].append((f'{mgr_name}.dict', '4KB', time.strftime('%Y-%m-%d')))
+            # the packs stay in the library so they can be added to other devices
+            # ensure device selection is shown after action (highlight connected device)
+            try:
+                idx = list(self.device_listbox.get(0, tk.END)).index(dev_name)
+                self.device_listbox.selection_clear(0, tk.END)
+                self.device_listbox.selection_set(idx)
+            except ValueError:
+                pass
+            self.on_device_select(None)
+            self.status.set(f'Added {label} to {dev_name}')
+            print('Add to device:', names, '->', dev_name)
+        session = self.session
+
+        def _add(job):
+            sizes = self.library.sizes()
+            packs = [self.library.get(n) for n in names if n in sizes]
+            if session is None or not packs:
+                return None
+            # decide internal memory / SD for the whole selection before sending anything
+            from libexword import install, planner
+            device = libexword.device_key(session)
+            placement = planner.plan(session, [planner.Item(p.name, sizes[p.name], p.id)
+                                               for p in packs],
+                                     store=self.manifests, device=device).check()
+            # only the files missing on the device or changed since the last sync are sent
+            return [install.sync_library(session, self.library, item.name, self.manifests,
+                                         device, root=root, job=job)
+                    for item, root in placement.assigned]
+        # queued on the worker so it is ordered after any running transfer
+        self._submit(_add, f'Adding {label}', _done, priority=sched.BULK)
+
+    def _submit(self, func, desc, on_done, error_title='Error', priority=sched.NORMAL):
+        """Run func(job) on the device worker, reporting progress in the status bar."""
+        def _progress(name, transferred, length):
+            if length:
+                self.status.set(f'{desc}: {name} {transferred * 100 // length}%')
+            else:
+                self.status.set(f'{desc}: {name}')
+
+        def _transfer(job, device):
+            # coalesced by the worker to a few calls a second
+            if job.fraction is not None:
+                self.progress['value'] = job.fraction
+            eta = f', {job.eta:.0f} s left' if job.eta is not None else ''
+            self.rate.set(f'{job.smoothed_mb_s:.2f} MB/s{eta}')
+
+        def _idle():
+            self.progress['value'] = 0
+            self.rate.set('')
+
+        def _done(result):
+            _idle()
+            on_done(result)
+
+        def _error(e):
+            _idle()
+            if isinstance(e, libexword.Cancelled):
+                self.status.set(f'{desc}: cancelled')
+                return
+            self.status.set(f'{desc}: failed')
+            messagebox.showerror('Error', f'{error_title}: {e}')
+
+        self.status.set(f'{desc}...')
+        return self.worker.submit(func, name=desc, on_done=_done, on_error=_error,
+                                  on_progress=_progress, on_transfer=_transfer,
+                                  priority=priority)
+
+    def on_cancel(self):
+        self.worker.cancel_all()
+        if self.session is not None:
+            # also ends a read that is still waiting for the device
+            self.session.abort()
 
     def _ensure_device_selected(self, event):
         # when manager list is clicked, preserve or restore last selected device
@@ -605,6 +824,13 @@ class LibexwordApp(tk.Tk):
         if not dev_name:
             return
         fname = self.device_files_listbox.get(dsel[0])
+        if self.session is not None and self.device_addons:
+            from libexword import admini
+            session, addon = self.session, self.device_addons[dsel[0]]
+            self._submit(lambda job: admini.remove(session, addon.id), f'Removing {addon.id}',
+                         lambda _: self.on_device_select(None),
+                         error_title=f'Failed to remove {addon.id}')
+            return
         # remove from device files, and re-add to manager
         before = len(self.device_info_map[dev_name]['files'])
         self.device_info_map[dev_name]['files'] = [f for f in self.device_info_map[dev_name]['files'] if f[0] != fname]
@@ -612,12 +838,28 @@ class LibexwordApp(tk.Tk):
             messagebox.showinfo('Info', 'Selected file not found on device')
             return
         name = fname[:-5] if fname.endswith('.dict') else fname
-        self.manager_db.append({'name': name, 'source': 'device'})
+        if name not in self.library:
+            self.library.add(name, 'device')
         self.refresh_manager_listview()
         self.on_device_select(None)
         self.status.set(f'Removed {fname} from {dev_name} (moved to manager)')
         print('Remove from device:', fname, '-> manager')
 
+    def on_decrypt_addon(self):
+        dsel = self.device_files_listbox.curselection()
+        if self.session is None or not self.device_addons or not dsel:
+            messagebox.showinfo('Info', 'Select an add-on of the connected device')
+            return
+        directory = filedialog.askdirectory(title='Save decrypted add-on to')
+        if not directory:
+            return
+        from libexword import decrypt
+        session, addon = self.session, self.device_addons[dsel[0]]
+        self._submit(lambda job: decrypt.decrypt(session, addon.id, directory, job=job),
+                     f'Decrypting {addon.id}',
+                     lambda names: self.status.set(f'Saved {len(names)} files of {addon.id} to {directory}'),
+                     error_title=f'Failed to decrypt {addon.id}', priority=sched.BULK)
+
     def on_manager_delete(self):
         # try to ensure manager selection under mouse if missing
         if not self._ensure_manager_selected():
@@ -629,7 +871,7 @@ class LibexwordApp(tk.Tk):
             return
         name = self.manager_listbox.get(sel[0])
         if messagebox.askyesno('Confirm', f'Delete {name} from manager?'):
-            self.manager_db = [m for m in self.manager_db if m['name'] != name]
+            self.library.remove(name)
             self.refresh_manager_listview()
             self.status.set(f'Deleted {name} from manager')
             print('Manager delete:', name)
@@ -725,6 +967,12 @@ class LibexwordApp(tk.Tk):
 
     def _change_connection(self, dev_name):
         # dev_name == None => disconnect
+        if self.session is not None:
+            # let queued transfers on the old device finish first
+            session = self.session
+            self.session = None
+            self.manager.remove(self.connected_device)
+            self.worker.submit(lambda job: session.close(), name='close')
         if dev_name is None:
             self.connected_device = None
             self.connected_device_var.set('Connected: (none)')
@@ -733,7 +981,147 @@ class LibexwordApp(tk.Tk):
             # update device info display
             self.on_device_select(None)
             return
-        # connect
+        # connect: keep one libexword session open for the whole connection
+        # so each operation does not pay for USB claim + OBEX connect again.
+        # Opening runs on the worker, after the old session has been closed.
+        if libexword.available():
+            def _open(job):
+                import os
+                options = self._device_options(dev_name)
+                socket_path = os.environ.get('LIBEXWORD_DAEMON')
+                if socket_path:
+                    # the daemon keeps the device connected across GUI restarts
+                    from libexword import daemon
+                    if 'transport' in options:
+                        options = {'device': daemon.EMULATOR}
+                    session = daemon.connect(socket_path=socket_path if socket_path != '1' else None,
+                                             **options)
+                else:
+                    session = libexword.Session(**options).open()
+                session.set_transfer_callback(self.worker.report_transfer,
+                                              self.worker.progress_interval)
+                return session
+
+            def _opened(session):
+                self.session = session
+                self.manager.remove(dev_name)
+                self.manager.add(dev_name, session, self.worker)
+                self._set_connected(dev_name)
+            self._submit(_open, f'Connecting to {dev_name}', _opened,
+                         error_title=f'Failed to connect to {dev_name}')
+            return
+        self._set_connected(dev_name)
+
+    def _start_device_watch(self):
+        """List the connected devices instead of the mock ones and keep the
+        list current from hotplug events (no refresh loop)."""
+        self.device_watcher = None
+        if not libexword.available():
+            return
+        self.device_listbox.delete(0, tk.END)
+        self.device_info_map = {}
+        self.device_watcher = libexword.DeviceWatcher(self._on_device_change, post=self.worker.post)
+        self.device_watcher.start()
+        import os
+        if os.environ.get('LIBEXWORD_EMULATOR'):
+            # software device for trying the GUI without hardware
+            from libexword import mock
+            name = 'EX-word (emulator)'
+            self.device_listbox.insert(tk.END, name)
+            self.device_info_map[name] = {'manufacturer': 'Casio', 'product': 'EX-word emulator',
+                                          'files': [], 'transport': mock.MockDevice(0.0005, 8e6, None)}
+
+    def _on_device_change(self, event, info):
+        name = f'EX-word ({info.path})'
+        names = list(self.device_listbox.get(0, tk.END))
+        if event == libexword.ARRIVED:
+            if name not in names:
+                self.device_listbox.insert(tk.END, name)
+                self.device_info_map[name] = {'manufacturer': 'Casio', 'product': 'EX-word',
+                                              'files': [], 'path': info.path}
+            self.status.set(f'{name} connected')
+            print('Device arrived:', name)
+            return
+        if name in names:
+            self.device_listbox.delete(names.index(name))
+        self.manager.close(name)
+        if name == self.connected_device:
+            self._change_connection(None)
+        self.device_info_map.pop(name, None)
+        self.status.set(f'{name} removed')
+        print('Device left:', name)
+
+    def _device_options(self, dev_name):
+        """Session options selecting the device of a device list entry."""
+        info = self.device_info_map.get(dev_name, {})
+        if 'transport' in info:
+            return {'transport': info['transport']}
+        path = info.get('path')
+        if path is not None:
+            return {'path': path}
+        import re
+        m = re.search(r'USB(\d+)', dev_name)
+        if m:
+            return {'index': int(m.group(1))}
+        return {'index': list(self.device_listbox.get(0, tk.END)).index(dev_name)}
+
+    def on_install_zip_all(self):
+        """Install one ZIP on every listed device in parallel."""
+        if not libexword.available():
+            messagebox.showinfo('Info', 'libexword is not available')
+            return
+        path = filedialog.askopenfilename(title='Select ZIP to install', filetypes=[('Zip files', '*.zip')])
+        if not path:
+            return
+        import os
+        from libexword import install
+        failed = {}
+
+        def _open_failed(name, e):
+            failed.setdefault(name, e)
+            self.manager.close(name)
+        for name in self.device_listbox.get(0, tk.END):
+            if name not in self.manager:
+                self.manager.open(name, on_error=lambda e, name=name: _open_failed(name, e),
+                                  **self._device_options(name))
+        names = self.manager.names()
+        remaining = set(names)
+
+        rates = {}
+
+        def _finish(name):
+            remaining.discard(name)
+            rates.pop(name, None)
+            if remaining:
+                self.status.set(f'Installing {os.path.basename(path)}: {len(remaining)} device(s) left')
+                return
+            if failed:
+                messagebox.showerror('Failed to install ZIP',
+                                     '\n'.join(f'{n}: {e}' for n, e in sorted(failed.items())))
+            self.status.set(f'Installed {os.path.basename(path)} on {len(names) - len(failed)} device(s)')
+            self.rate.set('')
+
+        def _done(name, id):
+            print('Install ZIP:', path, 'to', name)
+            _finish(name)
+
+        def _error(name, e):
+            failed.setdefault(name, e)
+            _finish(name)
+
+        def _progress(name, fname, done, total):
+            self.status.set(f'{name}: {fname} ({done}/{total})')
+
+        def _transfer(name, job, device):
+            rates[name] = device.smoothed
+            self.rate.set(f'{len(rates)} device(s) {sum(rates.values()) / 1e6:.2f} MB/s')
+
+        def _install(job, session):
+            return install.sync_zip(session, path, self.manifests, job=job, mapped=True).id
+        self.manager.run_all(_install, names=names, on_done=_done, on_error=_error,
+                             on_progress=_progress, on_transfer=_transfer)
+
+    def _set_connected(self, dev_name):
         self.connected_device = dev_name
         self.connected_device_var.set(f'Connected: {dev_name}')
         self.status.set(f'Connected to {dev_name}')
@@ -761,8 +1149,108 @@ class LibexwordApp(tk.Tk):
             self._change_connection(name)
 
     def on_exit(self):
+        if self.device_watcher is not None:
+            self.device_watcher.stop()
+        self.manager.close_all()
+        self.worker.stop()
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.library.close()
         self.destroy()
 
+    def on_show_stats(self):
+        # live view of the C library's request trace and latency histograms;
+        # both are read without the session lock, so this never waits for a transfer
+        win = tk.Toplevel(self)
+        win.title('統計')
+        win.geometry('760x520')
+        summary = tk.StringVar(value='未接続')
+        ttk.Label(win, textvariable=summary).pack(anchor='w', padx=6, pady=4)
+        columns = ('count', 'errors', 'mean', 'p50', 'p99', 'max')
+        hist = ttk.Treeview(win, columns=columns, height=8)
+        hist.heading('#0', text='command')
+        for c in columns:
+            hist.heading(c, text=c if c in ('count', 'errors') else c + ' ms')
+            hist.column(c, width=80, anchor='e')
+        hist.pack(fill=tk.X, padx=6)
+        columns = ('op', 'bytes', 'mtu', 'retries', 'write', 'seq', 'read', 'total', 'rsp')
+        reqs = ttk.Treeview(win, columns=columns)
+        reqs.heading('#0', text='#')
+        reqs.column('#0', width=60)
+        for c in columns:
+            reqs.heading(c, text=c)
+            reqs.column(c, width=70, anchor='e')
+        reqs.pack(fill=tk.BOTH, expand=True, padx=6, pady=4)
+        state = {'log': None}
+
+        def _log():
+            log = state['log']
+            if self.session is None:
+                return None
+            if log is None or log.session is not self.session:
+                log = state['log'] = libexword.TraceLog(self.session)
+            return log
+
+        def _refresh():
+            if not win.winfo_exists():
+                return
+            log = _log()
+            if log is not None:
+                new = log.poll()
+                stats = self.session.stats()
+                summary.set('%s  RTT %.2f ms  requests %d (dropped %d)'
+                            % (self.connected_device, self.session.rtt * 1000,
+                               len(log.entries), log.dropped))
+                hist.delete(*hist.get_children())
+                for name, h in stats.items():
+                    if h.count:
+                        hist.insert('', tk.END, text=name, values=(
+                            h.count, h.errors, '%.2f' % (h.mean * 1000),
+                            '%.2f' % (h.percentile(50) * 1000),
+                            '%.2f' % (h.percentile(99) * 1000), '%.2f' % (h.max * 1000)))
+                for e in new:
+                    reqs.insert('', 0, text=e.id, values=(
+                        '%s %s' % (e.command, e.op), e.tx_bytes + e.rx_bytes, e.mtu, e.retries,
+                        '%.2f' % (e.write * 1000), '%.2f' % (e.seq * 1000),
+                        '%.2f' % (e.read * 1000), '%.2f' % (e.total * 1000), '0x%02x' % (e.rsp & 0xff)))
+                rows = reqs.get_children()
+                if len(rows) > 200:
+                    reqs.delete(*rows[200:])
+            else:
+                summary.set('未接続')
+            self.after(500, _refresh)
+
+        def _reset():
+            if self.session is not None:
+                self.session.reset_stats()
+            log = _log()
+            if log is not None:
+                log.clear()
+            reqs.delete(*reqs.get_children())
+
+        def _export():
+            log = _log()
+            if log is None:
+                messagebox.showinfo('統計', 'デバイスに接続されていません', parent=win)
+                return
+            path = filedialog.asksaveasfilename(parent=win, title='Chrome trace を保存',
+                                                defaultextension='.json',
+                                                filetypes=[('JSON', '*.json')])
+            if not path:
+                return
+            log.poll()
+            libexword.export_chrome(path, log.entries, name=str(self.connected_device),
+                                    stats=self.session.stats())
+            self.status.set(f'Trace saved: {path}')
+
+        btns = ttk.Frame(win)
+        btns.pack(fill=tk.X, padx=6, pady=(0, 6))
+        ttk.Button(btns, text='リセット', command=_reset).pack(side=tk.LEFT)
+        ttk.Button(btns, text='Chrome trace を保存...', command=_export).pack(side=tk.LEFT, padx=4)
+        ttk.Button(btns, text='閉じる', command=win.destroy).pack(side=tk.RIGHT)
+        _refresh()
+
     def on_about(self):
         messagebox.showinfo('About', 'libexword GUI mock\nTkinter sample')
 
@@ -791,9 +1279,13 @@ class LibexwordApp(tk.Tk):
             return
         import os
         name = os.path.splitext(os.path.basename(path))[0]
-        self.manager_db.append({'name': name, 'source': 'zip'})
-        self.status.set(f'Added {name} from ZIP')
-        print('Add from ZIP:', path)
+
+        def _done(_):
+            self.refresh_manager_listview()
+            self.status.set(f'Added {name} from ZIP')
+            print('Add from ZIP:', path)
+        # files shared with packs already in the library are stored once
+        self._submit(lambda job: self.library.add_zip(path, name=name), f'Importing {name}', _done)
 
     def on_add_from_folder(self):
         path = filedialog.askdirectory(title='Select folder to add')
@@ -801,9 +1293,12 @@ class LibexwordApp(tk.Tk):
             return
         import os
         name = os.path.basename(path.rstrip('/\\'))
-        self.manager_db.append({'name': name, 'source': 'folder'})
-        self.status.set(f'Added {name} from folder')
-        print('Add from folder:', path)
+
+        def _done(_):
+            self.refresh_manager_listview()
+            self.status.set(f'Added {name} from folder')
+            print('Add from folder:', path)
+        self._submit(lambda job: self.library.add_folder(path, name=name), f'Importing {name}', _done)
 
     def on_add_from_github(self):
         # Simple prompt for GitHub release URL (mock)
@@ -812,15 +1307,18 @@ class LibexwordApp(tk.Tk):
         if not url:
             return
         name = url.split('/')[-1] if '/' in url else url
-        self.manager_db.append({'name': name, 'source': 'github'})
+        if name not in self.library:
+            self.library.add(name, 'github', origin=url)
+        self.refresh_manager_listview()
         self.status.set(f'Added {name} from GitHub')
         print('Add from GitHub:', url)
 
     def on_show_manager_list(self):
-        if not self.manager_db:
+        packs = self.library.packs()
+        if not packs:
             messagebox.showinfo('Manager', 'No dictionaries in manager')
             return
-        text = '\n'.join([f"{d['name']} ({d['source']})" for d in self.manager_db])
+        text = '\n'.join([f"{p.name} ({p.source})" for p in packs])
         messagebox.showinfo('Manager List', text)
 
     def on_delete_from_manager(self):
@@ -828,12 +1326,10 @@ class LibexwordApp(tk.Tk):
         name = simpledialog.askstring('Delete', 'Enter dictionary name to delete')
         if not name:
             return
-        before = len(self.manager_db)
-        self.manager_db = [d for d in self.manager_db if d['name'] != name]
-        after = len(self.manager_db)
-        if before == after:
+        if not self.library.remove(name):
             messagebox.showinfo('Delete', f'No entry named {name} found')
         else:
+            self.refresh_manager_listview()
             messagebox.showinfo('Delete', f'Deleted {name}')
             self.status.set(f'Deleted {name}')
 
@@ -26,10 +26,16 @@
 #include <dirent.h>
 #include <sys/stat.h>
 #include <fcntl.h>
+#include <errno.h>
 
 #include "exword.h"
+#include "dict.h"
 #include "util.h"
 
+#ifndef O_BINARY
+# define O_BINARY 0
+#endif
+
 typedef struct {
 	char id[32];
 	char key[16];
@@ -44,6 +50,23 @@ static char key1[16] =
 static char key2[16] =
 	"\x5d\x5d\x5d\x5d\x5c\x42\x5c\x42\x5b\x28\x5b\x28\x5a\x0f\x5a\x0f";
 
+/* 復元したキーのキャッシュ。
+ * Recovering the key of an installed add-on means downloading its whole
+ * diction.htm.  Keys are remembered in the device handle (see
+ * exword_get_key_cache) per root and id together with the admini.inf key
+ * they were recovered under, so decrypting the same add-on again (or
+ * after a reinstall with the same key) skips it. */
+
+/* dict_decrypt の受信先。 Packets are deciphered and written as they
+ * arrive, so no file is held in memory.  The write() runs in the receive
+ * callback, before the next GET packet is requested; it usually only
+ * copies into the page cache, but it does not overlap the USB transfer. */
+struct decrypt_sink {
+	int fd;
+	char *key;
+	unsigned int offset;
+};
+
 char *admini_list[] = {
 	"admini.inf",
 	"adminikr.inf",
@@ -55,23 +78,25 @@ char *admini_list[] = {
 	NULL
 };
 
-void _crypt(char *data, int size, char *key)
+/* キーストリームの XOR。暗号化と復号は同じ処理です。
+ * data[i] ^= key[i % 16].  Whole blocks are handled as two 64 bit words
+ * (memcpy keeps it alignment safe and lets the compiler vectorise). */
+void dict_crypt(char *data, int size, char *key)
 {
+	uint64_t k[2], w[2];
 	int blks, leftover;
 	int i;
 	char *ptr;
 	blks = size >> 4;
-	leftover = size % 16;
+	leftover = size & 15;
+	memcpy(k, key, 16);
 	ptr = data;
 	for (i = 0; i < blks; i++) {
-		*((long *)ptr) = *((long *)ptr) ^ ((long *)key)[0];
-		ptr += 4;
-		*((long *)ptr) = *((long *)ptr) ^ ((long *)key)[1];
-		ptr += 4;
-		*((long *)ptr) = *((long *)ptr) ^ ((long *)key)[2];
-		ptr += 4;
-		*((long *)ptr) = *((long *)ptr) ^ ((long *)key)[3];
-		ptr += 4;
+		memcpy(w, ptr, 16);
+		w[0] ^= k[0];
+		w[1] ^= k[1];
+		memcpy(ptr, w, 16);
+		ptr += 16;
 	}
 	for (i = 0; i < leftover; i++) {
 		*ptr = *ptr ^ key[i];
@@ -136,6 +161,42 @@ int _crack_key(exword_t *device, char *root, char *id, char *key)
 	return 1;
 }
 
+static int _cached_key(exword_t *device, char *root, admini_t *info, char *key)
+{
+	int i;
+	exword_key_cache_t *cache = exword_get_key_cache(device);
+	for (i = 0; i < EXWORD_KEY_CACHE_SIZE; i++) {
+		if (cache->entries[i].root[0] != '\0' &&
+		    strncmp(cache->entries[i].root, root, sizeof(cache->entries[i].root)) == 0 &&
+		    strncmp(cache->entries[i].id, info->id, sizeof(cache->entries[i].id)) == 0 &&
+		    memcmp(cache->entries[i].admini, info->key, 16) == 0) {
+			memcpy(key, cache->entries[i].key, 16);
+			return 1;
+		}
+	}
+	return 0;
+}
+
+static void _cache_key(exword_t *device, char *root, admini_t *info, char *key)
+{
+	exword_key_cache_t *cache = exword_get_key_cache(device);
+	int i = cache->next;
+	cache->next = (cache->next + 1) % EXWORD_KEY_CACHE_SIZE;
+	strncpy(cache->entries[i].root, root, sizeof(cache->entries[i].root) - 1);
+	cache->entries[i].root[sizeof(cache->entries[i].root) - 1] = '\0';
+	memcpy(cache->entries[i].id, info->id, sizeof(cache->entries[i].id));
+	memcpy(cache->entries[i].admini, info->key, 16);
+	memcpy(cache->entries[i].key, key, 16);
+}
+
+/* デバイスのキャッシュ済みキーを破棄します。
+ * The cache goes away with the handle; this drops the keys of a handle
+ * that stays open. */
+void dict_forget_keys(exword_t *device)
+{
+	memset(exword_get_key_cache(device), 0, sizeof(exword_key_cache_t));
+}
+
 int _upload_file(exword_t *device, char *id, char* name)
 {
 	int length, rsp;
@@ -154,7 +215,7 @@ int _upload_file(exword_t *device, char *id, char* name)
 			    strcmp(ext, ".TXT") == 0 ||
 			    strcmp(ext, ".BMP") == 0 ||
 			    strcmp(ext, ".HTM") == 0)) {
-		_crypt(buffer, length, key2);
+		dict_crypt(buffer, length, key2);
 	}
 	rsp = exword_send_file(device, name, buffer, length);
 	free(filename);
@@ -162,29 +223,55 @@ int _upload_file(exword_t *device, char *id, char* name)
 	return (rsp == 0x20);
 }
 
+static int _decrypt_write(char *buffer, int len, void *user_data)
+{
+	struct decrypt_sink *sink = user_data;
+	int head, ret;
+	char *ptr;
+	if (sink->key != NULL) {
+		/* finish the 16 byte block the previous packet ended in */
+		head = (16 - sink->offset % 16) % 16;
+		if (head > len)
+			head = len;
+		for (ret = 0; ret < head; ret++)
+			buffer[ret] ^= sink->key[(sink->offset + ret) % 16];
+		dict_crypt(buffer + head, len - head, sink->key);
+	}
+	sink->offset += len;
+	for (ptr = buffer; len > 0; ptr += ret, len -= ret) {
+		ret = write(sink->fd, ptr, len);
+		if (ret < 0)
+			return -1;
+	}
+	return 0;
+}
+
 int _download_file(exword_t *device, char *id, char* name, char *key)
 {
 	char *filename;
-	int length, rsp;
-	char *buffer, *ext;
+	int rsp;
+	char *ext;
+	struct decrypt_sink sink = {-1, NULL, 0};
 	filename = mkpath(id, name);
 	ext = strrchr(filename, '.');
-	rsp = exword_get_file(device, name, &buffer, &length);
-	if (rsp != 0x20) {
-		free(filename);
-		return 0;
-	}
 	if (ext != NULL && (strcmp(ext, ".htm") == 0 ||
 			    strcmp(ext, ".bmp") == 0 ||
 			    strcmp(ext, ".txt") == 0 ||
 			    strcmp(ext, ".TXT") == 0 ||
 			    strcmp(ext, ".BMP") == 0 ||
 			    strcmp(ext, ".HTM") == 0)) {
-		_crypt(buffer, length, key);
+		sink.key = key;
+	}
+	sink.fd = open(filename, O_WRONLY | O_CREAT | O_TRUNC | O_BINARY, S_IRUSR | S_IWUSR);
+	if (sink.fd < 0) {
+		free(filename);
+		return 0;
 	}
-	rsp = write_file(filename, buffer, length);
+	rsp = exword_get_file_stream(device, name, _decrypt_write, &sink);
+	close(sink.fd);
+	if (rsp != 0x20)
+		unlink(filename);
 	free(filename);
-	free(buffer);
 	return (rsp == 0x20);
 }
 
@@ -319,15 +406,18 @@ int dict_decrypt(exword_t *device, char *root, char *id)
 		printf("No dictionary with id %s installed.\n", id);
 		return 0;
 	}
-	if (!_crack_key(device, root, id, key)) {
-		printf("Dictionary with id %s is invalid.\n", id);
-		return 0;
+	if (!_cached_key(device, root, &info, key)) {
+		if (!_crack_key(device, root, id, key)) {
+			printf("Dictionary with id %s is invalid.\n", id);
+			return 0;
+		}
+		_cache_key(device, root, &info, key);
 	}
 	if (exword_setpath(device, path, 0) != 0x20) {
 		printf("Dictionary %s does not exist\n", id);
 		return 0;
 	}
-	if (mkdir(id, 0770) < 0) {
+	if (mkdir(id, 0770) < 0 && errno != EEXIST) {
 		printf("Failed to create local directory %s\n", id);
 		return 0;
 	}
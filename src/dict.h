@@ -0,0 +1,44 @@
+/* dict.h - add-on dictionary management used by exword and language bindings
+ *
+ * Copyright (C) 2010 - Brian Johnson <brijohn@gmail.com>
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along
+ * with this program; if not, write to the Free Software Foundation, Inc.,
+ * 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+ *
+ *
+ */
+
+#ifndef _DICT_H
+#define _DICT_H
+
+#include "exword.h"
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+int dict_list(exword_t *device, char *root);
+int dict_remove(exword_t *device, char *root, char *id);
+int dict_decrypt(exword_t *device, char *root, char *id);
+int dict_install(exword_t *device, char *root, char *id);
+int dict_auth(exword_t *device, char *user, char *auth);
+int dict_reset(exword_t *device, char *user);
+void dict_crypt(char *data, int size, char *key);
+void dict_forget_keys(exword_t *device);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif
@@ -23,6 +23,7 @@
 #include <stdio.h>
 #include <iconv.h>
 #include <errno.h>
+#include <sys/time.h>
 #include "obex.h"
 #include "exword.h"
 
@@ -87,6 +88,17 @@ struct exword_t {
 	char * cb_filename;
 	uint32_t cb_filelength;
 	uint32_t cb_transferred;
+	unsigned int cb_interval;
+	struct timeval cb_last;
+
+	exword_stats_t stats[EXWORD_STAT_COUNT];
+	exword_key_cache_t keys;
+};
+
+struct stream_ctx {
+	stream_read_cb read;
+	stream_write_cb write;
+	void *user_data;
 };
 /// @endcond
 
@@ -241,6 +253,24 @@ static int is_cmd(char *data, int length)
 	return 0;
 }
 
+/* whether the transfer callback should run for this packet: always for
+ * the first and last packet of a file, otherwise every cb_interval ms */
+static int exword_callback_due(exword_t *self)
+{
+	struct timeval now;
+	int64_t ms;
+	if (self->cb_interval == 0)
+		return 1;
+	gettimeofday(&now, NULL);
+	ms = (int64_t)(now.tv_sec - self->cb_last.tv_sec) * 1000 +
+	     (now.tv_usec - self->cb_last.tv_usec) / 1000;
+	if (self->cb_last.tv_sec != 0 && ms < self->cb_interval &&
+	    (self->cb_filelength == 0 || self->cb_transferred < self->cb_filelength))
+		return 0;
+	self->cb_last = now;
+	return 1;
+}
+
 static void exword_handle_callbacks(obex_t *self, obex_object_t *object, void *userdata)
 {
 	exword_t *exword = (exword_t*)userdata;
@@ -259,14 +289,16 @@ static void exword_handle_callbacks(obex_t *self, obex_object_t *object, void *u
 			utf16_to_locale(&exword->cb_filename, &len, hdr->hv, ntohs(hdr->hl) - 3);
 			exword->cb_filelength = ntohl(*((uint32_t*)(tx_buffer + ntohs(hdr->hl) + 5)));
 			exword->cb_transferred = 0;
+			exword->cb_last.tv_sec = 0;
 			hdr = (struct obex_unicode_hdr *)(tx_buffer + ntohs(hdr->hl) + 9);
 		}
 		if (hdr->hi == OBEX_HDR_BODY || hdr->hi == OBEX_HDR_BODY_END) {
 			exword->cb_transferred += ntohs(hdr->hl) - 3;
-			exword->put_file_cb(exword->cb_filename,
-					    exword->cb_transferred,
-					    exword->cb_filelength,
-					    exword->cb_userdata);
+			if (exword_callback_due(exword))
+				exword->put_file_cb(exword->cb_filename,
+						    exword->cb_transferred,
+						    exword->cb_filelength,
+						    exword->cb_userdata);
 		}
 	} else if (object->opcode == OBEX_CMD_GET && exword->get_file_cb) {
 		hdr = (struct obex_unicode_hdr *)(tx_buffer + 4);
@@ -274,6 +306,8 @@ static void exword_handle_callbacks(obex_t *self, obex_object_t *object, void *u
 			if (!is_cmd(hdr->hv, ntohs(hdr->hl) - 3)) {
 				free(exword->cb_filename);
 				utf16_to_locale(&exword->cb_filename, &len, hdr->hv, ntohs(hdr->hl) - 3);
+				exword->cb_filelength = 0;
+				exword->cb_last.tv_sec = 0;
 			} else {
 				free(exword->cb_filename);
 				exword->cb_filename = NULL;
@@ -282,6 +316,8 @@ static void exword_handle_callbacks(obex_t *self, obex_object_t *object, void *u
 		if (exword->cb_filename) {
 			if (object->rx_body)
 				exword->cb_transferred = object->rx_body->data_size;
+			else if (object->rx_stream)
+				exword->cb_transferred = object->rx_streamed;
 			if (!list_empty(&object->rx_headerq)) {
 				list_for_each(pos, &object->rx_headerq) {
 					h = list_entry(pos, struct obex_header_element, link);
@@ -291,14 +327,41 @@ static void exword_handle_callbacks(obex_t *self, obex_object_t *object, void *u
 						exword->cb_transferred = h->length;
 				}
 			}
-			exword->get_file_cb(exword->cb_filename,
-					    exword->cb_transferred,
-					    exword->cb_filelength,
-					    exword->cb_userdata);
+			if (exword_callback_due(exword))
+				exword->get_file_cb(exword->cb_filename,
+						    exword->cb_transferred,
+						    exword->cb_filelength,
+						    exword->cb_userdata);
 		}
 	}
 }
 
+/* obex_request() with its latency added to the histogram of command */
+static int exword_request(exword_t *self, int command, obex_object_t *obj)
+{
+	exword_stats_t *stats = &self->stats[command];
+	struct timeval start, end;
+	int64_t us;
+	int rsp, i;
+	gettimeofday(&start, NULL);
+	self->obex_ctx->trace_tag = command;
+	rsp = obex_request(self->obex_ctx, obj);
+	gettimeofday(&end, NULL);
+	us = (int64_t) (end.tv_sec - start.tv_sec) * 1000000 + (end.tv_usec - start.tv_usec);
+	if (us < 0)
+		us = 0;
+	for (i = 0; i < EXWORD_HIST_BUCKETS - 1 && (us >> (i + 1)) != 0; i++)
+		;
+	stats->buckets[i]++;
+	stats->count++;
+	stats->total_us += us;
+	if (us > stats->max_us)
+		stats->max_us = us;
+	if ((rsp & ~OBEX_FINAL) != OBEX_RSP_SUCCESS)
+		stats->errors++;
+	return rsp;
+}
+
 /** @ingroup device
  * Opens device.
  * デフォルト設定で接続されている exword デバイスを開きます。
@@ -319,22 +382,38 @@ exword_t * exword_open()
  */
 exword_t * exword_open2(uint16_t options)
 {
-	int i;
+	return exword_open_index(options, 0);
+}
+
+static uint8_t exword_version(uint16_t options)
+{
+	uint8_t locale = options & 0xff;
+	if (options & OPEN_TEXT)
+		return locale;
+	else if (options & OPEN_CD)
+		return 0xf0;
+	else
+		return locale - 0x0f;
+}
+
+/** @ingroup device
+ * Opens one of several connected devices.
+ * 接続されている EX-word のうち index 番目 (0 から) を開きます。
+ * 各ハンドルは独立した libusb コンテキストを使うため、
+ * 複数のデバイスを別々のスレッドから同時に操作できます。
+ * @param options bit mask of mode and region
+ * @param index which device to open, in USB enumeration order
+ * @returns pointer to a device handle.
+ */
+exword_t * exword_open_index(uint16_t options, int index)
+{
+	int i, n = index;
 	ssize_t ret;
-	uint8_t ver, locale;
 	struct libusb_device_descriptor desc;
 	libusb_device **dev_list = NULL;
 	libusb_device *device = NULL;
 	libusb_device_handle *dev = NULL;
 
-	locale = options & 0xff;
-	if (options & OPEN_TEXT)
-		ver = locale;
-	else if (options & OPEN_CD)
-		ver = 0xf0;
-	else
-		ver = locale - 0x0f;
-
 	exword_t *self = malloc(sizeof(exword_t));
 	if (self == NULL)
 		return NULL;
@@ -352,7 +431,7 @@ exword_t * exword_open2(uint16_t options)
 	for (i = 0; i < ret; i++) {
 		device = dev_list[i];
 		if (libusb_get_device_descriptor(device, &desc) == 0) {
-			if (desc.idVendor == 0x07cf && desc.idProduct == 0x6101) {
+			if (desc.idVendor == 0x07cf && desc.idProduct == 0x6101 && n-- == 0) {
 				if (libusb_open(device, &dev) >= 0) {
 					self->vid = desc.idVendor;
 					self->pid = desc.idProduct;
@@ -370,10 +449,10 @@ exword_t * exword_open2(uint16_t options)
 	if (i >= ret)
 		goto error;
 
-	self->obex_ctx = obex_init(self->vid, self->pid);
+	self->obex_ctx = obex_init_index(self->vid, self->pid, index);
 	if (self->obex_ctx == NULL)
 		goto error;
-	obex_set_connect_info(self->obex_ctx, ver, locale);
+	obex_set_connect_info(self->obex_ctx, exword_version(options), options & 0xff);
 	obex_register_callback(self->obex_ctx, exword_handle_callbacks, self);
 	return self;
 
@@ -382,6 +461,185 @@ error:
 	return NULL;
 }
 
+/** @ingroup device
+ * Opens a device over a custom transport.
+ * USB の代わりに write / read コールバックでパケットをやり取りします。
+ * デバイスエミュレータやテストで実機なしにライブラリ全体を動かすために使います。
+ * パイプライン送信は使えず、常に応答を待ってから次のパケットを送ります。
+ * @param options bit mask of mode and region
+ * @param write called to send one packet
+ * @param read called to receive data, up to len bytes
+ * @param user_data passed to write and read
+ * @returns pointer to a device handle.
+ */
+exword_t * exword_open_transport(uint16_t options, bulk_cb write, bulk_cb read, void *user_data)
+{
+	exword_t *self = malloc(sizeof(exword_t));
+	if (self == NULL)
+		return NULL;
+	memset(self, 0, sizeof(exword_t));
+	self->vid = 0x07cf;
+	self->pid = 0x6101;
+	self->obex_ctx = obex_init_transport(write, read, user_data);
+	if (self->obex_ctx == NULL) {
+		free(self);
+		return NULL;
+	}
+	obex_set_connect_info(self->obex_ctx, exword_version(options), options & 0xff);
+	obex_register_callback(self->obex_ctx, exword_handle_callbacks, self);
+	return self;
+}
+
+static void exword_device_info(libusb_device *device, int index, exword_device_info_t *info)
+{
+	int n;
+	memset(info, 0, sizeof(exword_device_info_t));
+	info->index = index;
+	info->bus = libusb_get_bus_number(device);
+	info->address = libusb_get_device_address(device);
+	n = libusb_get_port_numbers(device, info->ports, sizeof(info->ports));
+	info->port_count = n < 0 ? 0 : n;
+}
+
+/** @ingroup device
+ * Lists connected devices.
+ * 接続されている EX-word をすべて列挙し、バス番号とポート番号を返します。
+ * バスとポートの組はデバイスを差し直しても変わらないので、
+ * 同じ物理ポートのデバイスを識別するのに使えます。
+ * @param devices array receiving up to max entries (may be NULL if max is 0)
+ * @param max size of devices
+ * @return number of connected devices (may exceed max), or < 0 on error
+ */
+int exword_list_devices(exword_device_info_t *devices, int max)
+{
+	struct libusb_device_descriptor desc;
+	libusb_context *ctx = NULL;
+	libusb_device **dev_list = NULL;
+	ssize_t count;
+	int i, n = 0;
+
+	if (libusb_init(&ctx) < 0)
+		return -1;
+	count = libusb_get_device_list(ctx, &dev_list);
+	if (count < 0) {
+		libusb_exit(ctx);
+		return -1;
+	}
+	for (i = 0; i < count; i++) {
+		if (libusb_get_device_descriptor(dev_list[i], &desc) != 0)
+			continue;
+		if (desc.idVendor != 0x07cf || desc.idProduct != 0x6101)
+			continue;
+		if (n < max)
+			exword_device_info(dev_list[i], n, &devices[n]);
+		n++;
+	}
+	libusb_free_device_list(dev_list, 1);
+	libusb_exit(ctx);
+	return n;
+}
+
+struct exword_hotplug_t {
+	libusb_context *ctx;
+	libusb_hotplug_callback_handle handle;
+	int registered;
+	hotplug_cb callback;
+	void *user_data;
+};
+
+static int LIBUSB_CALL exword_hotplug_event(libusb_context *ctx, libusb_device *device,
+					    libusb_hotplug_event event, void *user_data)
+{
+	exword_hotplug_t *self = user_data;
+	exword_device_info_t info;
+	exword_device_info(device, -1, &info);
+	self->callback(event == LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED ?
+		       EXWORD_DEVICE_ARRIVED : EXWORD_DEVICE_LEFT, &info, self->user_data);
+	return 0;
+}
+
+/** @ingroup device
+ * Watches for devices being plugged in or removed.
+ * EX-word の接続・切断をポーリングせずに通知します。コールバックは
+ * \ref exword_hotplug_handle_events の中から呼ばれ、登録時に接続済みの
+ * デバイスについても EXWORD_DEVICE_ARRIVED が届きます。
+ * @param callback called with EXWORD_DEVICE_ARRIVED or EXWORD_DEVICE_LEFT
+ * @param user_data passed to callback
+ * @returns watcher handle, or NULL if the platform has no hotplug support
+ */
+exword_hotplug_t * exword_hotplug_register(hotplug_cb callback, void *user_data)
+{
+	exword_hotplug_t *self;
+	if (!libusb_has_capability(LIBUSB_CAP_HAS_HOTPLUG))
+		return NULL;
+	self = malloc(sizeof(exword_hotplug_t));
+	if (self == NULL)
+		return NULL;
+	memset(self, 0, sizeof(exword_hotplug_t));
+	self->callback = callback;
+	self->user_data = user_data;
+	if (libusb_init(&self->ctx) < 0) {
+		free(self);
+		return NULL;
+	}
+	if (libusb_hotplug_register_callback(self->ctx,
+					     LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED | LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT,
+					     LIBUSB_HOTPLUG_ENUMERATE, 0x07cf, 0x6101,
+					     LIBUSB_HOTPLUG_MATCH_ANY, exword_hotplug_event,
+					     self, &self->handle) != 0) {
+		libusb_exit(self->ctx);
+		free(self);
+		return NULL;
+	}
+	self->registered = 1;
+	return self;
+}
+
+/** @ingroup device
+ * Waits for hotplug events and dispatches them.
+ * イベントが届くか timeout_ms が過ぎるか \ref exword_hotplug_stop が
+ * 呼ばれるまでブロックします。待機中は CPU を使いません。
+ * @param self watcher handle
+ * @param timeout_ms maximum time to wait
+ * @return 0 on success, < 0 on error
+ */
+int exword_hotplug_handle_events(exword_hotplug_t *self, int timeout_ms)
+{
+	struct timeval tv;
+	tv.tv_sec = timeout_ms / 1000;
+	tv.tv_usec = (timeout_ms % 1000) * 1000;
+	return libusb_handle_events_timeout_completed(self->ctx, &tv, NULL);
+}
+
+/** @ingroup device
+ * Stops delivering hotplug events.
+ * 別スレッドの \ref exword_hotplug_handle_events を起こして戻らせます。
+ * @param self watcher handle
+ */
+void exword_hotplug_stop(exword_hotplug_t *self)
+{
+	if (self->registered) {
+		libusb_hotplug_deregister_callback(self->ctx, self->handle);
+		self->registered = 0;
+	}
+	libusb_interrupt_event_handler(self->ctx);
+}
+
+/** @ingroup device
+ * Frees a watcher.
+ * \ref exword_hotplug_handle_events を呼んでいるスレッドが終了してから
+ * 呼び出してください。
+ * @param self watcher handle
+ */
+void exword_hotplug_free(exword_hotplug_t *self)
+{
+	if (self) {
+		exword_hotplug_stop(self);
+		libusb_exit(self->ctx);
+		free(self);
+	}
+}
+
 /** @ingroup device
  * Closes device.
  * デバイスを閉じ、必要なクリーンアップを行います。
@@ -407,6 +665,170 @@ void exword_set_debug(exword_t *self, int level)
 	self->obex_ctx->debug = level;
 }
 
+/** @ingroup misc
+ * Opt-in high throughput transfers: request a larger packet size.
+ * 次回の \ref exword_connect で mtu バイト (最大 OBEX_MAXIMUM_MTU) の
+ * パケットを要求します。デバイスが接続を拒否した場合は半分にして再試行し、
+ * 0x4006 未満になると従来の固定値に戻ります。デバイスが応答した MTU が
+ * 送信サイズの上限になります。
+ * @param self device handle
+ * @param mtu requested packet size, 0 for the legacy fixed sizes
+ */
+void exword_set_max_mtu(exword_t *self, uint16_t mtu)
+{
+	obex_set_mtu(self->obex_ctx, mtu);
+}
+
+/** @ingroup misc
+ * Returns the packet size currently used for sending.
+ * @param self device handle
+ * @return transmit MTU in bytes
+ */
+uint16_t exword_get_mtu(exword_t *self)
+{
+	return self->obex_ctx->mtu_tx;
+}
+
+/** @ingroup misc
+ * Enable or disable pipelined uploads.
+ * 有効にすると、前のパケットの応答を読んでいる間に次の PUT パケットを
+ * 送信し、USB の送信側を休ませません。前の応答を読む前に次のパケットを
+ * 受け付けるデバイスでのみ使用してください。
+ * @param self device handle
+ * @param enable non-zero to pipeline PUT packets
+ * @return 0 on success, -1 if the second transmit buffer could not be allocated
+ */
+int exword_set_pipeline(exword_t *self, int enable)
+{
+	return obex_set_pipeline(self->obex_ctx, enable);
+}
+
+/** @ingroup misc
+ * Configure the USB read timeouts.
+ * 応答待ちのタイムアウトは計測した往復時間 (RTT) から決まり、min_ms から
+ * max_ms の範囲で倍々に延長されます。RTT の 16 倍（最短 300ms、最長 max_ms）の間
+ * なにも届かなければ LIBUSB_ERROR_TIMEOUT で失敗します。request_ms は複数パケットを含む
+ * コマンド全体の期限です。デバイスが切断されると以後のコマンドはすぐに
+ * LIBUSB_ERROR_NO_DEVICE を返します。
+ * @param self device handle
+ * @param min_ms lower bound of the adaptive timeout, 0 for the default (100)
+ * @param max_ms longest wait for a response, 0 for the default (800)
+ * @param request_ms deadline for a whole command, 0 for none
+ */
+void exword_set_timeouts(exword_t *self, unsigned int min_ms, unsigned int max_ms, unsigned int request_ms)
+{
+	obex_set_timeouts(self->obex_ctx, min_ms, max_ms, request_ms);
+}
+
+/** @ingroup misc
+ * Returns the smoothed round trip time of a packet.
+ * @param self device handle
+ * @return round trip time in microseconds, 0 if nothing was measured yet
+ */
+unsigned int exword_get_rtt(exword_t *self)
+{
+	return self->obex_ctx->srtt;
+}
+
+/** @ingroup misc
+ * Abort the command currently running on another thread.
+ * 実行中のコマンドは次の読み込みタイムアウトまでに LIBUSB_ERROR_INTERRUPTED
+ * で終了します。実行中のリクエストがなければ何もしません。
+ * どのスレッドからでも呼び出せます。
+ * @param self device handle
+ */
+void exword_abort(exword_t *self)
+{
+	obex_abort(self->obex_ctx);
+}
+
+/** @ingroup misc
+ * Start or stop the request trace.
+ * 各 OBEX リクエストのオペコード、バイト数、MTU、再試行回数と書き込み /
+ * シーケンス確認 / 読み込みの時間を直近 256 件のリングに記録します。
+ * 接続時から有効です。他のスレッドがハンドルを使っていない時に呼んでください。
+ * @param self device handle
+ * @param enable non-zero to record requests, 0 to stop and free the ring
+ * @return 0 on success, -1 if the ring could not be allocated
+ */
+int exword_set_trace(exword_t *self, int enable)
+{
+	return obex_set_trace(self->obex_ctx, enable);
+}
+
+/** @ingroup misc
+ * Copy recorded requests.
+ * ロックを取らないため、別スレッドでコマンドを実行中でも呼び出せます。
+ * since には前回受け取った最後の id + 1 を渡すと新しいものだけを取得できます。
+ * リングから押し出された分は欠けます (entries の id で分かります)。
+ * @param self device handle
+ * @param entries array receiving the requests, oldest first
+ * @param max number of entries the array can hold
+ * @param since id of the first request wanted
+ * @return number of entries stored
+ */
+int exword_get_trace(exword_t *self, exword_trace_t *entries, int max, uint32_t since)
+{
+	struct obex_trace ring[OBEX_TRACE_SIZE];
+	int i, n;
+	if (max > OBEX_TRACE_SIZE)
+		max = OBEX_TRACE_SIZE;
+	n = obex_get_trace(self->obex_ctx, ring, max, &since);
+	for (i = 0; i < n; i++) {
+		entries[i].start_us = ring[i].start;
+		entries[i].id = since + i;
+		entries[i].command = ring[i].tag;
+		entries[i].opcode = ring[i].opcode;
+		entries[i].mtu = ring[i].mtu;
+		entries[i].rsp = ring[i].rsp;
+		entries[i].packets = ring[i].packets;
+		entries[i].retries = ring[i].retries;
+		entries[i].tx_bytes = ring[i].tx_bytes;
+		entries[i].rx_bytes = ring[i].rx_bytes;
+		entries[i].write_us = ring[i].write;
+		entries[i].seq_us = ring[i].seq;
+		entries[i].read_us = ring[i].read;
+		entries[i].total_us = ring[i].total;
+	}
+	return n;
+}
+
+/** @ingroup misc
+ * Copy the per-command latency histograms.
+ * stats[i] は EXWORD_STAT_* の i 番目のコマンドの統計です。
+ * 別スレッドでコマンドを実行中でも呼び出せます。
+ * @param self device handle
+ * @param stats array receiving the histograms
+ * @param count number of elements in stats (at most EXWORD_STAT_COUNT are used)
+ */
+void exword_get_stats(exword_t *self, exword_stats_t *stats, int count)
+{
+	if (count > EXWORD_STAT_COUNT)
+		count = EXWORD_STAT_COUNT;
+	memcpy(stats, self->stats, count * sizeof(exword_stats_t));
+}
+
+/** @ingroup misc
+ * Clear the latency histograms.
+ * @param self device handle
+ */
+void exword_reset_stats(exword_t *self)
+{
+	memset(self->stats, 0, sizeof(self->stats));
+}
+
+/** @ingroup misc
+ * Get the add-on key cache of the device (used by dict.c).
+ * キャッシュはハンドルと一緒に解放されるため、他のハンドルと共有されません。
+ * ハンドルと同じくスレッドセーフではありません。
+ * @param self device handle
+ * @returns pointer to the cache in the handle
+ */
+exword_key_cache_t * exword_get_key_cache(exword_t *self)
+{
+	return &self->keys;
+}
+
 /** @ingroup misc
  * Registers callback functions for sending and recieving files.
  * These functions will be invoked during file transfers after each
@@ -424,6 +846,19 @@ void exword_register_callbacks(exword_t *self, file_cb get, file_cb put, void *u
 	self->cb_userdata = userdata;
 }
 
+/** @ingroup misc
+ * Limit how often the transfer callbacks run.
+ * 0 以外を指定すると、コールバックはファイルの最初と最後のパケット、
+ * およびその間では interval_ms ごとに最大1回だけ呼ばれます。
+ * 大きなファイルでパケットごとに呼び出すコストを避けるためのものです。
+ * @param self device handle
+ * @param interval_ms minimum time between two calls, 0 to call after every packet
+ */
+void exword_set_callback_interval(exword_t *self, unsigned int interval_ms)
+{
+	self->cb_interval = interval_ms;
+}
+
 /** @ingroup cmd
  * Send connect command.
  * @note これ以前に送ったコマンドは失敗します。
@@ -433,11 +868,22 @@ void exword_register_callbacks(exword_t *self, file_cb get, file_cb put, void *u
 int exword_connect(exword_t *self)
 {
 	int rsp;
-	obex_object_t *obj = obex_object_new(self->obex_ctx, OBEX_CMD_CONNECT);
-	if (obj == NULL)
-		return -1;
-	rsp = obex_request(self->obex_ctx, obj);
-	obex_object_delete(self->obex_ctx, obj);
+	uint16_t mtu;
+	obex_object_t *obj;
+	for (;;) {
+		obj = obex_object_new(self->obex_ctx, OBEX_CMD_CONNECT);
+		if (obj == NULL)
+			return -1;
+		rsp = exword_request(self, EXWORD_STAT_CONNECT, obj);
+		obex_object_delete(self->obex_ctx, obj);
+		mtu = self->obex_ctx->mtu_req;
+		if (rsp == OBEX_RSP_SUCCESS || rsp < 0 || mtu == 0)
+			break;
+		/* 大きな MTU を拒否された場合は半分にして再試行します
+		 * (libusb のエラーは MTU と無関係なのでそのまま返します) */
+		mtu /= 2;
+		obex_set_mtu(self->obex_ctx, mtu < 0x4006 ? 0 : mtu);
+	}
 	return rsp;
 }
 
@@ -467,9 +913,10 @@ int exword_send_file(exword_t *self, char* filename, char *buffer, int len)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, length, 0);
 	hv.bq4 = len;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
+	/* packets are filled straight from buffer, it is not copied first */
 	hv.bs = buffer;
-	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, len, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, len, OBEX_FL_BODY_REF);
+	rsp = exword_request(self, EXWORD_STAT_SEND_FILE, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	free(unicode);
 	return rsp;
@@ -504,7 +951,7 @@ int exword_get_file(exword_t *self, char* filename, char **buffer, int *len)
 	}
 	hv.bs = unicode;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, length, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_GET_FILE, obj);
 	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
 		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
 			if (hi == OBEX_HDR_LENGTH) {
@@ -522,6 +969,89 @@ int exword_get_file(exword_t *self, char* filename, char **buffer, int *len)
 	return rsp;
 }
 
+static int exword_tx_stream(obex_object_t *object, uint8_t *buffer, unsigned int len, void *userdata)
+{
+	struct stream_ctx *ctx = (struct stream_ctx *)userdata;
+	return ctx->read((char *)buffer, len, ctx->user_data);
+}
+
+static int exword_rx_stream(obex_object_t *object, uint8_t *buffer, unsigned int len, void *userdata)
+{
+	struct stream_ctx *ctx = (struct stream_ctx *)userdata;
+	return ctx->write((char *)buffer, len, ctx->user_data);
+}
+
+/** @ingroup cmd
+ * Upload a file to device from a stream.
+ * \ref exword_send_file と同じですが、データは read コールバックから
+ * パケット単位で読み込まれるため、ファイル全体をメモリに置く必要がありません。
+ * @param self device handle
+ * @param filename name of file being sent.
+ * @param len total size of file; read must supply exactly this many bytes.
+ * @param read callback that fills each packet's body
+ * @param user_data pointer passed to read
+ * @return response code
+ */
+int exword_send_file_stream(exword_t *self, char* filename, int len, stream_read_cb read, void *user_data)
+{
+	int length, rsp;
+	obex_headerdata_t hv;
+	char *unicode;
+	struct stream_ctx ctx = {read, NULL, user_data};
+	unicode = locale_to_utf16(&unicode, &length, filename, strlen(filename) + 1);
+	if (unicode == NULL)
+		return -1;
+	obex_object_t *obj = obex_object_new(self->obex_ctx, OBEX_CMD_PUT);
+	if (obj == NULL) {
+		free(unicode);
+		return -1;
+	}
+	obex_object_set_tx_stream(obj, exword_tx_stream, &ctx);
+	hv.bs = unicode;
+	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, length, 0);
+	hv.bq4 = len;
+	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
+	hv.bs = NULL;
+	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, len, OBEX_FL_STREAM_START);
+	rsp = exword_request(self, EXWORD_STAT_SEND_FILE, obj);
+	obex_object_delete(self->obex_ctx, obj);
+	free(unicode);
+	return rsp;
+}
+
+/** @ingroup cmd
+ * Download a file from device into a stream.
+ * 受信したボディはパケットごとに write コールバックへ渡され、
+ * ライブラリ内にファイル全体が溜まることはありません。
+ * @param self device handle
+ * @param filename name of file being received.
+ * @param write callback receiving each chunk of file data
+ * @param user_data pointer passed to write
+ * @return response code
+ */
+int exword_get_file_stream(exword_t *self, char* filename, stream_write_cb write, void *user_data)
+{
+	int length, rsp;
+	obex_headerdata_t hv;
+	char *unicode;
+	struct stream_ctx ctx = {NULL, write, user_data};
+	unicode = locale_to_utf16(&unicode, &length, filename, strlen(filename) + 1);
+	if (unicode == NULL)
+		return -1;
+	obex_object_t *obj = obex_object_new(self->obex_ctx, OBEX_CMD_GET);
+	if (obj == NULL) {
+		free(unicode);
+		return -1;
+	}
+	obex_object_set_rx_stream(obj, exword_rx_stream, &ctx);
+	hv.bs = unicode;
+	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, length, 0);
+	rsp = exword_request(self, EXWORD_STAT_GET_FILE, obj);
+	obex_object_delete(self->obex_ctx, obj);
+	free(unicode);
+	return rsp;
+}
+
 /** @ingroup cmd
  * Remove a file from device.
  * デバイスから指定ファイルを削除します。
@@ -554,7 +1084,7 @@ int exword_remove_file(exword_t *self, char* filename, int convert_to_unicode)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = convert_to_unicode ? unicode : filename;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, length, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_REMOVE_FILE, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	free(unicode);
 	return rsp;
@@ -580,7 +1110,7 @@ int exword_sd_format(exword_t *self)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = "";
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, 1, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_SD_FORMAT, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	return rsp;
 }
@@ -617,7 +1147,7 @@ int exword_setpath(exword_t *self, uint8_t *path, uint8_t mkdir)
 	}
 	obex_object_set_nonhdr_data(obj, non_hdr, 2);
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, len, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_SETPATH, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	free(unicode);
 	return rsp;
@@ -642,7 +1172,7 @@ int exword_get_model(exword_t *self, exword_model_t * model)
 		return -1;
 	hv.bs = Model;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, 14, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_MODEL, obj);
 	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
 		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
 			if (hi == OBEX_HDR_BODY) {
@@ -692,7 +1222,7 @@ int exword_get_capacity(exword_t *self, exword_capacity_t *cap)
 		return -1;
 	hv.bs = Cap;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, 10, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_CAPACITY, obj);
 	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
 		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
 			if (hi == OBEX_HDR_BODY) {
@@ -730,7 +1260,7 @@ int exword_list(exword_t *self, exword_dirent_t **entries, uint16_t *count)
 		return -1;
 	hv.bs = List;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, 12, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_LIST, obj);
 	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
 		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
 			if (hi == OBEX_HDR_BODY) {
@@ -754,6 +1284,72 @@ int exword_list(exword_t *self, exword_dirent_t **entries, uint16_t *count)
 	return rsp;
 }
 
+/** @ingroup cmd
+ * ファイル一覧を1つのバッファで取得します。
+ * Like \ref exword_list, but the List body is parsed into one block:
+ * a header, fixed size entry records and all names, instead of one
+ * allocation per name.  Entries that run past the end of the body are
+ * dropped.  The listing must be freed with \ref exword_free_buffer.
+ * @param[in] self device handle
+ * @param[out] listing parsed listing, NULL on error
+ * @return response code
+ */
+int exword_list_arena(exword_t *self, exword_listing_t **listing)
+{
+	int rsp;
+	uint32_t i, count, size, names_size, pos, used;
+	obex_headerdata_t hv;
+	uint8_t hi;
+	uint32_t hv_size;
+	exword_listing_t *l;
+	*listing = NULL;
+	obex_object_t *obj = obex_object_new(self->obex_ctx, OBEX_CMD_GET);
+	if (obj == NULL)
+		return -1;
+	hv.bs = List;
+	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, 12, 0);
+	rsp = exword_request(self, EXWORD_STAT_LIST, obj);
+	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
+		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
+			if (hi != OBEX_HDR_BODY)
+				continue;
+			count = hv_size >= 2 ? ntohs(*(uint16_t*)hv.bs) : 0;
+			/* each record is a 2 byte size, a flag byte and the name;
+			 * the names take at most what is left of the body */
+			names_size = hv_size > 2 ? hv_size - 2 : 0;
+			l = malloc(sizeof(exword_listing_t) + count * sizeof(exword_listent_t) + names_size);
+			if (l == NULL) {
+				rsp = -1;
+				break;
+			}
+			l->entries = (exword_listent_t *)(l + 1);
+			l->names = (char *)(l->entries + count);
+			pos = 2;
+			used = 0;
+			for (i = 0; i < count; i++) {
+				if (pos + 3 > hv_size)
+					break;
+				size = ntohs(*(uint16_t*)(hv.bs + pos));
+				if (size < 3 || pos + size > hv_size)
+					break;
+				l->entries[i].offset = used;
+				l->entries[i].length = size - 3;
+				l->entries[i].flags = hv.bs[pos + 2];
+				l->entries[i].reserved = 0;
+				memcpy(l->names + used, hv.bs + pos + 3, size - 3);
+				used += size - 3;
+				pos += size;
+			}
+			l->count = i;
+			l->names_size = used;
+			*listing = l;
+			break;
+		}
+	}
+	obex_object_delete(self->obex_ctx, obj);
+	return rsp;
+}
+
 /** @ingroup cmd
  * Free list of directory entries.
  * @param entries array of directory entries
@@ -768,6 +1364,17 @@ void exword_free_list(exword_dirent_t *entries)
 	free(entries);
 }
 
+/** @ingroup misc
+ * Free a buffer returned by the library.
+ * \ref exword_get_file などが確保したバッファを解放します。
+ * Bindings that cannot call the C runtime's free directly should use this.
+ * @param buffer buffer to free
+ */
+void exword_free_buffer(char *buffer)
+{
+	free(buffer);
+}
+
 /** @ingroup cmd
  * Set userid.
  * 接続デバイスの user_id を更新します。
@@ -788,7 +1395,7 @@ int exword_userid(exword_t *self, exword_userid_t id)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = id.name;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, 17, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_USERID, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	return rsp;
 }
@@ -815,7 +1422,7 @@ int exword_cryptkey(exword_t *self, exword_cryptkey_t *key)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, 20, 0);
 	hv.bs = key->blk1;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_CRYPTKEY, hv, 28, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_CRYPTKEY, obj);
 	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
 		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
 			if (hi == OBEX_HDR_BODY) {
@@ -858,7 +1465,7 @@ int exword_cname(exword_t *self, char *name, char* dir)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = buffer;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, dir_length + name_length, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_CNAME, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	free(buffer);
 	return rsp;
@@ -883,7 +1490,7 @@ int exword_unlock(exword_t *self)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = "";
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, 1, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_UNLOCK, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	return rsp;
 }
@@ -907,7 +1514,7 @@ int exword_lock(exword_t *self)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = "";
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, 1, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_LOCK, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	return rsp;
 }
@@ -932,7 +1539,7 @@ int exword_authchallenge(exword_t *self, exword_authchallenge_t challenge)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_LENGTH, hv, 0, 0);
 	hv.bs = challenge.challenge;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_BODY, hv, 20, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_AUTHCHALLENGE, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	return rsp;
 }
@@ -958,7 +1565,7 @@ int exword_authinfo(exword_t *self, exword_authinfo_t *info)
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_NAME, hv, 20, 0);
 	hv.bs = info->blk1;
 	obex_object_addheader(self->obex_ctx, obj, OBEX_HDR_AUTHINFO, hv, 40, 0);
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_AUTHINFO, obj);
 	if ((rsp & ~OBEX_FINAL) == OBEX_RSP_SUCCESS) {
 		while (obex_object_getnextheader(self->obex_ctx, obj, &hi, &hv, &hv_size)) {
 			if (hi == OBEX_HDR_BODY) {
@@ -983,7 +1590,7 @@ int exword_disconnect(exword_t *self)
 	obex_object_t *obj = obex_object_new(self->obex_ctx, OBEX_CMD_DISCONNECT);
 	if (obj == NULL)
 		return -1;
-	rsp = obex_request(self->obex_ctx, obj);
+	rsp = exword_request(self, EXWORD_STAT_DISCONNECT, obj);
 	obex_object_delete(self->obex_ctx, obj);
 	return rsp;
 }
@@ -1031,6 +1638,12 @@ char *exword_response_to_string(int rsp)
 		return "Database full";
 	case OBEX_RSP_DATABASE_LOCKED:
 		return "Database locked";
+	case LIBUSB_ERROR_TIMEOUT:
+		return "Timed out";
+	case LIBUSB_ERROR_NO_DEVICE:
+		return "Device disconnected";
+	case LIBUSB_ERROR_INTERRUPTED:
+		return "Aborted";
 	default:
 		return "Unknown response";
 	}
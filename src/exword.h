@@ -117,6 +117,36 @@ typedef struct {
 } exword_dirent_t;
 #pragma pack()
 
+/**
+ * One entry of an \ref exword_listing_t.
+ */
+typedef struct {
+	/** Offset of the name from exword_listing_t.names */
+	uint32_t offset;
+	/** Length of the name in bytes, including its terminating NUL(s) */
+	uint16_t length;
+	/** Flags, as in \ref exword_dirent_t */
+	uint8_t  flags;
+	uint8_t  reserved;
+} exword_listent_t;
+
+/**
+ * Directory listing stored in a single allocation.
+ * The header is followed by count exword_listent_t records and then by
+ * the raw names (Shift_JIS, or UTF-16BE if the entry has the unicode
+ * flag), so the whole listing is freed with one \ref exword_free_buffer.
+ */
+typedef struct {
+	/** Number of entries */
+	uint32_t count;
+	/** Size of the names area in bytes */
+	uint32_t names_size;
+	/** count entries, directly after this header */
+	exword_listent_t *entries;
+	/** names area, directly after the entries */
+	char *names;
+} exword_listing_t;
+
 /**
  * Structure representing a device's storage capacity.
  */
@@ -193,6 +223,113 @@ typedef struct {
 } exword_cryptkey_t;
 #pragma pack()
 
+/** Identity of a connected device */
+typedef struct {
+	/** Position for \ref exword_open_index, -1 if unknown */
+	int index;
+	/** USB bus number */
+	uint8_t bus;
+	/** USB device address (changes when the device is replugged) */
+	uint8_t address;
+	/** Number of valid entries in ports */
+	uint8_t port_count;
+	/** Port numbers from the root hub down to the device */
+	uint8_t ports[7];
+} exword_device_info_t;
+
+/** @ingroup misc
+ * Commands whose latency \ref exword_get_stats reports
+ */
+enum {
+	EXWORD_STAT_CONNECT,
+	EXWORD_STAT_DISCONNECT,
+	EXWORD_STAT_SEND_FILE,
+	EXWORD_STAT_GET_FILE,
+	EXWORD_STAT_REMOVE_FILE,
+	EXWORD_STAT_SD_FORMAT,
+	EXWORD_STAT_SETPATH,
+	EXWORD_STAT_MODEL,
+	EXWORD_STAT_CAPACITY,
+	EXWORD_STAT_LIST,
+	EXWORD_STAT_USERID,
+	EXWORD_STAT_CRYPTKEY,
+	EXWORD_STAT_CNAME,
+	EXWORD_STAT_UNLOCK,
+	EXWORD_STAT_LOCK,
+	EXWORD_STAT_AUTHCHALLENGE,
+	EXWORD_STAT_AUTHINFO,
+	EXWORD_STAT_COUNT
+};
+
+#define EXWORD_HIST_BUCKETS 32
+
+/** Latency histogram of one command */
+typedef struct {
+	/** Number of calls */
+	uint32_t count;
+	/** Calls that did not return OK, Success */
+	uint32_t errors;
+	/** Sum of all latencies in microseconds */
+	uint64_t total_us;
+	/** Slowest call in microseconds */
+	uint32_t max_us;
+	/** Bucket i counts calls that took 2^i to 2^(i+1) - 1 microseconds */
+	uint32_t buckets[EXWORD_HIST_BUCKETS];
+} exword_stats_t;
+
+#define EXWORD_KEY_CACHE_SIZE 16
+
+/** Add-on keys recovered by dict_decrypt, kept per device handle */
+typedef struct {
+	struct {
+		char root[32];
+		char id[32];
+		/** admini.inf key the content key was recovered under */
+		char admini[16];
+		char key[16];
+	} entries[EXWORD_KEY_CACHE_SIZE];
+	/** Entry the next key replaces */
+	int next;
+} exword_key_cache_t;
+
+/** One OBEX request as recorded by the trace ring */
+typedef struct {
+	/** Wall clock time the request started, microseconds since the epoch */
+	int64_t start_us;
+	/** Running number of the request */
+	uint32_t id;
+	/** EXWORD_STAT_* of the command that sent it */
+	uint8_t command;
+	/** OBEX opcode */
+	uint8_t opcode;
+	/** Transmit MTU when the request finished */
+	uint16_t mtu;
+	/** Response code or negative LIBUSB_ERROR code */
+	int rsp;
+	/** Packets sent */
+	uint16_t packets;
+	/** Reads that timed out or were empty and had to be repeated */
+	uint16_t retries;
+	/** Bytes written and read, including OBEX headers */
+	uint32_t tx_bytes;
+	uint32_t rx_bytes;
+	/** Microseconds spent writing packets, waiting for the sequence
+	 * echo, reading responses, and in total */
+	uint32_t write_us;
+	uint32_t seq_us;
+	uint32_t read_us;
+	uint32_t total_us;
+} exword_trace_t;
+
+#define EXWORD_DEVICE_ARRIVED  1
+#define EXWORD_DEVICE_LEFT     2
+
+typedef struct exword_hotplug_t exword_hotplug_t;
+
+typedef void (*hotplug_cb)(int event, exword_device_info_t *info, void *user_data);
+
+typedef int (*bulk_cb)(uint8_t *data, int len, int *actual, unsigned int timeout, void *user_data);
+
 /** @ingroup misc
  * File transfer callback function,
  * @param filename name of file currently being transferred
@@ -203,6 +340,24 @@ typedef struct {
  */
 typedef void (*file_cb)(char *filename, uint32_t transferred, uint32_t length, void *user_data);
 
+/** @ingroup misc
+ * Stream source for \ref exword_send_file_stream.
+ * @param buffer buffer to fill
+ * @param len maximum number of bytes to store in buffer
+ * @param user_data data pointer passed to \ref exword_send_file_stream
+ * @returns number of bytes stored, 0 at end of file or negative on error
+ */
+typedef int (*stream_read_cb)(char *buffer, int len, void *user_data);
+
+/** @ingroup misc
+ * Stream sink for \ref exword_get_file_stream.
+ * @param buffer received file data
+ * @param len number of bytes in buffer
+ * @param user_data data pointer passed to \ref exword_get_file_stream
+ * @returns negative value to abort the transfer
+ */
+typedef int (*stream_write_cb)(char *buffer, int len, void *user_data);
+
 #ifdef __cplusplus
 extern "C" {
 #endif
@@ -212,20 +367,43 @@ char * utf16_to_locale(char **dst, int *dstsz, const char *src, int srcsz);
 char * locale_to_utf16(char **dst, int *dstsz, const char *src, int srcsz);
 char * exword_response_to_string(int rsp);
 void exword_set_debug(exword_t *self, int level);
+void exword_set_max_mtu(exword_t *self, uint16_t mtu);
+uint16_t exword_get_mtu(exword_t *self);
+int exword_set_pipeline(exword_t *self, int enable);
+void exword_set_timeouts(exword_t *self, unsigned int min_ms, unsigned int max_ms, unsigned int request_ms);
+unsigned int exword_get_rtt(exword_t *self);
+void exword_abort(exword_t *self);
+int exword_set_trace(exword_t *self, int enable);
+int exword_get_trace(exword_t *self, exword_trace_t *entries, int max, uint32_t since);
+void exword_get_stats(exword_t *self, exword_stats_t *stats, int count);
+void exword_reset_stats(exword_t *self);
+exword_key_cache_t * exword_get_key_cache(exword_t *self);
 void exword_register_callbacks(exword_t *self, file_cb get, file_cb put, void *userdata);
+void exword_set_callback_interval(exword_t *self, unsigned int interval_ms);
 void exword_free_list(exword_dirent_t *entries);
+void exword_free_buffer(char *buffer);
 exword_t * exword_open();
 exword_t * exword_open2(uint16_t options);
+exword_t * exword_open_index(uint16_t options, int index);
+exword_t * exword_open_transport(uint16_t options, bulk_cb write, bulk_cb read, void *user_data);
 void exword_close(exword_t *self);
+int exword_list_devices(exword_device_info_t *devices, int max);
+exword_hotplug_t * exword_hotplug_register(hotplug_cb callback, void *user_data);
+int exword_hotplug_handle_events(exword_hotplug_t *self, int timeout_ms);
+void exword_hotplug_stop(exword_hotplug_t *self);
+void exword_hotplug_free(exword_hotplug_t *self);
 int exword_connect(exword_t *self);
 int exword_send_file(exword_t *self, char* filename, char *buffer, int len);
 int exword_get_file(exword_t *self, char* filename, char **buffer, int *len);
+int exword_send_file_stream(exword_t *self, char* filename, int len, stream_read_cb read, void *user_data);
+int exword_get_file_stream(exword_t *self, char* filename, stream_write_cb write, void *user_data);
 int exword_remove_file(exword_t *self, char* filename, int convert_to_unicode);
 int exword_get_model(exword_t *self, exword_model_t * model);
 int exword_get_capacity(exword_t *self, exword_capacity_t *cap);
 int exword_sd_format(exword_t *self);
 int exword_setpath(exword_t *self, uint8_t *path, uint8_t mkdir);
 int exword_list(exword_t *self, exword_dirent_t **entries, uint16_t *count);
+int exword_list_arena(exword_t *self, exword_listing_t **listing);
 int exword_userid(exword_t *self, exword_userid_t id);
 int exword_cryptkey(exword_t *self, exword_cryptkey_t *key);
 int exword_cname(exword_t *self, char *name, char* dir);
@@ -23,10 +23,12 @@
 #include <string.h>
 #include <locale.h>
 #include <libgen.h>
+#include <sys/stat.h>
 #include <readline/readline.h>
 #include <readline/history.h>
 
 #include "exword.h"
+#include "dict.h"
 #include "util.h"
 #include "list.h"
 
@@ -37,6 +39,10 @@ struct state {
 	int connected;
 	int debug;
 	int mkdir;
+	int mtu;
+	int pipeline;
+	unsigned int timeout;
+	unsigned int request_timeout;
 	int authenticated;
 	int sd_inserted;
 	char *cwd;
@@ -116,7 +122,10 @@ struct command commands[] = {
 	"<option> を [value] に設定します。値省略時は現在値を表示します。\n\n"
 	"利用可能なオプション:\n"
 	"debug <level>  - デバッグレベルを設定 (0-5)\n"
-	"mkdir <on|off> - setpath がディレクトリを作成するか指定\n"},
+	"mkdir <on|off> - setpath がディレクトリを作成するか指定\n"
+	"mtu <size>     - 次回接続時に要求する MTU (0 で従来値, 最大 65535)\n"
+	"pipeline <on|off> - アップロードのパケットをパイプライン送信\n"
+	"timeout <ms> [request ms] - 応答待ちの上限とコマンド全体の期限 (0 で既定値/無制限)\n"},
 {"exit", quit, "exit\t\t\t- 終了\n",
 	"プログラムを終了し、接続があれば切断します。\n"},
 {"help", help, NULL, NULL},
@@ -305,6 +314,9 @@ void connect(struct state *s)
 			printf("device not found\n");
 		} else {
 			exword_set_debug(s->device, s->debug);
+			exword_set_max_mtu(s->device, s->mtu);
+			exword_set_pipeline(s->device, s->pipeline);
+			exword_set_timeouts(s->device, 0, s->timeout, s->request_timeout);
 			if (exword_connect(s->device) != 0x20) {
 				printf("connect failed\n");
 				exword_close(s->device);
@@ -391,10 +403,21 @@ void format(struct state *s)
 	printf("%s\n", exword_response_to_string(rsp));
 }
 
+static int file_read_cb(char *buffer, int len, void *user_data)
+{
+	return fread(buffer, 1, len, (FILE *)user_data);
+}
+
+static int file_write_cb(char *buffer, int len, void *user_data)
+{
+	return (fwrite(buffer, 1, len, (FILE *)user_data) == len ? len : -1);
+}
+
 void send(struct state *s)
 {
-	int rsp, len;
-	char *buffer;
+	int rsp;
+	FILE *fp;
+	struct stat buf;
 	char *filename;
 	char *name = NULL;
 	if (!s->connected)
@@ -406,19 +429,27 @@ void send(struct state *s)
 		name = xmalloc(strlen(filename) + 1);
 		strcpy(name, filename);
 		printf("uploading...");
-		rsp = read_file(name, &buffer, &len);
-		if (rsp == 0x20)
-			rsp = exword_send_file(s->device, basename(name), buffer, len);
+		/* stream the file so only one packet is held in memory */
+		fp = fopen(name, "rb");
+		if (fp == NULL) {
+			rsp = 0x44;
+		} else {
+			if (fstat(fileno(fp), &buf) == 0)
+				rsp = exword_send_file_stream(s->device, basename(name), buf.st_size, file_read_cb, fp);
+			else
+				rsp = 0x50;
+			fclose(fp);
+		}
 		free(name);
-		free(buffer);
 		printf("%s\n", exword_response_to_string(rsp));
 	}
 }
 
 void get(struct state *s)
 {
-	int rsp, len;
-	char *buffer = NULL, *name = NULL;
+	int rsp;
+	FILE *fp;
+	char *name = NULL;
 	char *filename;
 	if (!s->connected)
 		return;
@@ -429,11 +460,17 @@ void get(struct state *s)
 		name = xmalloc(strlen(filename) + 1);
 		strcpy(name, filename);
 		printf("downloading...");
-		rsp = exword_get_file(s->device, basename(name), &buffer, &len);
-		if (rsp == 0x20)
-			rsp = write_file(filename, buffer, len);
+		fp = fopen(filename, "wb");
+		if (fp == NULL) {
+			rsp = 0x43;
+		} else {
+			rsp = exword_get_file_stream(s->device, basename(name), file_write_cb, fp);
+			if (fclose(fp) != 0 && rsp == 0x20)
+				rsp = 0x50;
+			if (rsp != 0x20)
+				remove(filename);
+		}
 		free(name);
-		free(buffer);
 		printf("%s\n", exword_response_to_string(rsp));
 	}
 }
@@ -489,12 +526,6 @@ void list(struct state *s)
 	printf("%s\n", exword_response_to_string(rsp));
 }
 
-int dict_list(exword_t *device, char *root);
-int dict_remove(exword_t *device, char *root, char *id);
-int dict_decrypt(exword_t *device, char *root, char *id);
-int dict_install(exword_t *device, char *root, char *id);
-int dict_auth(exword_t *device, char *user, char *auth);
-
 void dict(struct state *s)
 {
 	int i;
@@ -683,6 +714,71 @@ void set(struct state *s)
 				printf("Invalid value\n");
 			}
 		}
+	} else if (strcmp(opt, "mtu") == 0) {
+		unsigned int mtu;
+		dequeue_arg(&(s->cmd_list));
+		arg = peek_arg(&(s->cmd_list));
+		if (arg == NULL) {
+			printf("MTU: %u", s->mtu);
+			if (s->connected)
+				printf(" (using %u)", exword_get_mtu(s->device));
+			printf("\n");
+		} else {
+			if (sscanf(arg, "%i", &mtu) < 1) {
+				printf("Invalid value\n");
+			} else if (mtu > 65535) {
+				printf("Value should be between 0 and 65535\n");
+			} else {
+				s->mtu = mtu;
+				if (s->connected)
+					printf("Takes effect on next connect\n");
+			}
+		}
+	} else if (strcmp(opt, "pipeline") == 0) {
+		dequeue_arg(&(s->cmd_list));
+		arg = peek_arg(&(s->cmd_list));
+		if (arg == NULL) {
+			printf("Pipeline: %u\n", s->pipeline);
+		} else {
+			if (strcmp(arg, "on") == 0 ||
+			    strcmp(arg, "yes") == 0 ||
+			    strcmp(arg, "true") == 0) {
+				s->pipeline = 1;
+			} else if (strcmp(arg, "off") == 0 ||
+			    strcmp(arg, "no") == 0 ||
+			    strcmp(arg, "false") == 0) {
+				s->pipeline = 0;
+			} else {
+				printf("Invalid value\n");
+			}
+			if (s->connected)
+				exword_set_pipeline(s->device, s->pipeline);
+		}
+	} else if (strcmp(opt, "timeout") == 0) {
+		unsigned int timeout, request_timeout = 0;
+		dequeue_arg(&(s->cmd_list));
+		arg = peek_arg(&(s->cmd_list));
+		if (arg == NULL) {
+			printf("Timeout: %u ms, request: %u ms", s->timeout, s->request_timeout);
+			if (s->connected)
+				printf(" (rtt %u us)", exword_get_rtt(s->device));
+			printf("\n");
+		} else {
+			if (sscanf(arg, "%u", &timeout) < 1) {
+				printf("Invalid value\n");
+			} else {
+				dequeue_arg(&(s->cmd_list));
+				arg = peek_arg(&(s->cmd_list));
+				if (arg != NULL && sscanf(arg, "%u", &request_timeout) < 1) {
+					printf("Invalid value\n");
+				} else {
+					s->timeout = timeout;
+					s->request_timeout = request_timeout;
+					if (s->connected)
+						exword_set_timeouts(s->device, 0, s->timeout, s->request_timeout);
+				}
+			}
+		}
 	} else {
 		printf("Unknown option %s\n", opt);
 	}
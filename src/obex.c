@@ -23,23 +23,169 @@
  *
  *
  */
+#include <sys/time.h>
+
 #include "obex.h"
 
+static int obex_usb_write(uint8_t *data, int len, int *actual, unsigned int timeout, void *user_data)
+{
+	obex_t *self = user_data;
+	return libusb_bulk_transfer(self->usb_dev, self->write_endpoint_address, data, len, actual, timeout);
+}
+
+static int obex_usb_read(uint8_t *data, int len, int *actual, unsigned int timeout, void *user_data)
+{
+	obex_t *self = user_data;
+	return libusb_bulk_transfer(self->usb_dev, self->read_endpoint_address, data, len, actual, timeout);
+}
+
+static int64_t obex_now(void)
+{
+	struct timeval tv;
+	gettimeofday(&tv, NULL);
+	return (int64_t) tv.tv_sec * 1000000 + tv.tv_usec;
+}
+
+/* Jacobson/Karels estimator, as used for TCP retransmission timeouts */
+static void obex_update_rtt(obex_t *self, int64_t rtt)
+{
+	int64_t err;
+	if (self->srtt == 0) {
+		self->srtt = rtt > 0 ? rtt : 1;
+		self->rttvar = rtt / 2;
+		return;
+	}
+	err = rtt - self->srtt;
+	self->srtt += err / 8;
+	if (self->srtt <= 0)
+		self->srtt = 1;
+	if (err < 0)
+		err = -err;
+	self->rttvar += (err - self->rttvar) / 4;
+}
+
+/* First read timeout for a response in ms: srtt + 4 * rttvar */
+static unsigned int obex_rto(obex_t *self)
+{
+	int64_t rto;
+	if (self->srtt == 0)
+		return self->timeout_max;
+	rto = (self->srtt + 4 * self->rttvar) / 1000 + 1;
+	if (rto < self->timeout_min)
+		rto = self->timeout_min;
+	if (rto > self->timeout_max)
+		rto = self->timeout_max;
+	return rto;
+}
+
+/* Whether obex_abort() was called during the request in flight */
+static int obex_aborted(obex_t *self)
+{
+	uint32_t active = self->active;
+	return active != 0 && self->abort == active;
+}
+
+/* Longest silence in ms before a read fails, see OBEX_GIVEUP_RTT */
+static unsigned int obex_give_up(obex_t *self, unsigned int rto)
+{
+	int64_t ms;
+	if (self->srtt == 0)
+		return self->timeout_max;
+	ms = OBEX_GIVEUP_RTT * (self->srtt + 4 * self->rttvar) / 1000 + 1;
+	if (ms < OBEX_GIVEUP_MIN)
+		ms = OBEX_GIVEUP_MIN;
+	if (ms < rto)
+		ms = rto;
+	if (ms > self->timeout_max)
+		ms = self->timeout_max;
+	return ms;
+}
+
+/* Read one transfer into buffer.  A timeout or zero length packet is
+ * retried with a doubled timeout until obex_give_up() ms passed without
+ * data or the request deadline expired; disconnection and obex_abort()
+ * end the wait at once. */
+static int obex_read_wait(obex_t *self, uint8_t *buffer, int *actual)
+{
+	int64_t start, now, left;
+	unsigned int timeout, give_up;
+	int retval;
+	start = obex_now();
+	timeout = obex_rto(self);
+	give_up = obex_give_up(self, timeout);
+	for (;;) {
+		*actual = 0;
+		retval = self->bulk_read(buffer, self->mtu_rx, actual, timeout, self->bulk_data);
+		if (*actual > 0) {
+			self->trace_cur.rx_bytes += *actual;
+			return 0;
+		}
+		if (retval == LIBUSB_ERROR_NO_DEVICE)
+			self->gone = 1;
+		if (retval < 0 && retval != LIBUSB_ERROR_TIMEOUT)
+			return retval;
+		if (obex_aborted(self))
+			return LIBUSB_ERROR_INTERRUPTED;
+		self->trace_cur.retries++;
+		now = obex_now();
+		left = (int64_t) give_up * 1000 - (now - start);
+		if (self->deadline && self->deadline - now < left)
+			left = self->deadline - now;
+		if (left <= 0) {
+			DEBUG(self, 3, "No response after %d ms\n", (int) ((now - start) / 1000));
+			return LIBUSB_ERROR_TIMEOUT;
+		}
+		timeout *= 2;
+		if (timeout > left / 1000 + 1)
+			timeout = left / 1000 + 1;
+	}
+}
+
+/* LIBUSB_ERROR_INTERRUPTED after obex_abort(), LIBUSB_ERROR_TIMEOUT once
+ * the request deadline passed, otherwise 0 */
+static int obex_expired(obex_t *self)
+{
+	if (obex_aborted(self))
+		return LIBUSB_ERROR_INTERRUPTED;
+	if (self->deadline && obex_now() >= self->deadline)
+		return LIBUSB_ERROR_TIMEOUT;
+	return 0;
+}
+
+/* Throw away a response that arrived after its request had given up */
+static void obex_drain(obex_t *self)
+{
+	uint8_t *buffer;
+	int actual, count = 0;
+	buf_reuse(self->rx_msg);
+	buffer = buf_reserve_end(self->rx_msg, self->mtu_rx);
+	do {
+		actual = 0;
+		if (self->bulk_read(buffer, self->mtu_rx, &actual, self->timeout_min, self->bulk_data) == LIBUSB_ERROR_NO_DEVICE)
+			self->gone = 1;
+	} while (actual > 0 && ++count < 16);
+	buf_reuse(self->rx_msg);
+	self->stale = 0;
+}
+
 static int obex_bulk_read(obex_t *self, buf_t *msg)
 {
 	int retval, actual_length;
 	int expected_length;
+	int64_t start;
 	char * buffer;
 	DEBUG(self, 4, "Read from endpoint %d\n", self->read_endpoint_address);
 	if (msg->data_size > 0 && ntohs(*((uint16_t*)(msg->data + 1))) == msg->data_size)
 		return msg->data_size;
+	start = self->trace ? obex_now() : 0;
 	do {
 		buffer = buf_reserve_end(msg, self->mtu_rx);
-		retval = libusb_bulk_transfer(self->usb_dev, self->read_endpoint_address, buffer, self->mtu_rx, &actual_length, 1245);
+		retval = obex_read_wait(self, (uint8_t *) buffer, &actual_length);
 		buf_remove_end(msg, self->mtu_rx - actual_length);
 		expected_length = ntohs(*((uint16_t*)(msg->data + 1)));
-	} while ((expected_length != msg->data_size && retval == 0) ||
-		 (actual_length == 0 && retval == 0));
+	} while (expected_length != msg->data_size && retval == 0);
+	if (self->trace)
+		self->trace_cur.read += obex_now() - start;
 	if (retval == 0)
 		retval = msg->data_size;
 	return retval;
@@ -48,36 +194,50 @@ static int obex_bulk_read(obex_t *self, buf_t *msg)
 static int obex_bulk_write(obex_t *self, buf_t *msg)
 {
 	int actual_length, retval;
+	int64_t start;
 	DEBUG(self, 4, "Write to endpoint %d\n", self->write_endpoint_address);
-	retval = libusb_bulk_transfer(self->usb_dev, self->write_endpoint_address, msg->data, msg->data_size, &actual_length, 1245);
-	if (retval == 0)
+	start = self->trace ? obex_now() : 0;
+	retval = self->bulk_write(msg->data, msg->data_size, &actual_length, self->timeout_max, self->bulk_data);
+	if (retval == LIBUSB_ERROR_NO_DEVICE)
+		self->gone = 1;
+	if (retval == 0) {
 		retval = actual_length;
+		self->trace_cur.tx_bytes += actual_length;
+		self->trace_cur.packets++;
+	}
+	if (self->trace)
+		self->trace_cur.write += obex_now() - start;
 	return retval;
 }
 
-static int obex_verify_seq(obex_t *self, uint8_t seq) {
-	int retval, actual_length = 0, count = 0;
+/* Read the sequence number the device echoes for every packet.  sent is
+ * when the packet went out; the delay feeds the round trip estimate.
+ * Returns 0, a negative LIBUSB_ERROR code or -1 on a mismatch. */
+static int obex_verify_seq(obex_t *self, uint8_t seq, int64_t sent)
+{
+	int retval, actual_length = 0;
+	int64_t start;
 	char * buffer;
+	start = self->trace ? obex_now() : 0;
 	buffer = buf_reserve_end(self->rx_msg, self->mtu_rx);
-	do {
-		retval = libusb_bulk_transfer(self->usb_dev, self->read_endpoint_address, buffer, self->mtu_rx, &actual_length, 1245);
-		if (retval < 0)
-			break;
-		count++;
-	} while (count < 100 && actual_length == 0);
+	retval = obex_read_wait(self, (uint8_t *) buffer, &actual_length);
 	buf_remove_end(self->rx_msg, self->mtu_rx - actual_length);
-	if (retval < 0 || actual_length == 0) {
+	if (self->trace)
+		self->trace_cur.seq += obex_now() - start;
+	if (retval < 0) {
 		DEBUG(self, 4, "Error reading seq number (%d)\n",
 		      retval);
-		return 0;
+		return retval;
 	}
+	if (sent)
+		obex_update_rtt(self, obex_now() - sent);
 	if ((uint8_t)buffer[0] != seq) {
 		DEBUG(self, 4, "Sequence mismatch %u != %u\n",
 		      (uint8_t)buffer[0], seq);
-		return 0;
+		return -1;
 	}
 	buf_remove_begin(self->rx_msg, 1);
-	return 1;
+	return 0;
 }
 
 static int obex_claim_interface(obex_t *ctx)
@@ -189,6 +349,98 @@ static int send_body(obex_object_t *object,
 	return actual;
 }
 
+static int send_stream(obex_object_t *object,
+		       struct obex_header_element *h,
+		       buf_t *txmsg, unsigned int tx_left)
+{
+	struct obex_byte_stream_hdr *body_txh;
+	unsigned int len, got = 0;
+	uint8_t *data;
+	int ret;
+
+	/* h->length is the total body length, h->offset how much was sent */
+	if (tx_left <= sizeof(struct obex_byte_stream_hdr))
+		return 0;
+	len = tx_left - sizeof(struct obex_byte_stream_hdr);
+	if (len > h->length - h->offset)
+		len = h->length - h->offset;
+
+	/* The stream writes straight into the packet after the header */
+	body_txh = (struct obex_byte_stream_hdr*) buf_reserve_end(txmsg, sizeof(struct obex_byte_stream_hdr) + len);
+	data = body_txh->hv;
+
+	while (got < len) {
+		ret = object->tx_stream(object, data + got, len - got, object->tx_stream_data);
+		if (ret <= 0)
+			break;
+		got += ret;
+	}
+	if (got < len) {
+		/* LENGTH header already promised the full size */
+		DEBUG(object->context, 1, "Stream ended early (%u < %u)\n", got, len);
+		return -1;
+	}
+	h->offset += got;
+
+	if (h->offset < h->length) {
+		DEBUG(object->context, 4, "Add BODY header (stream)\n");
+		body_txh->hi = OBEX_HDR_BODY;
+	} else {
+		DEBUG(object->context, 4, "Add BODY_END header (stream)\n");
+		body_txh->hi = OBEX_HDR_BODY_END;
+		list_del(&h->link);
+		free(h);
+	}
+	body_txh->hl = htons((uint16_t)(got + sizeof(struct obex_byte_stream_hdr)));
+
+	return got + sizeof(struct obex_byte_stream_hdr);
+}
+
+/* Body added with OBEX_FL_BODY_REF: copied once, straight from the
+ * caller's buffer into the packet.  h->offset is how much was sent. */
+static int send_body_ref(obex_object_t *object,
+			 struct obex_header_element *h,
+			 buf_t *txmsg, unsigned int tx_left)
+{
+	struct obex_byte_stream_hdr *body_txh;
+	unsigned int len;
+
+	if (tx_left <= sizeof(struct obex_byte_stream_hdr))
+		return 0;
+	len = tx_left - sizeof(struct obex_byte_stream_hdr);
+	if (len > h->length - h->offset)
+		len = h->length - h->offset;
+
+	body_txh = (struct obex_byte_stream_hdr*) buf_reserve_end(txmsg, sizeof(struct obex_byte_stream_hdr) + len);
+	memcpy(body_txh->hv, h->data + h->offset, len);
+	h->offset += len;
+
+	if (h->offset < h->length) {
+		DEBUG(object->context, 4, "Add BODY header (ref)\n");
+		body_txh->hi = OBEX_HDR_BODY;
+	} else {
+		DEBUG(object->context, 4, "Add BODY_END header (ref)\n");
+		body_txh->hi = OBEX_HDR_BODY_END;
+		list_del(&h->link);
+		free(h);
+	}
+	body_txh->hl = htons((uint16_t)(len + sizeof(struct obex_byte_stream_hdr)));
+
+	return len + sizeof(struct obex_byte_stream_hdr);
+}
+
+static int obex_object_receive_stream(obex_object_t *object, uint8_t hi,
+				      uint8_t *source, unsigned int len)
+{
+	DEBUG(object->context, 4, "Streaming body-header. Len=%d\n", len);
+	if (len > 0 && object->rx_stream(object, source, len, object->rx_stream_data) < 0) {
+		DEBUG(object->context, 1, "Stream sink failed\n");
+		return -1;
+	}
+	object->rx_streamed += len;
+	return 1;
+}
+
 static int obex_object_receive_body(obex_object_t *object, buf_t *msg, uint8_t hi,
 				uint8_t *source, unsigned int len)
 {
@@ -202,10 +454,14 @@ static int obex_object_receive_body(obex_object_t *object, buf_t *msg, uint8_t h
 		return -1;
 	}
 
+	if (object->rx_stream)
+		return obex_object_receive_stream(object, hi, source, len);
+
 	if (!object->rx_body) {
 		int alloclen = OBEX_OBJECT_ALLOCATIONTRESHOLD + len;
 
-		if (object->hinted_body_len)
+		/* Length ヘッダがあれば本体全体を一度に確保します */
+		if (object->hinted_body_len >= (int) len)
 			alloclen = object->hinted_body_len;
 
 		DEBUG(object->context, 4, "Allocating new body-buffer. Len=%d\n", alloclen);
@@ -213,13 +469,17 @@ static int obex_object_receive_body(obex_object_t *object, buf_t *msg, uint8_t h
 			return -1;
 	}
 
-	/* Reallocate body buffer if needed */
+	/* Reallocate body buffer if needed.  Growing geometrically keeps the
+	 * total copying linear when the length was not hinted (or was wrong). */
 	if (object->rx_body->data_avail + object->rx_body->tail_avail < (int) len) {
-		int t;
+		size_t t, size;
 		DEBUG(object->context, 4, "Buffer too small. Go realloc\n");
 		t = buf_total_size(object->rx_body);
-		buf_resize(object->rx_body, t + OBEX_OBJECT_ALLOCATIONTRESHOLD + len);
-		if (buf_total_size(object->rx_body) != t + OBEX_OBJECT_ALLOCATIONTRESHOLD + len) {
+		size = t * 2;
+		if (size < t + OBEX_OBJECT_ALLOCATIONTRESHOLD + len)
+			size = t + OBEX_OBJECT_ALLOCATIONTRESHOLD + len;
+		buf_resize(object->rx_body, size);
+		if (buf_total_size(object->rx_body) != size) {
 			DEBUG(object->context, 1, "Can't realloc rx_body\n");
 			return -1;
 		}
@@ -247,20 +507,18 @@ static int obex_object_receive_body(obex_object_t *object, buf_t *msg, uint8_t h
 	return 1;
 }
 
-static int obex_object_send(obex_t *self, obex_object_t *object)
+/* 次に送るパケットを txmsg に組み立てます。
+ * Returns 1 if this is the last packet of the object, 0 if more follow. */
+static int obex_object_prepare(obex_t *self, obex_object_t *object, buf_t *txmsg)
 {
 	struct obex_header_element *h;
 	struct obex_common_hdr *hdr;
-	buf_t *txmsg;
 	int actual, finished = 0;
 	uint16_t tx_left;
 	int addmore = 1;
 	int real_opcode;
-	char check[1];
 
 	tx_left = self->mtu_tx - sizeof(struct obex_common_hdr);
-	/* Reuse transmit buffer */
-	txmsg = buf_reuse(self->tx_msg);
 
 	/* Add nonheader-data first if any (SETPATH, CONNECT)*/
 	if (object->tx_nonhdr_data) {
@@ -278,7 +536,19 @@ static int obex_object_send(obex_t *self, obex_object_t *object)
 		h = list_entry(object->tx_headerq.next, struct obex_header_element, link);
 
 
-		if (h->hi == OBEX_HDR_BODY) {
+		if (h->hi == OBEX_HDR_BODY && (h->flags & OBEX_FL_STREAM_START)) {
+			actual = send_stream(object, h, txmsg, tx_left);
+			if (actual < 0)
+				return -1;
+			if (actual == 0)
+				addmore = 0;
+			tx_left -= actual;
+		} else if (h->hi == OBEX_HDR_BODY && (h->flags & OBEX_FL_BODY_REF)) {
+			actual = send_body_ref(object, h, txmsg, tx_left);
+			if (actual == 0)
+				addmore = 0;
+			tx_left -= actual;
+		} else if (h->hi == OBEX_HDR_BODY) {
 			/* The body may be fragmented over several packets. */
 			tx_left -= send_body(object, h, txmsg, tx_left);
 		} else if(h->hi == OBEX_HDR_EMPTY) {
@@ -331,12 +601,31 @@ static int obex_object_send(obex_t *self, obex_object_t *object)
 	DUMPBUFFER(self, "Tx", txmsg);
 	DEBUG(self, 1, "len = %d bytes\n", txmsg->data_size);
 
+	return finished;
+}
+
+static int obex_object_send(obex_t *self, obex_object_t *object)
+{
+	struct obex_common_hdr *hdr;
+	buf_t *txmsg;
+	int actual, finished;
+	int64_t sent;
+
+	/* Reuse transmit buffer */
+	txmsg = buf_reuse(self->tx_msg);
+	finished = obex_object_prepare(self, object, txmsg);
+	if (finished < 0)
+		return finished;
+	hdr = (struct obex_common_hdr *) txmsg->data;
+
+	sent = obex_now();
 	actual = obex_bulk_write(self, txmsg);
 	if (actual < 0) {
 		return actual;
 	} else {
-		if (!obex_verify_seq(self, hdr->seq))
-			return -1;
+		actual = obex_verify_seq(self, hdr->seq, sent);
+		if (actual < 0)
+			return actual;
 		return finished;
 
 	}
@@ -391,9 +680,17 @@ int obex_object_receive(obex_t *self, obex_object_t *object)
 
 				DEBUG(self, 1, "version=%02x\n", version);
 
-				/* Limit to some reasonable value (usually OBEX_DEFAULT_MTU) */
-				self->mtu_rx = OBEX_DEFAULT_MTU;
-				self->mtu_tx = 0x4006;
+				if (self->mtu_req) {
+					/* Opt-in: use what the device offered, up to the requested size */
+					self->mtu_rx = self->mtu_req;
+					self->mtu_tx = self->mtu_req;
+					if (mtu >= OBEX_MINIMUM_MTU && mtu < self->mtu_tx)
+						self->mtu_tx = mtu;
+				} else {
+					/* Limit to some reasonable value (usually OBEX_DEFAULT_MTU) */
+					self->mtu_rx = OBEX_DEFAULT_MTU;
+					self->mtu_tx = 0x4006;
+				}
 
 				DEBUG(self, 1, "requested MTU=%02x, used MTU=%02x\n", mtu, self->mtu_tx);
 			} else {
@@ -520,24 +817,38 @@ int obex_object_receive(obex_t *self, obex_object_t *object)
 	return hdr->rsp & ~OBEX_FINAL;
 }
 
-obex_t * obex_init(uint16_t vid, uint16_t pid)
+/* index 番目に見つかった vid:pid のデバイスを開きます */
+static libusb_device_handle * obex_open_nth(libusb_context *ctx, uint16_t vid, uint16_t pid, int index)
 {
-	obex_t *self;
-	int size;
-	self = malloc(sizeof(obex_t));
-	if (self == NULL)
+	struct libusb_device_descriptor desc;
+	libusb_device **dev_list = NULL;
+	libusb_device_handle *dev = NULL;
+	ssize_t count;
+	int i;
+
+	count = libusb_get_device_list(ctx, &dev_list);
+	if (count < 0)
 		return NULL;
-	memset(self, 0, sizeof(obex_t));
-
-	if (libusb_init(&self->usb_ctx) < 0)
-		goto out_err;
-
-	self->usb_dev = libusb_open_device_with_vid_pid(self->usb_ctx, vid, pid);
-	if (self->usb_dev == NULL)
-		goto out_err;
+	for (i = 0; i < count; i++) {
+		if (libusb_get_device_descriptor(dev_list[i], &desc) != 0)
+			continue;
+		if (desc.idVendor != vid || desc.idProduct != pid)
+			continue;
+		if (index-- == 0) {
+			if (libusb_open(dev_list[i], &dev) < 0)
+				dev = NULL;
+			break;
+		}
+	}
+	libusb_free_device_list(dev_list, 1);
+	return dev;
+}
 
-	if (obex_claim_interface(self) < 0)
-		goto out_err;
+static int obex_setup(obex_t *self, obex_bulk_cb write, obex_bulk_cb read, void *user_data)
+{
+	self->bulk_write = write;
+	self->bulk_read = read;
+	self->bulk_data = user_data;
 
 	self->seq_num = 0;
 	self->debug = 0;
@@ -546,43 +857,96 @@ obex_t * obex_init(uint16_t vid, uint16_t pid)
 	self->mtu_rx = OBEX_DEFAULT_MTU;
 	self->mtu_tx = OBEX_DEFAULT_MTU;
 	self->mtu_tx_max = OBEX_MAXIMUM_MTU;
+	self->timeout_min = OBEX_TIMEOUT_MIN;
+	self->timeout_max = OBEX_TIMEOUT_MAX;
 
 	self->rx_msg = buf_new(self->mtu_rx);
 	if (self->rx_msg == NULL)
-		goto out_err;
+		return -1;
 
 	self->tx_msg = buf_new(self->mtu_tx_max);
 	if (self->tx_msg == NULL)
-		goto out_err;
-
-	return self;
+		return -1;
+	return obex_set_trace(self, 1);
+}
 
-out_err:
+static void obex_free(obex_t *self)
+{
 	if (self->tx_msg != NULL)
 		buf_free(self->tx_msg);
+	if (self->tx_next != NULL)
+		buf_free(self->tx_next);
 	if (self->rx_msg != NULL)
 		buf_free(self->rx_msg);
+	if (self->trace != NULL)
+		free(self->trace);
 	if (self->usb_dev)
 		libusb_close(self->usb_dev);
 	if (self->usb_ctx)
 		libusb_exit(self->usb_ctx);
 	free(self);
+}
+
+obex_t * obex_init(uint16_t vid, uint16_t pid)
+{
+	return obex_init_index(vid, pid, 0);
+}
+
+/* Each handle gets its own libusb context, so several devices can be
+ * driven from different threads at the same time. */
+obex_t * obex_init_index(uint16_t vid, uint16_t pid, int index)
+{
+	obex_t *self;
+	int size;
+	self = malloc(sizeof(obex_t));
+	if (self == NULL)
+		return NULL;
+	memset(self, 0, sizeof(obex_t));
+
+	if (libusb_init(&self->usb_ctx) < 0)
+		goto out_err;
+
+	self->usb_dev = obex_open_nth(self->usb_ctx, vid, pid, index);
+	if (self->usb_dev == NULL)
+		goto out_err;
+
+	if (obex_claim_interface(self) < 0)
+		goto out_err;
+
+	if (obex_setup(self, obex_usb_write, obex_usb_read, self) < 0)
+		goto out_err;
+
+	return self;
+
+out_err:
+	obex_free(self);
 	return NULL;
 }
 
-void obex_cleanup(obex_t *self)
+/* Use write/read instead of a USB device, e.g. for a device emulator.
+ * Pipelined PUT needs libusb's asynchronous API and falls back to
+ * stop-and-wait on such a transport. */
+obex_t * obex_init_transport(obex_bulk_cb write, obex_bulk_cb read, void *user_data)
 {
-	if (self) {
-		if (self->tx_msg)
-			buf_free(self->tx_msg);
+	obex_t *self;
+	self = malloc(sizeof(obex_t));
+	if (self == NULL)
+		return NULL;
+	memset(self, 0, sizeof(obex_t));
 
-		if (self->rx_msg)
-			buf_free(self->rx_msg);
+	if (obex_setup(self, write, read, user_data) < 0) {
+		obex_free(self);
+		return NULL;
+	}
+	return self;
+}
 
-		libusb_release_interface(self->usb_dev, self->intf_num);
-		libusb_close(self->usb_dev);
-		libusb_exit(self->usb_ctx);
-		free(self);
+void obex_cleanup(obex_t *self)
+{
+	if (self) {
+		if (self->usb_dev)
+			libusb_release_interface(self->usb_dev, self->intf_num);
+		obex_free(self);
 	}
 }
 
@@ -598,6 +962,50 @@ void obex_register_callback(obex_t *self, obex_callback cb, void *userdata)
 	self->cb_userdata = userdata;
 }
 
+/* Request a larger MTU on the next CMD_CONNECT.  The device's answer
+ * caps the transmit size; 0 restores the fixed legacy values. */
+void obex_set_mtu(obex_t *self, uint16_t mtu)
+{
+	if (mtu && mtu < OBEX_DEFAULT_MTU)
+		mtu = OBEX_DEFAULT_MTU;
+	self->mtu_req = mtu;
+}
+
+/* Pipelined PUT: the next packet is queued on the bulk-out endpoint while
+ * the response to the previous one is still being read.  Only enable this
+ * for devices that accept a packet before the previous response is read. */
+int obex_set_pipeline(obex_t *self, int enable)
+{
+	if (enable && self->tx_next == NULL) {
+		self->tx_next = buf_new(self->mtu_tx_max);
+		if (self->tx_next == NULL)
+			return -1;
+	}
+	self->pipeline = enable;
+	return 0;
+}
+
+/* Reads start with a timeout derived from the measured round trip time,
+ * kept between min_ms and max_ms; a response fails after max_ms without
+ * data.  request_ms bounds a whole request including all its packets,
+ * 0 disables that limit.  0 for min_ms or max_ms keeps the default. */
+void obex_set_timeouts(obex_t *self, unsigned int min_ms, unsigned int max_ms, unsigned int request_ms)
+{
+	self->timeout_min = min_ms ? min_ms : OBEX_TIMEOUT_MIN;
+	self->timeout_max = max_ms ? max_ms : OBEX_TIMEOUT_MAX;
+	if (self->timeout_max < self->timeout_min)
+		self->timeout_max = self->timeout_min;
+	self->request_timeout = request_ms;
+}
+
+/* Make the running request fail with LIBUSB_ERROR_INTERRUPTED within one
+ * read timeout.  The abort belongs to that request: with none running it
+ * does nothing.  Safe to call from any thread. */
+void obex_abort(obex_t *self)
+{
+	self->abort = self->active;
+}
+
 obex_object_t * obex_object_new(obex_t *self, uint8_t cmd)
 {
 	obex_object_t *object;
@@ -630,7 +1038,7 @@ obex_object_t * obex_object_new(obex_t *self, uint8_t cmd)
 			conn_hdr = (struct obex_connect_hdr *) buf_reserve_end(object->tx_nonhdr_data, 7);
 			conn_hdr->version = self->version;
 			conn_hdr->flags = 0x40;              /* Flags */
-			conn_hdr->mtu = htons(self->mtu_rx); /* Max packet size */
+			conn_hdr->mtu = htons(self->mtu_req ? self->mtu_req : self->mtu_rx); /* Max packet size */
 			memcpy(conn_hdr->unknown, "\x40\x00", 2); //unkown data sent during connect
 			conn_hdr->locale = self->locale;
 		}
@@ -690,6 +1098,28 @@ int obex_object_addheader(obex_t *self, obex_object_t *object, uint8_t hi,
 		return 1;
 	}
 
+	if (hi == OBEX_HDR_BODY && (flags & OBEX_FL_STREAM_START)) {
+		/* No data yet, hv_size bytes are pulled from object->tx_stream */
+		DEBUG(self, 2, "Stream body header size %d\n", hv_size);
+		if (object->tx_stream == NULL) {
+			free(element);
+			return -1;
+		}
+		element->length = hv_size;
+		list_add_tail(&element->link, &object->tx_headerq);
+		return 1;
+	}
+
+	if (hi == OBEX_HDR_BODY && (flags & OBEX_FL_BODY_REF)) {
+		/* Not copied; hv.bs must stay valid until obex_request returns */
+		DEBUG(self, 2, "Body reference size %d\n", hv_size);
+		element->data = hv.bs;
+		element->length = hv_size;
+		object->totallen += hv_size + sizeof(struct obex_byte_stream_hdr);
+		list_add_tail(&element->link, &object->tx_headerq);
+		return 1;
+	}
+
 	switch (hi & OBEX_HDR_TYPE_MASK) {
 	case OBEX_HDR_TYPE_UINT32:
 		DEBUG(self, 2, "4BQ header %d\n", hv.bq4);
@@ -814,16 +1244,230 @@ int obex_object_set_nonhdr_data(obex_object_t *object, const uint8_t *buffer, un
 	return 1;
 }
 
+void obex_object_set_tx_stream(obex_object_t *object, obex_stream_cb cb, void *userdata)
+{
+	object->tx_stream = cb;
+	object->tx_stream_data = userdata;
+}
+
+void obex_object_set_rx_stream(obex_object_t *object, obex_stream_cb cb, void *userdata)
+{
+	object->rx_stream = cb;
+	object->rx_stream_data = userdata;
+	object->rx_streamed = 0;
+}
+
+static void LIBUSB_CALL obex_write_done(struct libusb_transfer *transfer)
+{
+	*((int *)transfer->user_data) = 1;
+}
+
+/* Wait for a queued write and the device's sequence acknowledgement */
+static int obex_finish_write(obex_t *self, struct libusb_transfer *transfer, int *completed)
+{
+	struct obex_common_hdr *hdr = (struct obex_common_hdr *) transfer->buffer;
+	int64_t start = self->trace ? obex_now() : 0;
+	while (!*completed) {
+		if (libusb_handle_events_completed(self->usb_ctx, completed) < 0) {
+			libusb_cancel_transfer(transfer);
+			while (!*completed)
+				libusb_handle_events_completed(self->usb_ctx, completed);
+			return -1;
+		}
+	}
+	if (transfer->status == LIBUSB_TRANSFER_NO_DEVICE) {
+		self->gone = 1;
+		return LIBUSB_ERROR_NO_DEVICE;
+	}
+	if (transfer->status != LIBUSB_TRANSFER_COMPLETED)
+		return -1;
+	self->trace_cur.tx_bytes += transfer->actual_length;
+	self->trace_cur.packets++;
+	/* Only the time left after the response was read shows up here */
+	if (self->trace)
+		self->trace_cur.write += obex_now() - start;
+	/* The echo waited behind the previous response, so it is no round
+	 * trip sample */
+	return obex_verify_seq(self, hdr->seq, 0);
+}
+
+static int obex_request_pipelined(obex_t *self, obex_object_t *object)
+{
+	struct libusb_transfer *transfer;
+	buf_t *tmp;
+	int ret, rsp, finished, next_finished, completed, pending;
+
+	transfer = libusb_alloc_transfer(0);
+	if (transfer == NULL)
+		return -1;
+	finished = obex_object_send(self, object);
+	if (finished < 0) {
+		libusb_free_transfer(transfer);
+		return finished;
+	}
+	for (;;) {
+		pending = 0;
+		next_finished = 0;
+		ret = obex_expired(self);
+		if (ret < 0) {
+			rsp = ret;
+			break;
+		}
+		if (!finished) {
+			/* 前のパケットの応答を待つ間に次のパケットを送信します */
+			next_finished = obex_object_prepare(self, object, buf_reuse(self->tx_next));
+			if (next_finished >= 0) {
+				completed = 0;
+				libusb_fill_bulk_transfer(transfer, self->usb_dev, self->write_endpoint_address,
+							  self->tx_next->data, self->tx_next->data_size,
+							  obex_write_done, &completed, self->timeout_max);
+				if (libusb_submit_transfer(transfer) == 0)
+					pending = 1;
+				else
+					next_finished = -1;
+			}
+		}
+		rsp = obex_object_receive(self, object);
+		if (self->callback)
+			self->callback(self, object, self->cb_userdata);
+		if (!pending) {
+			if (next_finished < 0 && rsp >= 0)
+				rsp = -1;
+			if (rsp != OBEX_RSP_CONTINUE || next_finished < 0)
+				break;
+			/* CONTINUE after the final packet, resend like obex_request */
+			finished = obex_object_send(self, object);
+			if (finished < 0) {
+				rsp = finished;
+				break;
+			}
+			continue;
+		}
+		ret = obex_finish_write(self, transfer, &completed);
+		/* The packet just written is now the one awaiting a response */
+		tmp = self->tx_msg;
+		self->tx_msg = self->tx_next;
+		self->tx_next = tmp;
+		if (rsp != OBEX_RSP_CONTINUE) {
+			/* The device got one packet too many, drop its answer */
+			if (ret == 0)
+				obex_bulk_read(self, buf_reuse(self->rx_msg));
+			buf_reuse(self->rx_msg);
+			break;
+		}
+		if (ret < 0) {
+			rsp = ret;
+			break;
+		}
+		finished = next_finished;
+	}
+	libusb_free_transfer(transfer);
+	return rsp;
+}
+
+/* Store the finished request in the trace ring.  There is one writer, the
+ * thread running requests; obex_get_trace() may read concurrently. */
+static void obex_trace_push(obex_t *self, int rsp)
+{
+	struct obex_trace *cur = &self->trace_cur;
+	cur->total = obex_now() - cur->start;
+	cur->mtu = self->mtu_tx;
+	cur->rsp = rsp;
+	self->trace[self->trace_head & (OBEX_TRACE_SIZE - 1)] = *cur;
+	__atomic_store_n(&self->trace_head, self->trace_head + 1, __ATOMIC_RELEASE);
+}
+
+/* Start or stop recording requests; the ring is freed when stopped.  Must
+ * not be called while another thread uses self. */
+int obex_set_trace(obex_t *self, int enable)
+{
+	if (enable && self->trace == NULL) {
+		self->trace = calloc(OBEX_TRACE_SIZE, sizeof(struct obex_trace));
+		if (self->trace == NULL)
+			return -1;
+		self->trace_head = 0;
+	} else if (!enable && self->trace != NULL) {
+		free(self->trace);
+		self->trace = NULL;
+	}
+	return 0;
+}
+
+/* Copy up to max recorded requests, oldest first, starting with number
+ * *since; on return *since is the number of the first one copied.  Does
+ * not lock: entries the writer overwrote meanwhile are left out. */
+int obex_get_trace(obex_t *self, struct obex_trace *entries, int max, uint32_t *since)
+{
+	uint32_t head, first, end;
+	int i, n;
+	if (self->trace == NULL || max <= 0)
+		return 0;
+	head = __atomic_load_n(&self->trace_head, __ATOMIC_ACQUIRE);
+	first = *since;
+	if ((int32_t) (head - first) < 0)
+		first = head;
+	if (head - first > OBEX_TRACE_SIZE)
+		first = head - OBEX_TRACE_SIZE;
+	n = head - first;
+	if (n > max)
+		n = max;
+	for (i = 0; i < n; i++)
+		entries[i] = self->trace[(first + i) & (OBEX_TRACE_SIZE - 1)];
+	/* Slots the writer reached while copying may be torn */
+	end = __atomic_load_n(&self->trace_head, __ATOMIC_ACQUIRE);
+	if (end - first >= OBEX_TRACE_SIZE) {
+		i = end - first - OBEX_TRACE_SIZE + 1;
+		if (i > n)
+			i = n;
+		memmove(entries, entries + i, (n - i) * sizeof(*entries));
+		n -= i;
+		first += i;
+	}
+	*since = first;
+	return n;
+}
+
 int obex_request(obex_t *self, obex_object_t *object)
 {
 	int ret, rsp;
+	if (self->gone)
+		return LIBUSB_ERROR_NO_DEVICE;
+	if (self->stale)
+		obex_drain(self);
+	memset(&self->trace_cur, 0, sizeof(self->trace_cur));
+	if (self->trace) {
+		self->trace_cur.start = obex_now();
+		self->trace_cur.opcode = object->cmd;
+		self->trace_cur.tag = self->trace_tag;
+	}
+	self->deadline = 0;
+	if (self->request_timeout)
+		self->deadline = obex_now() + (int64_t) self->request_timeout * 1000;
+	if (++self->requests == 0)
+		self->requests = 1;
+	self->active = self->requests;
+	if (self->pipeline && self->usb_dev && object->cmd == OBEX_CMD_PUT) {
+		rsp = obex_request_pipelined(self, object);
+		goto out;
+	}
 	do {
-		ret = obex_object_send(self, object);
-		if (ret < 0)
-			return ret;
+		ret = obex_expired(self);
+		if (ret == 0)
+			ret = obex_object_send(self, object);
+		if (ret < 0) {
+			rsp = ret;
+			goto out;
+		}
 		rsp = obex_object_receive(self, object);
 		if (self->callback)
 			self->callback(self, object, self->cb_userdata);
 	} while (rsp == OBEX_RSP_CONTINUE);
+out:
+	self->active = 0;
+	/* The device may still answer the request we gave up on */
+	if ((rsp == LIBUSB_ERROR_TIMEOUT || rsp == LIBUSB_ERROR_INTERRUPTED) && self->trace_cur.packets)
+		self->stale = 1;
+	if (self->trace)
+		obex_trace_push(self, rsp);
 	return rsp;
 }
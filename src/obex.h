@@ -50,6 +50,8 @@
 #define OBEX_VERSION		0x11
 
 #define OBEX_FL_FIT_ONE_PACKET	0x01	/* このヘッダは1パケットに収まる必要があります */
+#define OBEX_FL_STREAM_START	0x02	/* Body data is pulled from the object's tx stream */
+#define OBEX_FL_BODY_REF	0x04	/* Body data stays in the caller's buffer until sent */
 
 #define OBEX_HDR_TYPE_UNICODE	(0 << 6)  /* zero terminated unicode string (network byte order) */
 #define OBEX_HDR_TYPE_BYTES	(1 << 6)  /* byte array */
@@ -152,9 +154,49 @@
 #define OBEX_MINIMUM_MTU	255
 #define OBEX_MAXIMUM_MTU	65535
 
+/* Bounds of the adaptive read timeout in ms.  Until a round trip has been
+ * measured the maximum is used. */
+#define OBEX_TIMEOUT_MIN	100
+#define OBEX_TIMEOUT_MAX	800
+/* A response that has not started after OBEX_GIVEUP_RTT smoothed round
+ * trips (srtt + 4 * rttvar) fails; never before OBEX_GIVEUP_MIN ms or the
+ * first read timeout, never later than the maximum above. */
+#define OBEX_GIVEUP_RTT		16
+#define OBEX_GIVEUP_MIN		300
+
 struct _obex_object;
 struct _obex;
 typedef void (*obex_callback)(struct _obex *, struct _obex_object *, void *);
+/* Stream callback.
+ * tx: fill up to len bytes of buffer, return the number of bytes written,
+ *     0 at end of data or < 0 on error.
+ * rx: consume len bytes of buffer, return < 0 on error. */
+typedef int (*obex_stream_cb)(struct _obex_object *, uint8_t *buffer, unsigned int len, void *);
+
+/* Bulk transfer used by obex_bulk_read / obex_bulk_write.
+ * Moves up to len bytes and stores the count in *actual.  Returns 0 or a
+ * negative LIBUSB_ERROR code (LIBUSB_ERROR_TIMEOUT if nothing arrived). */
+typedef int (*obex_bulk_cb)(uint8_t *data, int len, int *actual, unsigned int timeout, void *user_data);
+
+/* Number of requests kept by the trace ring, a power of two */
+#define OBEX_TRACE_SIZE		256
+
+/* One request in the trace ring; times in microseconds */
+struct obex_trace {
+	int64_t start;
+	int64_t write;
+	int64_t seq;
+	int64_t read;
+	int64_t total;
+	uint32_t tx_bytes;
+	uint32_t rx_bytes;
+	uint16_t mtu;
+	uint16_t packets;
+	uint16_t retries;
+	uint8_t opcode;
+	uint8_t tag;
+	int rsp;
+};
 
 typedef union {
 	uint32_t bq4;
@@ -168,18 +210,39 @@ typedef struct _obex {
 	uint8_t intf_num;
 	uint8_t read_endpoint_address;
 	uint8_t write_endpoint_address;
+	obex_bulk_cb bulk_write;		/* Transport, libusb bulk endpoints by default */
+	obex_bulk_cb bulk_read;
+	void *bulk_data;
 	uint8_t version;
 	uint8_t locale;
 	uint16_t mtu_rx;
 	uint16_t mtu_tx;
 	uint16_t mtu_tx_max;
+	uint16_t mtu_req;		/* Requested MTU, 0 = legacy fixed values */
+	int pipeline;			/* Queue next PUT packet before reading response */
 	buf_t *tx_msg;
+	buf_t *tx_next;			/* Second tx buffer used while pipelining */
 	buf_t *rx_msg;
 	int debug;
 	uint8_t seq_num;
 	int16_t seq_check;
 	obex_callback callback;
 	void * cb_userdata;
+	unsigned int timeout_min;	/* Adaptive read timeout bounds (ms) */
+	unsigned int timeout_max;	/* Also the longest wait for a response to start */
+	unsigned int request_timeout;	/* Deadline for a whole request (ms), 0 = none */
+	int64_t srtt;			/* Smoothed round trip time (us), 0 = not measured */
+	int64_t rttvar;			/* Round trip time variation (us) */
+	int64_t deadline;		/* End of the current request (us), 0 = none */
+	uint32_t requests;		/* Requests started so far */
+	volatile uint32_t active;	/* Number of the request in flight, 0 = none */
+	volatile uint32_t abort;	/* Request obex_abort() was called during */
+	int gone;			/* Device disconnected, every request fails */
+	int stale;			/* A late response may still be pending */
+	struct obex_trace *trace;	/* Ring of OBEX_TRACE_SIZE requests, NULL = off */
+	uint32_t trace_head;		/* Requests recorded so far */
+	struct obex_trace trace_cur;	/* Request being recorded */
+	uint8_t trace_tag;		/* Copied into the next recorded request */
 } obex_t;
 
 #pragma pack(1)
@@ -233,6 +296,7 @@ struct obex_unicode_hdr {
 
 struct obex_header_element {
 	buf_t *buf;
+	const uint8_t *data;		/* Caller's body data (OBEX_FL_BODY_REF) */
 	uint8_t hi;
 	unsigned int flags;
 	unsigned int length;
@@ -268,12 +332,26 @@ typedef struct _obex_object {
 
 	int continue_received;		/* CONTINUE received after sending last command */
 
+	obex_stream_cb tx_stream;	/* Source of streamed body data */
+	void *tx_stream_data;
+	obex_stream_cb rx_stream;	/* Sink for received body data */
+	void *rx_stream_data;
+	uint32_t rx_streamed;		/* Body bytes handed to rx_stream so far */
+
 } obex_object_t;
 
 obex_t * obex_init(uint16_t vid, uint16_t pid);
+obex_t * obex_init_index(uint16_t vid, uint16_t pid, int index);
+obex_t * obex_init_transport(obex_bulk_cb write, obex_bulk_cb read, void *user_data);
 void obex_cleanup(obex_t *self);
 void obex_set_connect_info(obex_t *self, uint8_t ver, uint8_t locale);
 void obex_register_callback(obex_t *self, obex_callback cb, void * userdata);
+void obex_set_mtu(obex_t *self, uint16_t mtu);
+int obex_set_pipeline(obex_t *self, int enable);
+void obex_set_timeouts(obex_t *self, unsigned int min_ms, unsigned int max_ms, unsigned int request_ms);
+void obex_abort(obex_t *self);
+int obex_set_trace(obex_t *self, int enable);
+int obex_get_trace(obex_t *self, struct obex_trace *entries, int max, uint32_t *since);
 obex_object_t * obex_object_new(obex_t *self, uint8_t cmd);
 int obex_object_delete(obex_t *self, obex_object_t *object);
 int obex_object_add_header(obex_t *self, obex_object_t *object,
@@ -282,6 +360,8 @@ int obex_object_add_header(obex_t *self, obex_object_t *object,
 int obex_object_getnextheader(obex_t *self, obex_object_t *object,
 			      uint8_t *hi, obex_headerdata_t *hv, uint32_t *hv_size);
 int obex_object_set_nonhdr_data(obex_object_t *object, const uint8_t *buffer, unsigned int len);
+void obex_object_set_tx_stream(obex_object_t *object, obex_stream_cb cb, void *userdata);
+void obex_object_set_rx_stream(obex_object_t *object, obex_stream_cb cb, void *userdata);
 int obex_request(obex_t *self, obex_object_t *object);
 
 #endif